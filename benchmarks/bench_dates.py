@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of the episode date parser.
+
+Checks that the fast path of `DateTimeParser.parse` gives the same results
+as the dateutil parser on the corpus of date strings, then times both.
+
+    PYTHONPATH=. python benchmarks/bench_dates.py [corpus] [--repeat N]
+
+The default corpus, data/dates.txt, is synthetic (see its header). Pass a
+file of date strings recorded from episode pages to check real data.
+"""
+
+import argparse
+import os
+import timeit
+
+from rrc_rss.rrc import DateTimeParser
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "data", "dates.txt")
+
+
+def read_corpus(filename):
+    with open(filename, "r", encoding="utf8") as f:
+        return [
+            line.rstrip("\n")
+            for line in f
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def check(corpus):
+    """
+    Compare the fast parser against the dateutil parser, return the mismatches
+    """
+    mismatches = []
+    for datestr in corpus:
+        expected = DateTimeParser.parse_dateutil(datestr)
+        result = DateTimeParser.parse.__wrapped__(datestr)
+        if result != expected:
+            mismatches.append((datestr, expected, result))
+    return mismatches
+
+
+def bench(corpus, repeat):
+    def run(parse):
+        for datestr in corpus:
+            parse(datestr)
+
+    def cached():
+        DateTimeParser.parse.cache_clear()
+        run(DateTimeParser.parse)
+
+    timings = {
+        "dateutil": lambda: run(DateTimeParser.parse_dateutil),
+        "fast (uncached)": lambda: run(DateTimeParser.parse.__wrapped__),
+        "fast (cached, cold)": cached,
+        "fast (cached, warm)": lambda: run(DateTimeParser.parse),
+    }
+    results = {}
+    for name, func in timings.items():
+        results[name] = min(
+            timeit.repeat(func, number=1, repeat=repeat)
+        ) / len(corpus)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the episode date parser"
+    )
+    parser.add_argument(
+        "corpus",
+        nargs="?",
+        default=DEFAULT_CORPUS,
+        help="File with one date string per line",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20, help="Number of timing repeats"
+    )
+    args = parser.parse_args()
+
+    corpus = read_corpus(args.corpus)
+    mismatches = check(corpus)
+    for datestr, expected, result in mismatches:
+        print(f"MISMATCH {datestr!r}: dateutil {expected}, fast {result}")
+    print(f"{len(corpus) - len(mismatches)} of {len(corpus)} dates match")
+
+    results = bench(corpus, args.repeat)
+    baseline = results["dateutil"]
+    for name, seconds in results.items():
+        print(
+            f"{name:22s} {seconds * 1e6:8.2f} us/date  "
+            f"{baseline / seconds:6.1f}x"
+        )
+
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
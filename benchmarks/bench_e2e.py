@@ -0,0 +1,273 @@
+"""
+End-to-end benchmark of the crawl, pipeline and feed rendering, offline.
+
+Runs `cli.main` on a synthetic archive (see `rrc_rss.replay.SyntheticArchive`)
+of the given total number of episodes, in a fresh process and cache directory
+for each size, and reports:
+
+- pages/s and items/s of the crawl
+- time spent in CreatePodcastPipeline (open_spider, process_item, publish)
+- time to render all the feeds
+- peak RSS of the process
+
+    PYTHONPATH=. python benchmarks/bench_e2e.py [--episodes 10 1000 100000]
+        [--per-show 100] [--profile NAME ...] [--latency S] [--json FILE]
+
+With --profile, each size is run with each crawl profile of config/config.yml,
+to compare their throughput. Replayed pages go through the Scrapy downloader,
+so the concurrency, delays and AutoThrottle of the profiles apply. Use
+--latency to simulate the response time of the site, e.g. --latency 0.3.
+"""
+
+import argparse
+import functools
+import inspect
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# Episodes per show page on the synthetic site
+PAGE_SIZE = 20
+
+
+def timed(cls, name, stats):
+    """
+    Wrap a method to accumulate its run time and number of calls in `stats`
+    """
+    method = getattr(cls, name)
+
+    def record(start):
+        stats[name + "_time"] = (
+            stats.get(name + "_time", 0) + time.perf_counter() - start
+        )
+        stats[name + "_calls"] = stats.get(name + "_calls", 0) + 1
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            record(start)
+
+    @functools.wraps(method)
+    async def async_wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            record(start)
+
+    setattr(
+        cls,
+        name,
+        async_wrapper if inspect.iscoroutinefunction(method) else wrapper,
+    )
+
+
+def run_one(episodes, per_show, profile=None, latency=0):
+    """
+    Run one benchmark in this process, return the results
+    """
+    from rrc_rss import cli
+    from rrc_rss.metrics import metrics
+    import rrc_rss.config
+    from rrc_rss.pipelines import CreatePodcastPipeline
+    from rrc_rss.replay import SyntheticArchive, ReplayDownloadHandler
+    from rrc_rss.storage import create_storage
+    from rrc_rss.upload import PodcastsUploader
+
+    shows = max(1, episodes // per_show)
+    archive = SyntheticArchive(
+        shows=shows, episodes=min(episodes, per_show), page_size=PAGE_SIZE
+    )
+
+    stats = {}
+    for name in ("open_spider", "process_item", "publish"):
+        timed(CreatePodcastPipeline, name, stats)
+    timed(ReplayDownloadHandler, "download_request", stats)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = os.path.join(tmpdir, "data")
+        config_file = os.path.join(tmpdir, "config.yml")
+        with open(config_file, "w") as f:
+            json.dump(
+                {
+                    "shows": {
+                        "showlists": [archive.showlist_url],
+                        "shows": [],
+                        "combos": [],
+                    },
+                    "crawl": {"profiles": profiles()},
+                    "cache": {
+                        "enabled": True,
+                        "dir": data,
+                        "file_shows": os.path.join(data, "shows.json"),
+                        "file_podcasts": os.path.join(data, "podcasts.pkl"),
+                        "file_hashes": os.path.join(data, "hashes.pkl"),
+                        "file_fingerprints": os.path.join(
+                            data, "fingerprints.pkl"
+                        ),
+                        "file_seen": os.path.join(data, "seen.bin"),
+                    },
+                },
+                f,
+            )
+        os.makedirs(data)
+
+        start = time.perf_counter()
+        cli.main(
+            ["crawl", "-c", config_file]
+            + (["--profile", profile] if profile else []),
+            settings={"REPLAY_ARCHIVE": archive, "REPLAY_LATENCY": latency},
+        )
+        crawl_time = time.perf_counter() - start
+
+        # Render all the feeds from the cache, as for an upload
+        storage = create_storage(rrc_rss.config.config.cache)
+        storage.open()
+        podcasts = list(storage.iter_podcasts())
+        start = time.perf_counter()
+        PodcastsUploader(podcasts=podcasts).feeds()
+        render_time = time.perf_counter() - start
+        storage.close()
+
+    pages = stats.get("download_request_calls", 0)
+    items = stats.get("process_item_calls", 0)
+    return {
+        "profile": profile or "default",
+        "latency": latency,
+        "episodes": shows * archive.episodes,
+        "shows": shows,
+        "pages": pages,
+        "items": items,
+        "crawl_time": crawl_time,
+        "pages_per_second": pages / crawl_time,
+        "fetch_pages_per_second": metrics.gauges.get(
+            "crawl_pages_per_second", 0
+        ),
+        "items_per_second": items / crawl_time,
+        "pipeline_time": sum(
+            stats.get(name + "_time", 0)
+            for name in ("open_spider", "process_item", "publish")
+        ),
+        "render_time": render_time,
+        "feeds": len(podcasts),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / 1024,
+    }
+
+
+def profiles():
+    """
+    The crawl profiles of the default configuration file
+    """
+    from omegaconf import OmegaConf
+    import rrc_rss.config
+
+    config_file = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "config",
+        "config.yml",
+    )
+    return OmegaConf.to_container(
+        rrc_rss.config.load_config(config_file).crawl.profiles
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end benchmark on synthetic archives"
+    )
+    parser.add_argument(
+        "--episodes",
+        type=int,
+        nargs="+",
+        default=[10, 1000, 100000],
+        help="Total episodes, one run each",
+    )
+    parser.add_argument(
+        "--per-show", type=int, default=100, help="Episodes per show"
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="+",
+        default=[None],
+        help="Crawl profiles, one run each",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0,
+        help="Simulated server response time per page, in seconds",
+    )
+    parser.add_argument(
+        "--json", type=str, help="Also write the results to this JSON file"
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(
+            json.dumps(
+                run_one(
+                    args.episodes[0],
+                    args.per_show,
+                    args.profile[0],
+                    args.latency,
+                )
+            )
+        )
+        return 0
+
+    # Each size runs in its own process, since the Twisted reactor can only
+    # be started once, and for an honest peak RSS
+    results = []
+    for profile in args.profile:
+        for episodes in args.episodes:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--child",
+                    "--episodes",
+                    str(episodes),
+                    "--per-show",
+                    str(args.per_show),
+                    "--latency",
+                    str(args.latency),
+                ]
+                + (["--profile", profile] if profile else []),
+                check=True,
+                stdout=subprocess.PIPE,
+                text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(
+        f"{'profile':>20} {'episodes':>9} {'pages':>7} {'pages/s':>8} "
+        f"{'items/s':>8} {'fetch/s':>8} {'crawl s':>8} "
+        f"{'pipeline s':>10} {'render s':>9} {'peak MB':>8}"
+    )
+    for r in results:
+        print(
+            f"{r['profile']:>20} {r['episodes']:9d} {r['pages']:7d} "
+            f"{r['pages_per_second']:8.0f} {r['items_per_second']:8.0f} "
+            f"{r['fetch_pages_per_second']:8.0f} {r['crawl_time']:8.2f} "
+            f"{r['pipeline_time']:10.2f} {r['render_time']:9.2f} "
+            f"{r['peak_rss_mb']:8.0f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
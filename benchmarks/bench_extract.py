@@ -0,0 +1,153 @@
+"""
+Benchmark of the page extraction layer.
+
+Extracts the fields of show and episode pages with the precompiled XPath
+expressions in `rrc_rss.extract`, and with the `response.css()` calls used
+before, checks that both give the same fields and compares their CPU time per
+page. Both paths include parsing the page.
+
+Pages are read from a directory of `show-*.html` and `episode-*.html` files.
+The pages of `data/pages` are synthetic: one-line markup with the classes the
+spiders select, not pages saved from the site. They check that both paths
+agree, but real pages are larger: save some from the site to a directory to
+measure the time per page.
+
+    PYTHONPATH=. python benchmarks/bench_extract.py [pages_dir] [--number N]
+"""
+
+import argparse
+import glob
+import os
+import time
+
+from scrapy.http import HtmlResponse
+
+from rrc_rss.extract import ShowPage, EpisodePage
+
+DEFAULT_PAGES = os.path.join(os.path.dirname(__file__), "data", "pages")
+
+
+def selector_show(response):
+    return {
+        "title": response.css("h1.cat-header__title::text").get(default=""),
+        "author": response.css(
+            "span.cat-header__descriere__realizator::text"
+        ).get(default=""),
+        "program": response.css(
+            "span.cat-header__descriere__program strong::text"
+        ).get(default=""),
+        "description": response.css("p.cat-header__descriere::text").get(
+            default=""
+        ),
+        "episode_urls": response.css(
+            "div.news-item.news-item--with-audio a.link::attr(href)"
+        ).getall(),
+        "next_page": response.css(
+            'a[rel="next"]::attr(href), ul.pagination li.next a::attr(href)'
+        ).get(),
+    }
+
+
+def selector_episode(response):
+    audio_elem = response.css("source").attrib
+    return {
+        "title": response.css("article.articol h1::text").get(default=""),
+        "date": response.css("p.articol__autor-data::text").get(default=""),
+        "description": "\n".join(
+            response.css("#__content p").xpath("string(.)").getall()
+        ),
+        "audio_url": audio_elem.get("src"),
+        "audio_type": audio_elem.get("type"),
+    }
+
+
+def xpath_show(response):
+    return ShowPage.extract(response.selector.root)
+
+
+def xpath_episode(response):
+    return EpisodePage.extract(response.selector.root)
+
+
+EXTRACTORS = {
+    "show": (selector_show, xpath_show),
+    "episode": (selector_episode, xpath_episode),
+}
+
+
+def read_pages(directory):
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        kind = os.path.basename(filename).split("-")[0]
+        if kind in EXTRACTORS:
+            with open(filename, "rb") as f:
+                pages.append((filename, kind, f.read()))
+    return pages
+
+
+def response(filename, body):
+    return HtmlResponse(
+        url="https://www.radioromaniacultural.ro/"
+        + os.path.basename(filename),
+        body=body,
+        encoding="utf-8",
+    )
+
+
+def cpu_time(extract, filename, body, number):
+    """
+    CPU time per page, parsing the page from a fresh response each time
+    """
+    start = time.process_time()
+    for _ in range(number):
+        extract(response(filename, body))
+    return (time.process_time() - start) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the page extraction layer"
+    )
+    parser.add_argument(
+        "pages",
+        nargs="?",
+        default=DEFAULT_PAGES,
+        help="Directory with saved pages",
+    )
+    parser.add_argument(
+        "--number",
+        type=int,
+        default=500,
+        help="Number of extractions per page",
+    )
+    args = parser.parse_args()
+
+    pages = read_pages(args.pages)
+    mismatches = 0
+    for filename, kind, body in pages:
+        selector, xpath = EXTRACTORS[kind]
+        expected = selector(response(filename, body))
+        result = xpath(response(filename, body))
+        if result != expected:
+            mismatches += 1
+            print(
+                f"MISMATCH {filename}:\n"
+                f"  selector {expected}\n"
+                f"  xpath    {result}"
+            )
+
+        selector_time = cpu_time(selector, filename, body, args.number)
+        xpath_time = cpu_time(xpath, filename, body, args.number)
+        print(
+            f"{os.path.basename(filename):30s} "
+            f"selector {selector_time * 1e6:8.1f} us  "
+            f"xpath {xpath_time * 1e6:8.1f} us  "
+            f"{selector_time / xpath_time:5.2f}x"
+        )
+
+    print(f"{len(pages) - mismatches} of {len(pages)} pages match")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,130 @@
+"""
+Start-up benchmark of the command line: time to import and run each command
+up to its first real work, and the heavy libraries it loads.
+
+Each command runs in a fresh interpreter, several times, on a configuration
+with the cache disabled and no shows, so that no command crawls, renders
+or uploads anything. Reports the best wall time of each command and which
+of Scrapy, Twisted, podgen, lxml and the upload backends it imported.
+
+    python benchmarks/bench_import.py [--repeat 5] [--json FILE]
+
+Run `python -X importtime -m rrc_rss <command>` for the detail of a command.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = (
+    "scrapy",
+    "twisted",
+    "podgen",
+    "lxml",
+    "dropbox",
+    "requests",
+    "omegaconf",
+)
+
+COMMANDS = {
+    "help": ["--help"],
+    "check-config": ["check-config"],
+    "render": ["render"],
+    "upload": ["upload"],
+    "crawl": ["crawl"],
+}
+
+# Runs a command, then prints the heavy modules it imported
+CHILD = """
+import sys
+from rrc_rss.cli import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+print('MODULES', ' '.join(m for m in {modules!r} if m in sys.modules))
+"""
+
+
+def python_startup():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def run_command(argv, cwd):
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    for name in ("DROPBOX_ACCESS_TOKEN", "DROPBOX_REFRESH_TOKEN"):
+        env.pop(name, None)
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(modules=HEAVY_MODULES)] + argv,
+        cwd=cwd,
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    ).stdout
+    elapsed = time.perf_counter() - start
+    modules = output.strip().splitlines()[-1].split()[1:]
+    return elapsed, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Start-up time of each command"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Runs of each command, the best one is reported",
+    )
+    parser.add_argument(
+        "--json", type=str, help="Also write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_file = os.path.join(tmpdir, "config.yml")
+        with open(config_file, "w") as f:
+            json.dump({"cache": {"enabled": False}}, f)
+
+        # Baseline: the interpreter alone
+        baseline = min(python_startup() for _ in range(args.repeat))
+
+        results = [{"command": "python", "seconds": baseline, "modules": []}]
+        for command, argv in COMMANDS.items():
+            if command != "help":
+                argv = argv + ["-c", config_file]
+            runs = [run_command(argv, tmpdir) for _ in range(args.repeat)]
+            results.append(
+                {
+                    "command": command,
+                    "seconds": min(elapsed for elapsed, _ in runs),
+                    "modules": runs[0][1],
+                }
+            )
+
+    print(f"{'command':>13} {'seconds':>8}  heavy modules")
+    for r in results:
+        print(
+            f"{r['command']:>13} {r['seconds']:8.3f}  {' '.join(r['modules'])}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
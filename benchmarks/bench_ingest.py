@@ -0,0 +1,179 @@
+"""
+Benchmark of the episode ingest of CreatePodcastPipeline: time to process a
+batch of new episodes, as the number of episodes already in the storage grows.
+
+For each archive size, a fresh storage is filled with shows of `--per-show`
+episodes, with a combo podcast including every show, then a batch of new
+episodes (and as many duplicates) is sent through `process_item`. With the
+episode index, the time per item stays flat as the archive grows, where the
+duplicate scans it replaced were linear in the size of each podcast.
+
+    PYTHONPATH=. python benchmarks/bench_ingest.py
+        [--episodes 1000 10000 100000] [--per-show 1000] [--batch 1000]
+        [--backend pickle] [--json FILE]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from omegaconf import OmegaConf
+
+import rrc_rss.config
+from rrc_rss.pipelines import (
+    CreatePodcastPipeline,
+    ShowDescriptionItem,
+    EpisodeItem,
+)
+
+START = datetime(2010, 1, 1, tzinfo=timezone.utc)
+
+
+def show_item(show):
+    return ShowDescriptionItem(
+        title=show,
+        author="Autor",
+        program="Program",
+        description="Descriere",
+        category="Emisiuni",
+        website=f"https://rrc.invalid/{show}",
+    )
+
+
+def episode_item(show, number):
+    return EpisodeItem(
+        show_name=show,
+        title=f"Episodul {number} din {show}",
+        date=START + timedelta(hours=number),
+        audio_url=f"https://rrc.invalid/audio/{show}/{number}.mp3",
+        audio_type="audio/mpeg",
+        description=f"Descrierea episodului {number}",
+        url=f"https://rrc.invalid/{show}/{number}",
+    )
+
+
+def run_one(episodes, per_show, batch, backend, tmpdir):
+    """
+    Fill a storage with `episodes` episodes, then time a batch of new and
+    duplicate episodes
+    """
+    shows = [f"Show {s}" for s in range(max(1, episodes // per_show))]
+    rrc_rss.config.config = OmegaConf.merge(
+        OmegaConf.create(rrc_rss.config.config_defaults),
+        {
+            "shows": {
+                "combos": [
+                    {
+                        "name": "Combo",
+                        "urls": [
+                            f"https://rrc.invalid/{show}" for show in shows
+                        ],
+                    }
+                ]
+            },
+            "cache": {
+                "enabled": True,
+                "backend": backend,
+                "file_podcasts": os.path.join(
+                    tmpdir, f"podcasts-{episodes}.pkl"
+                ),
+                "file_db": os.path.join(tmpdir, f"podcasts-{episodes}.db"),
+            },
+        },
+    )
+    pipeline = CreatePodcastPipeline()
+    spider = SimpleNamespace(do_cache=True)
+    pipeline.open_spider(spider)
+
+    for show in shows:
+        pipeline.process_item(show_item(show), spider)
+    for number in range(per_show):
+        for show in shows:
+            pipeline.process_item(episode_item(show, number), spider)
+
+    # New episodes, spread over the shows, then the same ones again as
+    # duplicates
+    items = [
+        episode_item(shows[i % len(shows)], per_show + i // len(shows))
+        for i in range(batch)
+    ]
+    start = time.perf_counter()
+    for item in items:
+        pipeline.process_item(item, spider)
+    new_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for item in items:
+        pipeline.process_item(item, spider)
+    duplicate_time = time.perf_counter() - start
+    pipeline.storage.close()
+
+    return {
+        "backend": backend,
+        "episodes": len(shows) * per_show,
+        "combo_episodes": len(shows) * per_show,
+        "batch": batch,
+        "new_us_per_item": new_time / batch * 1e6,
+        "duplicate_us_per_item": duplicate_time / batch * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ingest time per episode as the archive grows"
+    )
+    parser.add_argument(
+        "--episodes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000],
+        help="Episodes already stored, one run each",
+    )
+    parser.add_argument(
+        "--per-show", type=int, default=1000, help="Episodes per show"
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1000,
+        help="New episodes processed in each run",
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="pickle",
+        choices=["pickle", "sqlite"],
+        help="Storage backend",
+    )
+    parser.add_argument(
+        "--json", type=str, help="Also write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = [
+            run_one(episodes, args.per_show, args.batch, args.backend, tmpdir)
+            for episodes in args.episodes
+        ]
+
+    print(
+        f"{'backend':>8} {'episodes':>9} {'combo':>9} "
+        f"{'new us/item':>12} {'dup us/item':>12}"
+    )
+    for r in results:
+        print(
+            f"{r['backend']:>8} {r['episodes']:9d} {r['combo_episodes']:9d} "
+            f"{r['new_us_per_item']:12.1f} {r['duplicate_us_per_item']:12.1f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,182 @@
+"""
+Benchmark of the pickle cache: memory and pickle size of the episode
+records (see `rrc_rss.storage.PickleStorage`) against podgen objects, as
+cached before.
+
+Builds a synthetic archive of shows and combos, once as podgen Podcasts
+with a podgen Episode per show and per combo episode, and once in a
+PickleStorage, where combos share the records of their shows. Reports the
+memory held by each (with tracemalloc) when built during a crawl and when
+loaded from the cache, the pickle size and the load time.
+
+    PYTHONPATH=. python benchmarks/bench_records.py [--shows 200]
+        [--episodes 500] [--combos 5] [--json FILE]
+"""
+
+import argparse
+import gc
+import json
+import pickle
+import time
+import tracemalloc
+import warnings
+from datetime import datetime, timedelta, timezone
+
+from podgen import Podcast, Episode, Media
+
+from rrc_rss.storage import PickleStorage, combo_episode_title
+
+
+def archive(shows, episodes, combos):
+    """
+    Yield the (podcast name, show name, title, audio_url, audio_type,
+    summary, date) of each episode, for the shows, then the combos
+    """
+    start = datetime(2010, 1, 1, tzinfo=timezone.utc)
+    summary = (
+        "Descrierea emisiunii, cu invitații și subiectele discutate. " * 8
+    )
+    combo_shows = {
+        f"Combo {c}": [f"Show {s}" for s in range(c, shows, combos)]
+        for c in range(combos)
+    }
+
+    def show_episodes(show):
+        for e in range(episodes):
+            yield (
+                f"Episodul {e} din {show}",
+                f"https://rrc.invalid/audio/{show}/{e}.mp3",
+                "audio/mpeg",
+                f"{summary}{show} {e}",
+                start + timedelta(days=e),
+            )
+
+    for s in range(shows):
+        show = f"Show {s}"
+        for episode in show_episodes(show):
+            yield (show, None) + episode
+    for combo, members in combo_shows.items():
+        for show in members:
+            for title, *fields in show_episodes(show):
+                yield (combo, show, title, *fields)
+
+
+def build_podgen(shows, episodes, combos):
+    podcasts = {}
+    for name, show, title, audio_url, audio_type, summary, date in archive(
+        shows, episodes, combos
+    ):
+        if name not in podcasts:
+            podcasts[name] = Podcast(
+                name=name,
+                description="Description",
+                website=f"https://rrc.invalid/{name}",
+                explicit=False,
+            )
+        podcasts[name].add_episode(
+            Episode(
+                title=combo_episode_title(show, title) if show else title,
+                media=Media(audio_url, type=audio_type),
+                summary=summary,
+                publication_date=date,
+            )
+        )
+    return podcasts
+
+
+def build_records(shows, episodes, combos):
+    storage = PickleStorage()
+    for name, show, title, audio_url, audio_type, summary, date in archive(
+        shows, episodes, combos
+    ):
+        if name not in storage:
+            storage.update_podcast(
+                name, "Description", f"https://rrc.invalid/{name}", False
+            )
+        if show:
+            storage.add_combo_episode(
+                name, show, title, audio_url, audio_type, summary, date
+            )
+        else:
+            storage.add_episode(
+                name, title, audio_url, audio_type, summary, date
+            )
+    return storage.podcasts
+
+
+def measure(build, args):
+    gc.collect()
+    tracemalloc.start()
+    podcasts = build(args.shows, args.episodes, args.combos)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    data = pickle.dumps(podcasts, protocol=pickle.HIGHEST_PROTOCOL)
+    del podcasts
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    loaded = pickle.loads(data)
+    load_time = time.perf_counter() - start
+    loaded_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        "podcasts": len(loaded),
+        "memory_mb": memory / 2**20,
+        "loaded_mb": loaded_memory / 2**20,
+        "pickle_mb": len(data) / 2**20,
+        "load_time": load_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory and pickle size of the cached episodes"
+    )
+    parser.add_argument(
+        "--shows", type=int, default=200, help="Number of shows"
+    )
+    parser.add_argument(
+        "--episodes", type=int, default=500, help="Episodes per show"
+    )
+    parser.add_argument(
+        "--combos",
+        type=int,
+        default=5,
+        help="Combos, each with 1/combos of the shows",
+    )
+    parser.add_argument(
+        "--json", type=str, help="Also write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # podgen warns about the missing media sizes
+    warnings.simplefilter("ignore")
+
+    results = {
+        "podgen": measure(build_podgen, args),
+        "records": measure(build_records, args),
+    }
+    print(
+        f"{args.shows} shows of {args.episodes} episodes, "
+        f"in {args.combos} combos"
+    )
+    print(
+        f"{'':>8} {'memory MB':>10} {'loaded MB':>10} "
+        f"{'pickle MB':>10} {'load s':>8}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:>8} {r['memory_mb']:10.1f} {r['loaded_mb']:10.1f} "
+            f"{r['pickle_mb']:10.1f} {r['load_time']:8.2f}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -3,4 +3,4 @@
 from rrc_rss.cli import main  # pragma: no cover
 
 if __name__ == "__main__":  # pragma: no cover
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+import os
+import pickle
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+@contextmanager
+def atomic_write(filename, mode="wb"):
+    """
+    Open a temporary file next to `filename` for writing, and rename it over
+    `filename` once it is written and synced. If the process is killed or the
+    write fails, `filename` keeps its previous content, never a partial one.
+
+        with atomic_write('data/hashes.pkl') as f:
+            pickle.dump(hashes, f)
+    """
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_filename = filename + ".tmp"
+    try:
+        with open(tmp_filename, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(tmp_filename)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class Journal:
+    """
+    An append-only file of pickled entries, written ahead of changes which
+    are only saved at the end of a run.
+
+    Each entry is flushed when appended, so the journal survives the process
+    being killed. If the last entry was cut short, it is dropped when the
+    journal is replayed, and the following entries are appended after the
+    last complete one.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+
+    def replay(self):
+        """
+        Yield the entries of the journal, left by an interrupted run
+        """
+        try:
+            f = open(self.filename, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            end = 0
+            while True:
+                try:
+                    entry = pickle.load(f)
+                except EOFError:
+                    break
+                except (
+                    pickle.UnpicklingError,
+                    AttributeError,
+                    ValueError,
+                    IndexError,
+                ) as e:
+                    logger.warning(
+                        "Dropping the incomplete end of the journal "
+                        f"{self.filename}: {e}"
+                    )
+                    break
+                end = f.tell()
+                yield entry
+        if end < os.path.getsize(self.filename):
+            os.truncate(self.filename, end)
+
+    def append(self, entry):
+        if self.file is None:
+            self.file = open(self.filename, "ab")
+        pickle.dump(entry, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def clear(self):
+        """
+        Remove the journal, once the changes it records are saved
+        """
+        self.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
@@ -10,12 +10,13 @@ Be creative! do whatever you want!
 
 import argparse
 import json
-from omegaconf import OmegaConf
-import scrapy
-from scrapy.crawler import CrawlerProcess
-from rrc_rss.rrc import RRCShowSpider, RRCShowListSpider
-import rrc_rss.config
-from rrc_rss.config import config_defaults
+import os
+import sys
+import time
+
+# Heavy libraries (Scrapy, podgen, the upload backends) are imported by the
+# commands which need them, so that e.g. `rrc_rss upload` or `rrc_rss --help`
+# start fast
 
 # Set up our specific logger
 import logging
@@ -27,45 +28,257 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
 
+def read_cached_shows(filename):
+    """
+    Read the show URLs from the show list in JSON lines format.
+    Returns None if the file does not exist.
+    """
+    if not filename or not os.path.exists(filename):
+        return None
+    with open(filename, 'r') as f:
+        return [json.loads(line)['url'] for line in f]
+
+
+def shows_are_fresh(filename, ttl):
+    """
+    Check if the cached show list is younger than `ttl` seconds
+    """
+    if not ttl or not filename or not os.path.exists(filename):
+        return False
+    return time.time() - os.path.getmtime(filename) < ttl
+
+
+COMMANDS = ('crawl', 'render', 'upload', 'check-config')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Scrape Radio Romania Cultural shows and episodes')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-c', '--config', type=str,
+                        default='config/config.yml',
+                        help='Path to the configuration file')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    crawl = commands.add_parser(
+        'crawl', parents=[common],
+        help='Crawl the shows, then render and upload the changed feeds '
+             '(default)')
+    crawl.add_argument('--record', type=str, metavar='DIR',
+                       help='Record the crawled pages to an archive directory')
+    crawl.add_argument('--replay', type=str, metavar='DIR',
+                       help='Crawl offline, from the pages recorded in an '
+                            'archive directory')
+    crawl.add_argument('--shards', type=int, default=1, metavar='N',
+                       help='Crawl the shows in N worker processes, e.g. for '
+                            'a full backfill')
+    crawl.add_argument('--profile', type=str, metavar='NAME',
+                       help='Crawl profile from the configuration, e.g. '
+                            'fast-backfill')
+
+    render = commands.add_parser(
+        'render', parents=[common],
+        help='Render the cached podcasts to feed files, without crawling')
+    render.add_argument('-o', '--output', type=str, default='feeds',
+                        metavar='DIR', help='Directory to write the feeds to')
+    render.add_argument('shows', nargs='*', metavar='SHOW',
+                        help='Names of the podcasts to render, by default all')
+
+    upload = commands.add_parser(
+        'upload', parents=[common],
+        help='Render and upload the cached podcasts, without crawling')
+    upload.add_argument('-b', '--backend', action='append',
+                        choices=['dropbox', 'gist', 'pastebin'],
+                        help='Upload backend, can be repeated. By default the '
+                             'backends of the configuration')
+    upload.add_argument('--changed', action='store_true',
+                        help='Only render the podcasts changed since they '
+                             'were last published, as after a crawl')
+    upload.add_argument('shows', nargs='*', metavar='SHOW',
+                        help='Names of the podcasts to upload, by default all')
+    commands.add_parser('check-config', parents=[common],
+                        help='Check the configuration file and exit')
+
+    # Without a command, crawl, as in previous versions
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] not in COMMANDS + ('-h', '--help'):
+        argv.insert(0, 'crawl')
+    return parser.parse_args(argv)
+
 
-def main():  # pragma: no cover
+def main(argv=None, settings=None):  # pragma: no cover
     """
     The main function executes on commands:
     `python -m rrc_rss` and `$ rrc_rss `.
 
     This is your program's entry point.
+
+    :param argv: command line arguments, by default from sys.argv
+    :param settings: extra crawler settings, e.g. a REPLAY_ARCHIVE object
+    :returns: the exit code
     """
+    args = parse_args(argv)
 
-    logger.info('Starting Radio Romania Cultural RSS generator')
+    import dotenv
+    import rrc_rss.config
 
-    # Parse the command line arguments
-    parser = argparse.ArgumentParser(description='Scrape Radio Romania Cultural shows and episodes')
-    parser.add_argument('-c', '--config', type=str, default='config/config.yml', help='Path to the configuration file')
-    args = parser.parse_args()
+    dotenv.load_dotenv()
 
     # Merge with default configuration, set the global config object
-    rrc_rss.config.config = OmegaConf.merge(
-        OmegaConf.create(config_defaults),
-        OmegaConf.load(args.config)
-    )
+    config = rrc_rss.config.load_config(args.config)
+
+    if args.command == 'check-config':
+        return check_config(config)
+    if args.command == 'render':
+        return render(args.output, args.shows)
+    if args.command == 'upload':
+        return upload(args.backend, args.shows, args.changed)
+    return crawl(args, settings)
+
+
+def check_config(config):
+    import rrc_rss.config
+
+    problems = rrc_rss.config.check_config(config)
+    for problem in problems:
+        logger.error(problem)
+    if problems:
+        return 1
+    logger.info('Configuration is valid')
+    return 0
+
+
+def open_storage():
+    """
+    Open the podcast storage of the cache, to publish without crawling
+    """
+    import rrc_rss.config
+    from rrc_rss.storage import create_storage
+
+    cache = rrc_rss.config.config.cache
+    if not cache.enabled:
+        logger.warning(
+            'The cache is disabled, there are no podcasts to publish')
+    storage = create_storage(cache, enabled=cache.enabled)
+    storage.open()
+    return storage
+
+
+def render(output, shows=()):
+    """
+    Render the cached podcasts to feed files in the output directory
+    """
+    import rrc_rss.config
+    from rrc_rss.upload import PodcastsUploader
+
+    logger.info('Rendering the cached podcasts')
+    storage = open_storage()
+    try:
+        missing = [name for name in shows if name not in storage]
+        for name in missing:
+            logger.error(f'Podcast "{name}" not found in the cache')
+        names = [name for name in shows if name in storage] if shows else None
+        uploader = PodcastsUploader(
+            podcasts=storage.iter_podcasts(names),
+            max_episodes=rrc_rss.config.config.options.max_feed_episodes,
+            render_workers=rrc_rss.config.config.upload.render_workers
+        )
+        os.makedirs(output, exist_ok=True)
+        for feed in uploader.feeds():
+            with open(os.path.join(output, feed.filename), 'wb') as f:
+                f.write(feed.data)
+        logger.info(f'{len(uploader.rendered)} feeds written to {output}')
+    finally:
+        storage.close()
+    finish()
+    return 1 if missing else 0
+
+
+def upload(backends=None, shows=(), changed_only=False):
+    """
+    Render the cached podcasts and upload them, without crawling.
+
+    All the podcasts are rendered, e.g. to publish a change of the feed
+    format, but each backend only uploads the feeds whose content changed.
+    """
+    import rrc_rss.config
+    from rrc_rss.publish import Publisher
+
+    logger.info('Uploading the cached podcasts')
+    storage = open_storage()
+    try:
+        missing = [name for name in shows if name not in storage]
+        for name in missing:
+            logger.error(f'Podcast "{name}" not found in the cache')
+        names = [name for name in shows if name in storage] if shows else None
+        publisher = Publisher(storage, backends=backends,
+                              enabled=rrc_rss.config.config.cache.enabled)
+        published = publisher.publish(names=names, changed_only=changed_only)
+        logger.info(f'{len(published)} feeds published')
+    finally:
+        storage.close()
+    finish()
+    return 1 if missing else 0
+
+
+def crawl(args, settings=None):
+    """
+    Crawl the shows, the podcast pipeline then saves, renders and uploads the
+    changed ones
+    """
+    import scrapy
+    from scrapy.crawler import CrawlerProcess
+    import rrc_rss.config
+    from rrc_rss.metrics import metrics
+    from rrc_rss.pipelines import normalize_url
+    from rrc_rss.rrc import RRCShowSpider, RRCShowListSpider
+    from rrc_rss.shards import crawl_showlists, crawl_sharded
+
+    logger.info('Starting Radio Romania Cultural RSS generator')
     config = rrc_rss.config.config
 
-    # Create a process and a crawler for the first spider
-    process = CrawlerProcess(
-        settings={
-            'LOG_LEVEL': logging.WARNING,
-            'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7'   # Disable a deprecated warning
-            }
-    )
-    crawler = process.create_crawler(RRCShowListSpider)
+    # Crawler settings
+    extra_settings = settings or {}
+    settings = {
+        'LOG_LEVEL': logging.WARNING,
+        # Disable a deprecated warning
+        'REQUEST_FINGERPRINTER_IMPLEMENTATION': '2.7',
+        'DOWNLOADER_MIDDLEWARES': {}
+    }
 
-    # Define a function to run the second spider
-    def run_show_spider():
-        show_urls = []
+    # Concurrency, throttling, DNS cache and retries of the crawl profile
+    profile = args.profile or config.crawl.profile
+    settings.update(rrc_rss.config.crawl_profile_settings(config, profile))
+    metrics.info['profile'] = profile or 'default'
+    logger.info(f'Crawl profile: {profile or "Scrapy defaults"}')
 
-        # Read the urls from the show list in JSON lines format
-        with open(config.cache.file_shows, 'r') as f:
-            show_urls = [json.loads(line)['url'] for line in f]
+    # Send conditional requests for show and showlist pages, with the
+    # ETag / Last-Modified validators stored in the previous run
+    if config.cache.enabled and config.cache.file_validators:
+        settings['DOWNLOADER_MIDDLEWARES'][
+            'rrc_rss.middlewares.ConditionalRequestMiddleware'] = 560
+        settings['CONDITIONAL_CACHE_FILE'] = config.cache.file_validators
+
+    # Record the pages to an archive, or replay them from one, offline
+    if args.record:
+        settings['RECORD_ARCHIVE'] = args.record
+    if args.replay:
+        settings['REPLAY_ARCHIVE'] = args.replay
+    settings.update(extra_settings)
+    if 'RECORD_ARCHIVE' in settings:
+        settings['DOWNLOADER_MIDDLEWARES'][
+            'rrc_rss.replay.ReplayMiddleware'] = 950
+    elif 'REPLAY_ARCHIVE' in settings:
+        # Replayed pages go through the downloader, as online, with the
+        # concurrency of the profile
+        settings['DOWNLOAD_HANDLERS'] = {
+            'http': 'rrc_rss.replay.ReplayDownloadHandler',
+            'https': 'rrc_rss.replay.ReplayDownloadHandler',
+        }
+
+    # Collect show urls from the show list and from the configuration
+    def get_show_urls(showlist_urls):
+        show_urls = list(showlist_urls)
 
         # Add the individual shows URL from the configuration
         show_urls.extend(config.shows.shows)
@@ -74,23 +287,133 @@ def main():  # pragma: no cover
         for combo in config.shows.combos:
             show_urls.extend(combo.urls)
 
-        # Eliminate duplicates from the list
-        show_urls = list(set(show_urls))
+        # Eliminate duplicates from the list, also when the same show is
+        # written differently (e.g. without the trailing slash)
+        unique_urls = {}
+        for url in show_urls:
+            unique_urls.setdefault(normalize_url(url), url)
+        return list(unique_urls.values())
+
+    cached_shows = None
+    if config.cache.enabled:
+        cached_shows = read_cached_shows(config.cache.file_shows)
+    shows_fresh = (cached_shows is not None and
+                   shows_are_fresh(config.cache.file_shows,
+                                   config.cache.shows_ttl))
+
+    # Sharded crawl: the showlists are crawled first, unless the cached show
+    # list is fresh, then the shows are split across worker processes
+    if args.shards > 1:
+        if not shows_fresh:
+            with metrics.timer('run'):
+                cached_shows = crawl_showlists(settings)
+            logger.info(f'Show list crawled, {len(cached_shows)} shows')
+        with metrics.timer('run'):
+            failed = crawl_sharded(get_show_urls(cached_shows), args.shards,
+                                   settings)
+        report_throughput()
+        finish(save_metrics=True)
+        return 1 if failed else 0
 
-        # Run the Show spider to collect episodes from all the shows
-        process.crawl(RRCShowSpider,
+    # Crawlers are created in the order they are started, since the first
+    # one installs the Twisted reactor
+    process = CrawlerProcess(settings=settings)
+
+    # Define a function to run the Show spider to collect episodes from all
+    # the shows
+    def run_show_spider(show_urls, wait_for_shows=False):
+        show_crawler = process.create_crawler(RRCShowSpider)
+        metrics.track_crawler(show_crawler, 'crawl_shows')
+        process.crawl(show_crawler,
                       start_urls=show_urls,
                       do_cache=config.cache.enabled,
                       max_episodes=config.options.max_episodes,
                       min_episodes=config.options.min_episodes,
+                      wait_for_shows=wait_for_shows,
                       )
+        return show_crawler
+
+    if shows_fresh:
+        # The cached show list is fresh, skip the showlist crawl
+        logger.info(f'Using {len(cached_shows)} cached shows '
+                    f'from {config.cache.file_shows}')
+        run_show_spider(get_show_urls(cached_shows))
+
+    else:
+        # Crawl the showlists and the shows at the same time. Each show found
+        # on a showlist page is scheduled right away in the running Show
+        # spider, which drops the shows already scheduled. The Show spider is
+        # kept open until the showlist crawl is done. The show list file is
+        # only written as a side artifact, for the next runs.
+        if (cached_shows is not None and
+                config.cache.shows_refresh == 'background'):
+            logger.info(f'Using {len(cached_shows)} cached shows, '
+                        f'refreshing the show list in background')
+            show_urls = get_show_urls(cached_shows)
+        else:
+            show_urls = get_show_urls([])
+        show_crawler = run_show_spider(show_urls, wait_for_shows=True)
+
+        showlist_urls = []
+
+        def add_show(item):
+            showlist_urls.append(item['url'])
+            show_crawler.spider.add_shows([item['url']])
+
+        def showlist_done():
+            logger.info(f'Show list crawled, {len(set(showlist_urls))} shows')
+            show_crawler.spider.wait_for_shows = False
+
+        showlist_crawler = process.create_crawler(RRCShowListSpider)
+        metrics.track_crawler(showlist_crawler, 'crawl_showlists')
+        showlist_crawler.signals.connect(
+            add_show, signal=scrapy.signals.item_scraped)
+        showlist_crawler.signals.connect(
+            showlist_done, signal=scrapy.signals.spider_closed)
+        process.crawl(showlist_crawler, start_urls=config.shows.showlists)
+
+    # Start the process, and it will handle running the spiders
+    with metrics.timer('run'):
+        process.start()
+    report_throughput()
+    finish(save_metrics=True)
+    return 0
 
-    # Connect the `run_show_spider` function to the `spider_closed` signal of the first crawler
-    crawler.signals.connect(run_show_spider, signal=scrapy.signals.spider_closed)
 
-    # Add the first crawler to the process
-    process.crawl(crawler, start_urls=config.shows.showlists)
+def report_throughput():
+    """
+    Log the pages and items per second of the show crawl, and keep them as
+    gauges
+    """
+    from rrc_rss.metrics import metrics
+
+    # Wall time of the shards, or time to the last response of the show spider
+    seconds = (metrics.timers.get('crawl_sharded') or
+               metrics.timers.get('crawl_shows_fetching'))
+    if not seconds:
+        return
+    pages = metrics.counters['crawl_shows_responses']
+    items = metrics.counters['crawl_shows_items']
+    metrics.gauge('crawl_pages_per_second', pages / seconds)
+    metrics.gauge('crawl_items_per_second', items / seconds)
+    logger.info(f"Crawl profile {metrics.info.get('profile')}: "
+                f"{pages} pages and {items} items in {seconds:.1f}s, "
+                f"{pages / seconds:.1f} pages/s, "
+                f"{items / seconds:.1f} items/s, "
+                f"{metrics.counters['crawl_shows_retries']} retries")
+
 
-    # Start the process, and it will handle running the second spider after the first completes
-    process.start()
+def finish(save_metrics=False):
+    """
+    Log the metrics of the run. Only crawls save them, so that the metrics
+    files keep those of the last crawl, e.g. for the Prometheus textfile
+    collector, and not those of a later `render` or `upload`.
+    """
+    import rrc_rss.config
+    from rrc_rss.metrics import metrics
+
+    config = rrc_rss.config.config
+    logger.info(metrics.summary())
+    if save_metrics:
+        metrics.save(config.cache.file_metrics, config.cache.file_prometheus)
     logger.info('Finished Radio Romania Cultural RSS generator')
@@ -10,14 +10,155 @@ config_defaults = {
     'options': {
         'max_episodes': None,
         'min_episodes': 0,
+        'max_feed_episodes': None,
+    },
+    'crawl': {
+        # Crawl profile, from `profiles`. None runs with the Scrapy defaults
+        'profile': None,
+        # Scrapy settings of each profile, in lower case
+        'profiles': {
+            'fast-backfill': {
+                'concurrent_requests': 32,
+                'concurrent_requests_per_domain': 16,
+                'download_delay': 0,
+                'autothrottle_enabled': True,
+                'autothrottle_start_delay': 0.5,
+                'autothrottle_max_delay': 10,
+                'autothrottle_target_concurrency': 8.0,
+                'dnscache_enabled': True,
+                'dnscache_size': 1000,
+                'reactor_threadpool_maxsize': 20,
+                'download_timeout': 60,
+                'retry_enabled': True,
+                'retry_times': 5,
+                'retry_http_codes': [500, 502, 503, 504, 522, 524, 408, 429],
+            },
+            'nightly-incremental': {
+                'concurrent_requests': 8,
+                'concurrent_requests_per_domain': 4,
+                'download_delay': 0.25,
+                'autothrottle_enabled': True,
+                'autothrottle_start_delay': 1,
+                'autothrottle_max_delay': 30,
+                'autothrottle_target_concurrency': 2.0,
+                'dnscache_enabled': True,
+                'dnscache_size': 1000,
+                'reactor_threadpool_maxsize': 10,
+                'download_timeout': 30,
+                'retry_enabled': True,
+                'retry_times': 2,
+                'retry_http_codes': [500, 502, 503, 504, 522, 524, 408, 429],
+            },
+        },
+    },
+    'upload': {
+        'workers': 1,
+        'retries': 3,
+        'backoff': 1.0,
+        'render_workers': 1,
+        'backends': ['dropbox'],
     },
     'cache': {
         'enabled': False,
+        'backend': 'pickle',
         'dir': 'data',
         'file_shows': None,
+        'shows_ttl': 0,
+        'shows_refresh': 'showlist',
         'file_podcasts': None,
+        'file_db': None,
         'file_hashes': None,
+        'file_pastebin': None,
+        'file_fingerprints': None,
+        'file_validators': None,
+        'file_seen': None,
+        'file_journal': None,
+        'file_metrics': None,
+        'file_prometheus': None,
     }
 }
 
 config = OmegaConf.create(config_defaults)
+
+
+def load_config(filename):
+    """
+    Merge the configuration file with the default configuration, and set the
+    global config object
+    """
+    global config
+    config = OmegaConf.merge(OmegaConf.create(config_defaults),
+                             OmegaConf.load(filename))
+    return config
+
+
+def check_config(config):
+    """
+    Check the configuration for values which would only fail during a run.
+    Returns a list of problems, empty if the configuration is fine.
+    """
+    problems = []
+
+    def is_url(url):
+        return isinstance(url, str) and url.startswith(('http://', 'https://'))
+
+    for section in ('showlists', 'shows'):
+        for url in config.shows[section]:
+            if not is_url(url):
+                problems.append(f"shows.{section}: not an url: {url}")
+    names = set()
+    for i, combo in enumerate(config.shows.combos):
+        if not combo.get('name'):
+            problems.append(f"shows.combos[{i}]: missing name")
+        elif combo.name in names:
+            problems.append(f"shows.combos[{i}]: duplicate name {combo.name}")
+        names.add(combo.get('name'))
+        if not combo.get('urls'):
+            problems.append(f"shows.combos[{i}]: no urls")
+        for url in combo.get('urls') or []:
+            if not is_url(url):
+                problems.append(f"shows.combos[{i}].urls: not an url: {url}")
+
+    for key in ('max_episodes', 'max_feed_episodes'):
+        value = config.options[key]
+        if value is not None and (not isinstance(value, int) or value < 1):
+            problems.append(
+                f"options.{key}: must be a positive number, got {value}")
+    profile = config.crawl.profile
+    if profile is not None and profile not in config.crawl.profiles:
+        problems.append(f"crawl.profile: unknown profile {profile}")
+    for backend in config.upload.backends:
+        if backend not in ('dropbox', 'gist', 'pastebin'):
+            problems.append(f"upload.backends: unknown backend {backend}")
+    for key in ('workers', 'render_workers'):
+        value = config.upload[key]
+        if not isinstance(value, int) or value < 1:
+            problems.append(
+                f"upload.{key}: must be a positive number, got {value}")
+
+    backend = config.cache.backend
+    if backend not in ('pickle', 'sqlite'):
+        problems.append(f"cache.backend: unknown backend {backend}")
+    if config.cache.shows_refresh not in ('showlist', 'background'):
+        problems.append(
+            f"cache.shows_refresh: unknown mode {config.cache.shows_refresh}")
+    if config.cache.enabled:
+        required = 'file_db' if backend == 'sqlite' else 'file_podcasts'
+        if not config.cache[required]:
+            problems.append(
+                f"cache.{required}: required by the {backend} backend")
+    return problems
+
+
+def crawl_profile_settings(config, profile=None):
+    """
+    Scrapy settings of a crawl profile, by default of the profile selected in
+    `crawl.profile`
+    """
+    profile = profile or config.crawl.profile
+    if profile is None:
+        return {}
+    if profile not in config.crawl.profiles:
+        raise ValueError(f"Unknown crawl profile: {profile}")
+    settings = OmegaConf.to_container(config.crawl.profiles[profile])
+    return {key.upper(): value for key, value in settings.items()}
@@ -0,0 +1,89 @@
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+
+def compile_css(css):
+    """
+    Compile a CSS selector (with the ::text and ::attr() extensions) to an
+    XPath expression, translated the same way as `response.css()`
+    """
+    return etree.XPath(HTMLTranslator().css_to_xpath(css), smart_strings=False)
+
+
+def first(results, default=None):
+    return results[0] if results else default
+
+
+class ShowPage:
+    """
+    Fields of a show page, extracted with precompiled XPath expressions
+    """
+
+    title = compile_css("h1.cat-header__title::text")
+    author = compile_css("span.cat-header__descriere__realizator::text")
+    program = compile_css("span.cat-header__descriere__program strong::text")
+    description = compile_css("p.cat-header__descriere::text")
+
+    # Episode links and link to the next page of episodes
+    episode_urls = compile_css(
+        "div.news-item.news-item--with-audio a.link::attr(href)"
+    )
+    next_page = compile_css(
+        'a[rel="next"]::attr(href), ul.pagination li.next a::attr(href)'
+    )
+
+    @classmethod
+    def extract(cls, root):
+        """
+        Extract all the fields of a show page
+        :param root: the lxml root of the page, e.g. `response.selector.root`
+        """
+        fields = cls.extract_links(root)
+        fields.update(
+            title=first(cls.title(root), ""),
+            author=first(cls.author(root), ""),
+            program=first(cls.program(root), ""),
+            description=first(cls.description(root), ""),
+        )
+        return fields
+
+    @classmethod
+    def extract_links(cls, root):
+        """
+        Extract only the episode urls and the next page, for further pages of
+        a show
+        """
+        return {
+            "episode_urls": cls.episode_urls(root),
+            "next_page": first(cls.next_page(root)),
+        }
+
+
+class EpisodePage:
+    """
+    Fields of an episode page, extracted with precompiled XPath expressions
+    """
+
+    title = compile_css("article.articol h1::text")
+    date = compile_css("p.articol__autor-data::text")
+    paragraphs = compile_css("#__content p")
+    source = compile_css("source")
+    text = etree.XPath("string(.)", smart_strings=False)
+
+    @classmethod
+    def extract(cls, root):
+        """
+        Extract all the fields of an episode page
+        :param root: the lxml root of the page, e.g. `response.selector.root`
+        """
+        source = first(cls.source(root))
+        attrib = source.attrib if source is not None else {}
+        return {
+            "title": first(cls.title(root), ""),
+            "date": first(cls.date(root), ""),
+            "description": "\n".join(
+                cls.text(p) for p in cls.paragraphs(root)
+            ),
+            "audio_url": attrib.get("src"),
+            "audio_type": attrib.get("type"),
+        }
@@ -0,0 +1,113 @@
+import itertools
+from datetime import datetime, timezone
+
+from lxml import etree
+from podgen import Podcast
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+def newest_first(episodes):
+    """
+    Sort podgen Episodes by publication date, newest first, undated ones last
+    """
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    return sorted(
+        episodes,
+        key=lambda episode: episode.publication_date or oldest,
+        reverse=True,
+    )
+
+
+class FeedWriter:
+    """
+    Write the RSS feed of a podcast without building the whole XML tree.
+
+    The channel metadata is serialized first, from the podcast without its
+    episodes, then the episodes are serialized in small batches, as they come
+    from an iterator, and written out right away. Memory use is bounded by
+    the batch size instead of the number of episodes. The output is the same
+    as podgen's `rss_str()` for a podcast with the same episodes, in the same
+    order.
+
+    Episodes must come newest first (see `newest_first`), since the channel
+    publication date is the date of the newest episode.
+    """
+
+    channel_end = b"  </channel>\n</rss>\n"
+
+    def __init__(self, max_episodes=None, batch_size=100):
+        self.max_episodes = max_episodes
+        self.batch_size = batch_size
+
+    def write(self, podcast: Podcast, episodes, out):
+        """
+        Write the feed to a binary file-like object
+        :param podcast: the podcast, for the channel metadata. Its episodes
+            are ignored
+        :param episodes: iterable of podgen Episodes, newest first
+        :param out: binary file-like object, e.g. an open file or a BytesIO
+        :returns: the number of episodes written
+        """
+        episodes = iter(episodes)
+        if self.max_episodes is not None:
+            episodes = itertools.islice(episodes, self.max_episodes)
+
+        # The newest dated episode gives the channel publication date
+        first = next(episodes, None)
+        publication_date = podcast.publication_date
+        if publication_date is None and first is not None:
+            publication_date = first.publication_date
+        if first is not None:
+            episodes = itertools.chain([first], episodes)
+
+        out.write(self.header(podcast, publication_date))
+        count = 0
+        while True:
+            batch = list(itertools.islice(episodes, self.batch_size))
+            if not batch:
+                break
+            out.write(self.items(podcast, batch))
+            count += len(batch)
+        out.write(self.channel_end)
+        return count
+
+    def header(self, podcast, publication_date):
+        """
+        Serialize everything up to the first episode
+        """
+        episodes, podcast.episodes = podcast.episodes, []
+        saved_publication_date = podcast.publication_date
+        try:
+            podcast.publication_date = publication_date
+            data = etree.tostring(
+                podcast._create_rss(),
+                pretty_print=True,
+                encoding="UTF-8",
+                xml_declaration=True,
+            )
+        finally:
+            podcast.episodes = episodes
+            podcast.publication_date = saved_publication_date
+
+        if podcast.xslt:
+            data = data.replace(
+                b"\n", b"\n" + podcast._get_xslt_pi().encode() + b"\n", 1
+            )
+        return data[: -len(self.channel_end)]
+
+    def items(self, podcast, episodes):
+        """
+        Serialize a batch of episodes, indented and with the namespace
+        prefixes they have inside the full feed
+        """
+        feed = etree.Element("rss", nsmap=podcast._nsmap)
+        channel = etree.SubElement(feed, "channel")
+        for episode in episodes:
+            channel.append(episode.rss_entry())
+        data = etree.tostring(feed, pretty_print=True, encoding="UTF-8")
+        start = data.index(b"<channel>\n") + len(b"<channel>\n")
+        end = len(data) - len(self.channel_end)
+        return data[start:end]
@@ -0,0 +1,178 @@
+import time
+
+import requests
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class GistAPIError(Exception):
+    pass
+
+
+class GistClient:
+    """
+    A small client for the GitHub gists REST API.
+
+    Requests share one HTTP session (keep-alive). Write requests are spaced
+    by `min_interval` seconds, as GitHub asks for content creation. When the
+    rate limit is exhausted (403/429 with `x-ratelimit-remaining: 0` or
+    `retry-after`), the client waits until the limit resets, up to
+    `max_wait` seconds. Server errors, connection errors and timeouts are
+    retried with exponential backoff.
+
+    `api_url` can point to a local fake API for testing.
+    """
+
+    def __init__(
+        self,
+        token,
+        api_url="https://api.github.com",
+        session=None,
+        retries=3,
+        backoff=1.0,
+        min_interval=1.0,
+        max_wait=900,
+    ):
+        self.api_url = api_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.session.headers.update(
+            {
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/vnd.github+json",
+                "X-GitHub-Api-Version": "2022-11-28",
+            }
+        )
+        self.retries = retries
+        self.backoff = backoff
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self.last_write = 0
+
+    def rate_limit_delay(self, response):
+        """
+        Seconds to wait before retrying a rate limited request, or None if
+        the response is not about the rate limit
+        """
+        if response.status_code not in (403, 429):
+            return None
+        if "retry-after" in response.headers:
+            return float(response.headers["retry-after"])
+        if response.headers.get("x-ratelimit-remaining") == "0":
+            reset = float(
+                response.headers.get("x-ratelimit-reset", time.time() + 60)
+            )
+            return max(reset - time.time(), 0) + 1
+        return None
+
+    def request(self, method, path, **kwargs):
+        url = path if path.startswith("http") else self.api_url + path
+
+        # Space out write requests
+        if method != "GET":
+            delay = self.last_write + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(
+                    method, url, timeout=30, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self.backoff * 2**attempt
+                if attempt == self.retries or delay > self.max_wait:
+                    raise GistAPIError(f"{method} {path} failed: {e}") from e
+                logger.warning(
+                    f"Gist API {method} {path} failed ({e}), "
+                    f"retrying in {delay:.0f}s"
+                )
+                time.sleep(delay)
+                continue
+            if method != "GET":
+                self.last_write = time.monotonic()
+
+            delay = self.rate_limit_delay(response)
+            if delay is None and response.status_code >= 500:
+                delay = self.backoff * 2**attempt
+            if delay is None:
+                break
+            if attempt == self.retries or delay > self.max_wait:
+                break
+            logger.warning(
+                f"Gist API {method} {path} returned {response.status_code}, "
+                f"retrying in {delay:.0f}s"
+            )
+            time.sleep(delay)
+
+        if response.status_code >= 400:
+            raise GistAPIError(
+                f"{method} {path} failed with {response.status_code}: "
+                f"{response.text[:200]}"
+            )
+        return response
+
+    def list_gists(self):
+        """
+        All gists of the user, following the pagination
+        """
+        gists = []
+        url = "/gists?per_page=100"
+        while url:
+            response = self.request("GET", url)
+            gists.extend(response.json())
+            url = response.links.get("next", {}).get("url")
+        return gists
+
+    def file_index(self):
+        """
+        Map each file name to the id of the gist containing it
+        """
+        index = {}
+        for gist in self.list_gists():
+            for filename in gist["files"]:
+                if filename in index:
+                    logger.warning(
+                        f"{filename} is in several gists, "
+                        f"updating {index[filename]}"
+                    )
+                    continue
+                index[filename] = gist["id"]
+        return index
+
+    def create_gist(self, files, description="", public=False):
+        """
+        Create a gist with several files
+        :param files: dict of file name to content
+        :returns: the id of the new gist
+        """
+        response = self.request(
+            "POST",
+            "/gists",
+            json={
+                "description": description,
+                "public": public,
+                "files": {
+                    filename: {"content": content}
+                    for filename, content in files.items()
+                },
+            },
+        )
+        return response.json()["id"]
+
+    def update_gist(self, gist_id, files):
+        """
+        Update (or add) several files of a gist in one call
+        :param files: dict of file name to content
+        """
+        self.request(
+            "PATCH",
+            f"/gists/{gist_id}",
+            json={
+                "files": {
+                    filename: {"content": content}
+                    for filename, content in files.items()
+                },
+            },
+        )
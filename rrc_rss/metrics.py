@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from rrc_rss.cache import atomic_write
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class Metrics:
+    """
+    Timers and counters for each stage of a run, e.g. show pages crawled,
+    episodes skipped as cached, feeds rendered and uploaded.
+
+    Timers accumulate seconds under a stage name, counters accumulate counts,
+    gauges keep the last value set, e.g. a rate, and info keeps labels of the
+    run, e.g. the crawl profile. At the end of the run they are written as
+    JSON and optionally in the Prometheus textfile format.
+    """
+
+    def __init__(self):
+        self.timers = defaultdict(float)
+        self.counters = Counter()
+        self.gauges = {}
+        self.info = {}
+        self.started = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def start(self, stage):
+        """
+        Start a timer ended by `stop`, for stages that span callbacks, e.g. a
+        spider
+        """
+        self.started[stage] = time.perf_counter()
+
+    def stop(self, stage):
+        start = self.started.pop(stage, None)
+        if start is not None:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            self.timers[stage] += seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def merge(self, data):
+        """
+        Add the timers and counters of another run, e.g. of a worker process
+        (see `to_dict`)
+        """
+        for stage, seconds in data.get("timers", {}).items():
+            self.add_time(stage, seconds)
+        for name, value in data.get("counters", {}).items():
+            self.count(name, value)
+
+    def track_crawler(self, crawler, stage):
+        """
+        Time a spider from open to close, and keep its response, item, retry
+        and duplicate request counts. The time from open to the last response
+        is kept as `{stage}_fetching`, for the crawl throughput, without the
+        time spent publishing when the spider closes.
+        """
+        from scrapy import signals
+
+        opened_at = []
+        last_response = []
+
+        def opened():
+            self.start(stage)
+            opened_at[:] = [time.perf_counter()]
+
+        def response_received():
+            last_response[:] = [time.perf_counter()]
+
+        def closed():
+            self.stop(stage)
+            if opened_at and last_response:
+                self.add_time(
+                    f"{stage}_fetching", last_response[0] - opened_at[0]
+                )
+            self.count(
+                f"{stage}_responses",
+                crawler.stats.get_value("response_received_count", 0),
+            )
+            self.count(
+                f"{stage}_items",
+                crawler.stats.get_value("item_scraped_count", 0),
+            )
+            self.count(
+                f"{stage}_retries", crawler.stats.get_value("retry/count", 0)
+            )
+            self.count(
+                f"{stage}_duplicates",
+                crawler.stats.get_value("dupefilter/filtered", 0),
+            )
+
+        crawler.signals.connect(
+            opened, signal=signals.spider_opened, weak=False
+        )
+        crawler.signals.connect(
+            response_received, signal=signals.response_received, weak=False
+        )
+        crawler.signals.connect(
+            closed, signal=signals.spider_closed, weak=False
+        )
+
+    def to_dict(self):
+        return {
+            "timestamp": time.time(),
+            "timers": {
+                stage: round(seconds, 6)
+                for stage, seconds in sorted(self.timers.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "gauges": dict(sorted(self.gauges.items())),
+            "info": dict(sorted(self.info.items())),
+        }
+
+    def to_prometheus(self, prefix="rrc_rss"):
+        data = self.to_dict()
+        lines = [
+            f"# HELP {prefix}_stage_seconds "
+            "Time spent in each stage of the last run",
+            f"# TYPE {prefix}_stage_seconds gauge",
+        ]
+        lines += [
+            f'{prefix}_stage_seconds{{stage="{stage}"}} {seconds}'
+            for stage, seconds in data["timers"].items()
+        ]
+        lines += [
+            f"# HELP {prefix}_count Counters of the last run",
+            f"# TYPE {prefix}_count gauge",
+        ]
+        lines += [
+            f'{prefix}_count{{name="{name}"}} {value}'
+            for name, value in data["counters"].items()
+        ]
+        lines += [
+            f"# HELP {prefix}_gauge Rates and other values of the last run",
+            f"# TYPE {prefix}_gauge gauge",
+        ]
+        lines += [
+            f'{prefix}_gauge{{name="{name}"}} {value}'
+            for name, value in data["gauges"].items()
+        ]
+        if data["info"]:
+            labels = ",".join(
+                f'{name}="{value}"' for name, value in data["info"].items()
+            )
+            lines += [
+                f"# HELP {prefix}_info Labels of the last run",
+                f"# TYPE {prefix}_info gauge",
+                f"{prefix}_info{{{labels}}} 1",
+            ]
+        lines += [
+            f"# HELP {prefix}_last_run_timestamp_seconds "
+            "End time of the last run",
+            f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+            f'{prefix}_last_run_timestamp_seconds {data["timestamp"]}',
+        ]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write(filename, content):
+        """
+        Write a file atomically, so that readers (e.g. the node exporter)
+        never see a partial file
+        """
+        with atomic_write(filename, "w") as f:
+            f.write(content)
+
+    def save(self, json_filename=None, prometheus_filename=None):
+        if json_filename:
+            self.write(json_filename, json.dumps(self.to_dict(), indent=1))
+            logger.info(f"Metrics saved to {json_filename}")
+        if prometheus_filename:
+            self.write(prometheus_filename, self.to_prometheus())
+            logger.info(f"Metrics saved to {prometheus_filename}")
+
+    def summary(self):
+        timers = ", ".join(
+            f"{stage} {seconds:.2f}s"
+            for stage, seconds in sorted(self.timers.items())
+        )
+        counters = ", ".join(
+            f"{name} {value}" for name, value in sorted(self.counters.items())
+        )
+        gauges = ", ".join(
+            f"{name} {value:.2f}"
+            for name, value in sorted(self.gauges.items())
+        )
+        return f"Timers: {timers}\nCounters: {counters}\nGauges: {gauges}"
+
+
+# Metrics of the current run
+metrics = Metrics()
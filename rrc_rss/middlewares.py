@@ -0,0 +1,154 @@
+import json
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from rrc_rss.cache import atomic_write
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class ConditionalRequestMiddleware:
+    """
+    A Scrapy downloader middleware for HTTP conditional requests.
+
+    Stores the ETag and Last-Modified validators of show and showlist pages
+    in a persistent JSON file, and sends them back as If-None-Match and
+    If-Modified-Since on the next run. Unchanged pages are answered with
+    304 Not Modified, which the spiders skip without parsing.
+
+    Only requests with `meta['conditional']` set are handled. The validators
+    file is given by the `CONDITIONAL_CACHE_FILE` setting.
+
+    A spider can return the pages whose validators must not be saved from an
+    `incomplete_pages()` method, e.g. show pages whose episodes failed. A 304
+    for these pages would skip the failed episodes on the next run. Instead,
+    they are marked as incomplete, and fetched on the next run without
+    validators and with `meta['backfill']` set. A page still incomplete
+    after `CONDITIONAL_BACKFILL_RETRIES` runs (3 by default) keeps its
+    validators again, so that a lasting failure does not backfill the show
+    on every run.
+    """
+
+    def __init__(self, filename, backfill_retries=3):
+        self.filename = filename
+        self.backfill_retries = backfill_retries
+        self.validators = {}
+        self.updated = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        filename = crawler.settings.get("CONDITIONAL_CACHE_FILE")
+        if not filename:
+            raise NotConfigured("CONDITIONAL_CACHE_FILE not set")
+        middleware = cls(
+            filename,
+            crawler.settings.getint("CONDITIONAL_BACKFILL_RETRIES", 3),
+        )
+        crawler.signals.connect(
+            middleware.spider_opened, signal=signals.spider_opened
+        )
+        crawler.signals.connect(
+            middleware.spider_closed, signal=signals.spider_closed
+        )
+        return middleware
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def spider_opened(self, spider):
+        self.validators = self.load()
+        logger.debug(
+            f"Loaded {len(self.validators)} HTTP validators "
+            f"from {self.filename}"
+        )
+
+    def spider_closed(self, spider):
+        """
+        Save the updated validators, merged with the ones on disk, since
+        other spiders in the same process share the file. The validators of
+        incomplete pages are replaced by a mark with the number of runs they
+        were incomplete in, so these pages are fetched again.
+        """
+        incomplete = (
+            spider.incomplete_pages()
+            if hasattr(spider, "incomplete_pages")
+            else set()
+        )
+        marks = {}
+        for url in incomplete:
+            previous = self.validators.get(url) or {}
+            attempts = previous.get("attempts", 0) + 1
+            if attempts > self.backfill_retries:
+                logger.warning(
+                    f"{url} still incomplete after {attempts} runs, "
+                    "keeping its validators"
+                )
+                continue
+            marks[url] = {"incomplete": True, "attempts": attempts}
+        incomplete = set(marks)
+        updated = {
+            url: validator
+            for url, validator in self.updated.items()
+            if url not in incomplete
+        }
+        updated.update(marks)
+        if not updated:
+            return
+        validators = self.load()
+        for url, validator in updated.items():
+            if validator is None:
+                validators.pop(url, None)
+            else:
+                validators[url] = validator
+        with atomic_write(self.filename, "w") as f:
+            json.dump(validators, f, indent=1)
+        if incomplete:
+            logger.info(
+                "Not saving the HTTP validators of "
+                f"{len(incomplete)} incomplete pages"
+            )
+        logger.debug(
+            f"Saved {len(updated)} updated HTTP validators to {self.filename}"
+        )
+
+    def process_request(self, request, spider=None):
+        if not request.meta.get("conditional"):
+            return None
+        validator = self.validators.get(request.url)
+        if validator:
+            if validator.get("incomplete"):
+                request.meta["backfill"] = True
+            if validator.get("etag"):
+                request.headers.setdefault("If-None-Match", validator["etag"])
+            if validator.get("last_modified"):
+                request.headers.setdefault(
+                    "If-Modified-Since", validator["last_modified"]
+                )
+        return None
+
+    def process_response(self, request, response, spider=None):
+        if not request.meta.get("conditional"):
+            return response
+        if response.status == 304:
+            logger.debug(f"Not modified: {request.url}")
+        elif response.status == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                self.updated[request.url] = {
+                    "etag": etag.decode() if etag else None,
+                    "last_modified": (
+                        last_modified.decode() if last_modified else None
+                    ),
+                }
+            elif request.url in self.validators:
+                # No validators anymore, or a page marked as incomplete
+                self.updated[request.url] = None
+        return response
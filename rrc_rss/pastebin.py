@@ -1,22 +1,76 @@
 #!/usr/bin/env python
 # PasteBin API Class - Developed by acidvegas in Python (https://git.acid.vegas/pastebin)
+# Changed to use a pooled keep-alive session, with retries and errors as
+# exceptions
 
 '''
 API Documentation: https://pastebin.com/doc_api
 '''
 
-import urllib.parse
-import urllib.request
+import time
+
+import requests
+import requests.adapters
+import urllib3.exceptions
+
+
+class PasteBinError(Exception):
+	pass
+
 
 class PasteBin:
-	def __init__(self, api_dev_key, api_user_key=None):
+	def __init__(
+			self, api_dev_key, api_user_key=None,
+			api_url='https://pastebin.com/api/', session=None,
+			pool_size=4, timeout=30, retries=3, backoff=1.0):
 		self.api_dev_key  = api_dev_key
 		self.api_user_key = api_user_key
+		self.api_url = api_url.rstrip('/') + '/'
+		self.timeout = timeout
+		self.retries = retries
+		self.backoff = backoff
+		if session is None:
+			# One pool of keep-alive connections, shared by all threads using
+			# the client
+			session = requests.Session()
+			adapter = requests.adapters.HTTPAdapter(
+				pool_connections=1, pool_maxsize=pool_size)
+			session.mount('http://', adapter)
+			session.mount('https://', adapter)
+		self.session = session
+
+	@staticmethod
+	def not_sent(error):
+		'''Check if a request failed while connecting, before it was sent.'''
+		if isinstance(error, requests.ConnectTimeout):
+			return True
+		reason = getattr(error.args[0], 'reason', None) if error.args else None
+		return isinstance(error, requests.ConnectionError) and isinstance(
+			reason, urllib3.exceptions.NewConnectionError)
 
-	def api_call(self, method, params):
-		'''Make a call to the PasteBin API.'''
-		response = urllib.request.urlopen('https://pastebin.com/api/' + method, urllib.parse.urlencode(params).encode('utf-8'), timeout=10)
-		return response.read().decode()
+	def api_call(self, method, params, idempotent=True):
+		'''Make a call to the PasteBin API. Connection and server errors are
+		retried with exponential backoff. Calls which are not idempotent, e.g.
+		creating a paste, are only retried if the request was not sent.'''
+		for attempt in range(self.retries + 1):
+			try:
+				response = self.session.post(
+					self.api_url + method, data=params, timeout=self.timeout)
+				if response.status_code < 500:
+					break
+				error = PasteBinError(f'{method} failed with {response.status_code}')
+				retry = idempotent
+			except requests.RequestException as e:
+				error = e
+				retry = idempotent or self.not_sent(e)
+			if not retry or attempt == self.retries:
+				raise error
+			time.sleep(self.backoff * 2 ** attempt)
+		text = response.text
+		if response.status_code >= 400 or text.startswith('Bad API request'):
+			raise PasteBinError(
+				f'{method} failed with {response.status_code}: {text[:200]}')
+		return text
 
 	def create_user_key(self, username, password):
 		'''Create a user key for the PasteBin API.'''
@@ -31,7 +85,8 @@ class PasteBin:
 		if format    : params['api_paste_format']      = format
 		if private   : params['api_paste_private']     = private
 		if expire    : params['api_paste_expire_date'] = expire
-		return self.api_call('api_post.php', params)
+		# Not retried once sent, a lost response would create a duplicate paste
+		return self.api_call('api_post.php', params, idempotent=False)
 
 	def list_pastes(self, results_limit=None):
 		'''List pastes created by the user.'''
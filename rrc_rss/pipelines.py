@@ -1,17 +1,32 @@
-import os
-import dotenv
-import pickle
+from collections import defaultdict
+from urllib.parse import urlsplit
 
-from podgen import Podcast, Episode, Media
 from scrapy import Item, Field
-from rrc_rss.upload import PodcastsUploader
+from twisted.internet import threads
+from rrc_rss.cache import Journal
+from rrc_rss.publish import Publisher
+from rrc_rss.storage import create_storage, combo_episode_title
 import rrc_rss.config
+from rrc_rss.metrics import metrics
 
 import logging
 logger = logging.getLogger('RRC_RSS')
 
 
-dotenv.load_dotenv()
+def normalize_url(url):
+    """
+    Normalize a show url for comparisons, e.g. between the combo urls in the
+    configuration and the show websites: ignore the scheme, the case of the
+    host, a leading "www." and trailing slashes
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    normalized = host + parts.path.rstrip('/')
+    if parts.query:
+        normalized += '?' + parts.query
+    return normalized
 
 
 class ShowDescriptionItem(Item):
@@ -29,6 +44,14 @@ class EpisodeItem(Item):
     audio_url = Field()
     audio_type = Field()
     description = Field()
+    url = Field()
+
+
+# Item classes by name, to write items to a file and read them back
+ITEM_TYPES = {
+    'ShowDescriptionItem': ShowDescriptionItem,
+    'EpisodeItem': EpisodeItem,
+}
 
 class CreatePodcastPipeline:
     """
@@ -37,149 +60,203 @@ class CreatePodcastPipeline:
     The Scrapy spider yields ShowDescriptionItems and EpisodeItems.
     It is assumed that the ShowDescriptionItem is yielded first.
 
-    The pipeline creates a Podcast object for each ShowDescriptionItem, and
-    adds Episode objects to the Podcast.
+    The pipeline creates a podcast for each ShowDescriptionItem, and
+    adds episodes to the podcast, in the storage backend selected in the
+    `cache` configuration (see `rrc_rss.storage`).
 
     For Combo podcasts (e.g. multiple shows in one feed), the pipeline
-    assembles the episodes from different shows in the same Podcast object,
+    assembles the episodes from different shows in the same podcast,
     so this is handled here.
+
+    When caching is enabled, each item is written ahead to the journal file
+    (`cache.file_journal`) before it is stored, and the journal is cleared
+    once the storage is saved. If a run is killed before that, the next run
+    replays the journal first, so an interrupted backfill resumes where it
+    stopped instead of fetching the same episodes again.
     """
 
     do_cache = False
-
-    def create_or_update_podcast(self, name, description, website, explicit, **kwargs):
-        """
-        Create or update a podcast with the given metadata
-        """
-        if name not in self.podcasts:
-            self.podcasts[name] = Podcast(
-                name=name,
-                description=description,
-                website=website,
-                explicit=explicit,
-            )
-        for key, value in kwargs.items():
-            setattr(self.podcasts[name], key, value)
-
+    journal = None
 
     def open_spider(self, spider):
         """
         Runs when the spider is opened.
 
-        Load existing podcasts from cache file.
+        Open the podcast storage, loading existing podcasts if caching is
+        enabled.
         """
 
-        # Load existing podcasts from cache file
-        if hasattr(spider, 'do_cache') and spider.do_cache:
-            # if CreatePodcastPipeline.do_cache:
-            try:
-                with open(rrc_rss.config.config.cache.file_podcasts, 'rb') as f:
-                    self.podcasts = pickle.load(f)
-                    logger.info(f"Loaded {len(self.podcasts)} podcasts from {rrc_rss.config.config.cache.file_podcasts}")
-            except FileNotFoundError:
-                    self.podcasts = {}
-        else:
-            self.podcasts = {}
-
-        # Create combo podcasts
+        # Open the storage backend selected in the cache configuration
+        self.do_cache = hasattr(spider, 'do_cache') and spider.do_cache
+        self.storage = create_storage(rrc_rss.config.config.cache,
+                                      enabled=self.do_cache)
+        with metrics.timer('storage_open'):
+            self.storage.open()
+
+        # Create combo podcasts, and index them by the normalized url of
+        # their shows
+        self.combo_index = defaultdict(list)
+        self.show_combos = {}
         for combo in rrc_rss.config.config.shows.combos:
-            self.create_or_update_podcast(
+            self.storage.update_podcast(
                 name=combo.name,
                 description=combo.description if hasattr(combo, 'description') else 'Combo podcast',
                 website=str(combo.urls),
                 explicit=False,
                 show_category='Combo'
             )
+            for url in combo.urls:
+                if combo.name not in self.combo_index[normalize_url(url)]:
+                    self.combo_index[normalize_url(url)].append(combo.name)
 
+        # Resume from the journal of an interrupted run
+        filename = rrc_rss.config.config.cache.file_journal
+        if self.do_cache and filename:
+            self.journal = Journal(filename)
+            self.replay_journal(spider)
+
+    def replay_journal(self, spider):
+        """
+        Store the items of the journal left by an interrupted run, and mark
+        their episodes as seen by the spider, so they are not fetched again
+        """
+        seen = getattr(spider, 'seen', None)
+        count = 0
+        for item_type, fields in self.journal.replay():
+            item = ITEM_TYPES[item_type](**fields)
+            self.store_item(item)
+            if seen is not None and item.get('url'):
+                seen.add(item['url'])
+            count += 1
+        if count:
+            logger.info(f"Replayed {count} items from the journal "
+                        f"{self.journal.filename}, left by an interrupted run")
+            metrics.count('journal_items_replayed', count)
+
+    def combos(self, show_name):
+        """
+        Names of the combo podcasts which include a show, looked up once per
+        show
+        """
+        if show_name not in self.show_combos:
+            if show_name not in self.storage:
+                return []
+            website = self.storage.website(show_name)
+            self.show_combos[show_name] = (
+                self.combo_index.get(normalize_url(website), [])
+                if website else [])
+        return self.show_combos[show_name]
+
+    def add_episode(self, name, item, show_name=None):
+        """
+        Add an episode to a podcast, unless it is already present. For a
+        combo podcast, `show_name` is the show the episode comes from.
+        """
+        title = item['title']
+        if show_name:
+            title = combo_episode_title(show_name, title)
+
+        # Skip if episode is already present, add it otherwise
+        if self.storage.has_episode(name, title, item['audio_url']):
+            logger.debug(f"Podcast \"{name}\": episode exists \"{title}\"")
+            metrics.count('episodes_duplicate')
+            return
+
+        fields = dict(
+            audio_url=item['audio_url'],
+            audio_type=item['audio_type'],
+            summary=item['description'],
+            date=item['date']
+        )
+        if show_name:
+            # Combos share the episode of the show, as far as the storage
+            # allows
+            self.storage.add_combo_episode(name, show_name, item['title'],
+                                           **fields)
+        else:
+            self.storage.add_episode(name, title=title, **fields)
+        logger.info(f"Podcast \"{name}\": added episode \"{title}\"")
+        metrics.count('episodes_added')
 
     def process_item(self, item, spider):
         """
         Process a scraped item
         """
+        if type(item).__name__ not in ITEM_TYPES:
+            raise ValueError(f"Unknown item type: {type(item)}")
+        if self.journal is not None:
+            self.journal.append((type(item).__name__, dict(item)))
+        self.store_item(item)
+        return item
+
+    def store_item(self, item):
+        """
+        Store an item in the podcast storage
+        """
 
         # Received a ShowDescriptionItem, create a new podcast if it doesn't exist
         if isinstance(item, ShowDescriptionItem):
-            self.create_or_update_podcast(
+            self.storage.update_podcast(
                 name=item['title'],
                 description=f"{item['author']}\n{item['program']}\n{item['description']}",
                 website=item['website'],
                 explicit=False,
                 show_category=item['category']
             )
+            self.show_combos.pop(item['title'], None)
 
         # Received an EpisodeItem, add it to the corresponding podcast(s)
         elif isinstance(item, EpisodeItem):
             show_name = item['show_name']
 
             # Add it to its corresponding podcast
-            if show_name in self.podcasts:
-
-                # Skip if episode is already present, add it otherwise
-                if any(existing_episode.title == item['title'] for existing_episode in self.podcasts[show_name].episodes):
-                    logger.debug(f"Podcast \"{show_name}\": episode exists \"{item['title']}\"")
-                else:
-                    self.podcasts[show_name].add_episode(
-                        Episode(
-                            title=item['title'],
-                            media=Media(item['audio_url'], type=item['audio_type']),
-                            summary=item['description'],
-                            publication_date=item['date']
-                        )
-                    )
-                    logger.info(f"Podcast \"{show_name}\": added episode \"{item['title']}\"")
+            if show_name in self.storage:
+                self.add_episode(show_name, item)
             else:
                 logger.error(f"Podcast \"{show_name}\" not found")
 
             # Add it to combo podcasts that include this show
-            show_website = self.podcasts[show_name].website
-            for combo in rrc_rss.config.config.shows.combos:
-                if show_website in combo.urls:
-
-                    # Format episode title to include the show name
-                    episode_title = f"{show_name}: {item['title']}"
-
-                    # Skip if episode is already present, add it otherwise
-                    if any(existing_episode.title == episode_title for existing_episode in self.podcasts[combo.name].episodes):
-                        logger.debug(f"Podcast \"{combo.name}\": episode exists \"{episode_title}\"")
-                    else:
-                        self.podcasts[combo.name].add_episode(
-                            Episode(
-                                title=episode_title,
-                                media=Media(item['audio_url'], type=item['audio_type']),
-                                summary=item['description'],
-                                publication_date=item['date']
-                            )
-                        )
-                        logger.info(f"Podcast \"{combo.name}\": added episode \"{episode_title}\"")
-
-        else:
-            raise ValueError(f"Unknown item type: {type(item)}")
-
-        return item
+            # The episode title includes the show name
+            for combo_name in self.combos(show_name):
+                self.add_episode(combo_name, item, show_name=show_name)
 
 
     def close_spider(self, spider):
         """
         Runs when the spider is closed.
 
-        Uploads podcasts and saves them to a cache file.
+        Saves podcasts to the storage and uploads them, in a thread of the
+        reactor thread pool, so the reactor keeps running other spiders
+        meanwhile. Scrapy waits for the returned Deferred before the spider
+        is closed.
         """
+        deferred = threads.deferToThread(self.publish)
+        deferred.addErrback(self.publish_failed)
+        return deferred
 
-        # Save collected podcasts
-        #if CreatePodcastPipeline.do_cache:
-        if hasattr(spider, 'do_cache') and spider.do_cache:
-            with open(rrc_rss.config.config.cache.file_podcasts, 'wb') as f:
-                pickle.dump(self.podcasts, f)
-                logger.info(f"Saved {len(self.podcasts)} podcasts to {rrc_rss.config.config.cache.file_podcasts}")
-
-        # Upload collected podcasts
-        PodcastsUploader(
-            podcasts=list(self.podcasts.values()),
-            dropbox_folder=os.getenv('DROPBOX_FOLDER'),
-            dropbox_token=os.getenv('DROPBOX_ACCESS_TOKEN'),
-            dropbox_refresh_token=os.getenv('DROPBOX_REFRESH_TOKEN'),
-            dropbox_app_key=os.getenv('DROPBOX_APP_KEY'),
-            dropbox_app_secret=os.getenv('DROPBOX_APP_SECRET')
-        ).to_dropbox()
+    def publish_failed(self, failure):
+        logger.error(f"Saving and publishing podcasts failed: "
+                     f"{failure.getErrorMessage()}\n{failure.getTraceback()}")
 
+    def publish(self):
+        """
+        Save podcasts to the storage, render the changed ones and upload them
+        """
+        try:
+            self.save_and_upload()
+        finally:
+            self.storage.close()
 
+    def save_and_upload(self):
+
+        # Save collected podcasts
+        with metrics.timer('storage_save'):
+            self.storage.save()
+        if self.journal is not None:
+            self.journal.clear()
+
+        # Only render podcasts which changed during the run, or whose feed
+        # was not published with the current fingerprint (e.g. a failed
+        # upload)
+        publisher = Publisher(self.storage, enabled=self.do_cache)
+        publisher.publish(dirty=self.storage.dirty)
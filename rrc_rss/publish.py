@@ -0,0 +1,173 @@
+import os
+import pickle
+
+import rrc_rss.config
+from rrc_rss.cache import atomic_write
+from rrc_rss.metrics import metrics
+from rrc_rss.upload import PodcastsUploader
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class Publisher:
+    """
+    Render the podcasts of a storage and upload them with the upload
+    backends selected in the configuration.
+
+    Used by the podcast pipeline at the end of a crawl, and by the `upload`
+    command to publish the cached podcasts without crawling. Credentials
+    come from the environment (see `.env`).
+
+    The fingerprints of the published feeds are remembered, so that the
+    next crawl only renders the podcasts which changed. Each backend also
+    skips the feeds whose content hash did not change since its last upload.
+    """
+
+    available_backends = ("dropbox", "gist", "pastebin")
+
+    def __init__(self, storage, backends=None, enabled=True):
+        """
+        :param storage: an open podcast storage (see `rrc_rss.storage`)
+        :param backends: names of the upload backends, by default from
+            `upload.backends`
+        :param enabled: whether the fingerprints are read from and saved to
+            the cache
+        """
+        config = rrc_rss.config.config
+        self.storage = storage
+        self.backends = list(backends or config.upload.backends)
+        self.enabled = enabled
+        for backend in self.backends:
+            if backend not in Publisher.available_backends:
+                raise ValueError(f"Unknown upload backend: {backend}")
+
+    def fingerprints(self):
+        """
+        Fingerprints of all podcasts. The episode cap of the feeds is part of
+        their fingerprint.
+        """
+        max_feed_episodes = rrc_rss.config.config.options.max_feed_episodes
+        fingerprints = {
+            name: self.storage.fingerprint(name)
+            for name in self.storage.names()
+        }
+        if max_feed_episodes is not None:
+            fingerprints = {
+                name: f"{fingerprint}|max{max_feed_episodes}"
+                for name, fingerprint in fingerprints.items()
+            }
+        return fingerprints
+
+    def load_fingerprints(self):
+        """
+        Load the fingerprints of the feeds published in previous runs
+        """
+        filename = rrc_rss.config.config.cache.file_fingerprints
+        if not self.enabled or not filename:
+            return {}
+        try:
+            with open(filename, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_fingerprints(self, fingerprints):
+        filename = rrc_rss.config.config.cache.file_fingerprints
+        if not self.enabled or not filename:
+            return
+        with atomic_write(filename) as f:
+            pickle.dump(fingerprints, f)
+        logger.debug(
+            f"Saved {len(fingerprints)} feed fingerprints to {filename}"
+        )
+
+    def uploader(self, podcasts):
+        config = rrc_rss.config.config
+        return PodcastsUploader(
+            podcasts=podcasts,
+            gist_token=os.getenv("GIST_TOKEN"),
+            pastebin_api_key=os.getenv("PASTEBIN_API_KEY"),
+            pastebin_username=os.getenv("PASTEBIN_USERNAME"),
+            pastebin_password=os.getenv("PASTEBIN_PASSWORD"),
+            pastebin_workers=config.upload.workers,
+            dropbox_folder=os.getenv("DROPBOX_FOLDER"),
+            dropbox_token=os.getenv("DROPBOX_ACCESS_TOKEN"),
+            dropbox_refresh_token=os.getenv("DROPBOX_REFRESH_TOKEN"),
+            dropbox_app_key=os.getenv("DROPBOX_APP_KEY"),
+            dropbox_app_secret=os.getenv("DROPBOX_APP_SECRET"),
+            dropbox_workers=config.upload.workers,
+            dropbox_retries=config.upload.retries,
+            dropbox_backoff=config.upload.backoff,
+            max_episodes=config.options.max_feed_episodes,
+            render_workers=config.upload.render_workers,
+        )
+
+    def publish(self, names=None, changed_only=True, dirty=()):
+        """
+        Render and upload podcasts
+        :param names: names of the podcasts to publish, by default all of them
+        :param changed_only: only render the podcasts whose fingerprint
+            changed since they were last published, or which are in `dirty`.
+            Otherwise render all of them, and only upload the ones whose
+            content changed (e.g. after a change of the feed format)
+        :returns: the names of the published podcasts
+        """
+        fingerprints = self.fingerprints()
+        published = self.load_fingerprints()
+        if names is None:
+            names = list(fingerprints)
+        if changed_only:
+            changed = [
+                name
+                for name in names
+                if name in dirty or published.get(name) != fingerprints[name]
+            ]
+            logger.info(f"{len(changed)} of {len(names)} podcasts changed")
+            metrics.count("feeds_changed", len(changed))
+            metrics.count("feeds_skipped", len(names) - len(changed))
+            names = changed
+
+        # Podcasts are loaded lazily from the storage, and rendered once for
+        # all backends
+        uploader = self.uploader(self.storage.iter_podcasts(names))
+
+        # Without any backend to upload to, nothing is rendered, and the
+        # fingerprints are kept, so the feeds are published once a backend is
+        # set
+        backends = [
+            backend
+            for backend in self.backends
+            if uploader.has_credentials(backend)
+        ]
+        for backend in self.backends:
+            if backend not in backends:
+                logger.warning(
+                    f"No credentials for the {backend} backend, "
+                    "not uploading to it"
+                )
+        if not backends:
+            logger.warning(
+                "No upload backend to publish to, "
+                f"not rendering the {len(names)} podcasts"
+            )
+            return set()
+
+        published_names = None
+        with metrics.timer("publish"):
+            for backend in backends:
+                uploader.published = set()
+                getattr(uploader, f"to_{backend}")()
+                # A feed is published once all the backends have it
+                published_names = (
+                    uploader.published
+                    if published_names is None
+                    else published_names & uploader.published
+                )
+
+        # Remember the fingerprints of the published feeds
+        for name in published_names:
+            published[name] = fingerprints[name]
+        self.save_fingerprints(published)
+        return published_names
@@ -0,0 +1,337 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+
+from scrapy import signals
+from scrapy.core.downloader.handlers.base import BaseDownloadHandler
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.asyncio import sleep
+
+from rrc_rss.cache import atomic_write
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class PageArchive:
+    """
+    Pages recorded from a crawl, to be replayed offline.
+
+    The archive is a directory with an `index.jsonl` file, one line per page
+    with the url, status, headers and body file, and the gzipped page bodies.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, "index.jsonl")
+        self.pages = {}
+        self.updated = {}
+
+    def load(self):
+        self.pages = self.read_index()
+        return self
+
+    def read_index(self):
+        pages = {}
+        try:
+            with open(self.index_file, "r") as f:
+                for line in f:
+                    page = json.loads(line)
+                    pages[page["url"]] = page
+        except FileNotFoundError:
+            pass
+        return pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    def get(self, url):
+        """
+        Return the status, headers and body of a recorded page, or None
+        """
+        page = self.pages.get(url)
+        if page is None:
+            return None
+        with gzip.open(os.path.join(self.directory, page["file"]), "rb") as f:
+            body = f.read()
+        return page["status"], page["headers"], body
+
+    def add(self, url, status, headers, body):
+        filename = hashlib.sha1(url.encode()).hexdigest() + ".gz"
+        os.makedirs(self.directory, exist_ok=True)
+        with gzip.open(os.path.join(self.directory, filename), "wb") as f:
+            f.write(body)
+        page = {
+            "url": url,
+            "status": status,
+            "headers": headers,
+            "file": filename,
+        }
+        self.pages[url] = page
+        self.updated[url] = page
+
+    def save(self):
+        """
+        Save the index, merged with the one on disk, since other spiders in
+        the same process record to the same archive
+        """
+        if not self.updated:
+            return
+        pages = self.read_index()
+        pages.update(self.updated)
+        with atomic_write(self.index_file, "w") as f:
+            for page in pages.values():
+                f.write(json.dumps(page) + "\n")
+        logger.info(f"Recorded {len(self.updated)} pages to {self.directory}")
+        self.updated = {}
+
+
+class SyntheticArchive:
+    """
+    Pages of a synthetic site with the same markup as radioromaniacultural.ro,
+    generated on request: one showlist, `shows` shows with `episodes` episodes
+    each, `page_size` episodes per show page.
+    """
+
+    def __init__(
+        self,
+        shows=10,
+        episodes=100,
+        page_size=20,
+        base_url="https://rrc.invalid",
+    ):
+        self.shows = shows
+        self.episodes = episodes
+        self.page_size = page_size
+        self.base_url = base_url
+
+    @property
+    def showlist_url(self):
+        return f"{self.base_url}/emisiuni"
+
+    def show_url(self, show, page=1):
+        url = f"{self.base_url}/emisiuni/show-{show}/"
+        return url if page == 1 else f"{url}page/{page}/"
+
+    def episode_url(self, show, episode):
+        return f"{self.base_url}/emisiuni/show-{show}/episod-{episode}/"
+
+    def get(self, url):
+        prefix = len(self.base_url)
+        path = url[prefix:].strip("/").split("/")
+        try:
+            if path == ["emisiuni"]:
+                body = self.showlist_page()
+            elif len(path) == 2 and path[1].startswith("show-"):
+                body = self.show_page(int(path[1][5:]))
+            elif len(path) == 4 and path[2] == "page":
+                body = self.show_page(int(path[1][5:]), int(path[3]))
+            elif len(path) == 3 and path[2].startswith("episod-"):
+                body = self.episode_page(int(path[1][5:]), int(path[2][7:]))
+            else:
+                return None
+        except ValueError:
+            return None
+        if body is None:
+            return None
+        return (
+            200,
+            {"Content-Type": ["text/html; charset=utf-8"]},
+            body.encode(),
+        )
+
+    def showlist_page(self):
+        items = "".join(
+            f'<div class="news-item">'
+            f'<a class="link" href="{self.show_url(show)}">Show {show}</a>'
+            f"</div>"
+            for show in range(self.shows)
+        )
+        return (
+            f'<html><body><h1 class="cat-header__title">Emisiuni</h1>'
+            f"{items}</body></html>"
+        )
+
+    def show_page(self, show, page=1):
+        if show >= self.shows:
+            return None
+        # Newest episodes first
+        last = self.episodes - (page - 1) * self.page_size
+        if last <= 0 and page > 1:
+            return None
+        items = "".join(
+            f'<div class="news-item news-item--with-audio">'
+            f'<a class="link" href="{self.episode_url(show, episode)}">'
+            f"Episodul {episode}</a></div>"
+            for episode in range(
+                last - 1, max(last - self.page_size, 0) - 1, -1
+            )
+        )
+        if last > self.page_size:
+            items += (
+                f'<ul class="pagination"><li class="next">'
+                f'<a href="{self.show_url(show, page + 1)}">next</a>'
+                f"</li></ul>"
+            )
+        return (
+            f'<html><body><div class="cat-header">'
+            f'<h1 class="cat-header__title">Show {show}</h1>'
+            f'<p class="cat-header__descriere">Descrierea emisiunii {show}.'
+            f'<span class="cat-header__descriere__realizator">'
+            f"Realizator {show}</span>"
+            f'<span class="cat-header__descriere__program">'
+            f"Program: <strong>Luni, 10:00</strong></span></p>"
+            f"</div>{items}</body></html>"
+        )
+
+    def episode_page(self, show, episode):
+        if show >= self.shows or episode >= self.episodes:
+            return None
+        paragraphs = "".join(
+            f"<p>Paragraful {k} al episodului {episode}, "
+            f"cu <strong>text</strong>.</p>"
+            for k in range(5)
+        )
+        return (
+            f'<html><body><article class="articol"><h1>Episodul {episode}</h1>'
+            f'<p class="articol__autor-data">'
+            f"{1 + episode % 28} Martie {2000 + episode // 336 % 25}, "
+            f"{episode % 24:02d}:{episode % 60:02d}</p>"
+            f'<audio><source src="{self.base_url}/audio/{show}/{episode}.mp3"'
+            f' type="audio/mpeg"></audio>'
+            f'<div id="__content">{paragraphs}</div></article></body></html>'
+        )
+
+
+def open_archive(replay):
+    """
+    The archive of the `REPLAY_ARCHIVE` setting: a PageArchive directory, or
+    an archive object
+    """
+    return PageArchive(replay).load() if isinstance(replay, str) else replay
+
+
+def archive_response(archive, request):
+    """
+    The response to a request from an archive, or a 404 response if the page
+    is not in the archive. Returns the response and whether the page was
+    found.
+    """
+    page = archive.get(request.url)
+    if page is None:
+        logger.debug(f"Not in archive: {request.url}")
+        status, headers, body = 404, {}, b""
+    else:
+        status, headers, body = page
+    headers = Headers(headers)
+    response_class = responsetypes.from_args(
+        headers=headers, url=request.url, body=body
+    )
+    return (
+        response_class(
+            url=request.url,
+            status=status,
+            headers=headers,
+            body=body,
+            request=request,
+        ),
+        page is not None,
+    )
+
+
+class ReplayDownloadHandler(BaseDownloadHandler):
+    """
+    A Scrapy download handler serving the http and https pages from the
+    `REPLAY_ARCHIVE` archive (see ReplayMiddleware).
+
+    Unlike the middleware, requests go through the downloader slots, so the
+    concurrency, download delays and AutoThrottle of the crawl profile apply
+    as they do online. The `REPLAY_LATENCY` setting adds a server response
+    time in seconds to each page, to compare crawl profiles offline.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        replay = crawler.settings.get("REPLAY_ARCHIVE")
+        if not replay:
+            raise NotConfigured("REPLAY_ARCHIVE not set")
+        self.archive = open_archive(replay)
+        self.latency = crawler.settings.getfloat("REPLAY_LATENCY", 0)
+        self.replayed = 0
+
+    async def download_request(self, request):
+        start = time.perf_counter()
+        if self.latency:
+            await sleep(self.latency)
+        response, found = archive_response(self.archive, request)
+        # As the HTTP handler, for AutoThrottle
+        request.meta["download_latency"] = time.perf_counter() - start
+        self.replayed += found
+        return response
+
+    async def close(self):
+        logger.info(f"Replayed {self.replayed} pages")
+
+
+class ReplayMiddleware:
+    """
+    A Scrapy downloader middleware to crawl offline from a page archive.
+
+    With the `REPLAY_ARCHIVE` setting, responses are served from the archive
+    instead of being downloaded, and pages missing from the archive get a
+    404 response. The setting is either the directory of a PageArchive, or
+    an archive object, e.g. a SyntheticArchive.
+
+    With the `RECORD_ARCHIVE` setting, downloaded responses are recorded to a
+    PageArchive in that directory.
+    """
+
+    def __init__(self, archive, record=False):
+        self.archive = archive
+        self.record = record
+        self.replayed = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        record_dir = crawler.settings.get("RECORD_ARCHIVE")
+        replay = crawler.settings.get("REPLAY_ARCHIVE")
+        if record_dir:
+            middleware = cls(PageArchive(record_dir), record=True)
+        elif replay:
+            middleware = cls(open_archive(replay))
+        else:
+            raise NotConfigured("REPLAY_ARCHIVE or RECORD_ARCHIVE not set")
+        crawler.signals.connect(
+            middleware.spider_closed, signal=signals.spider_closed
+        )
+        return middleware
+
+    def spider_closed(self, spider):
+        if self.record:
+            self.archive.save()
+        else:
+            logger.info(f"Replayed {self.replayed} pages")
+
+    def process_request(self, request, spider=None):
+        if self.record:
+            return None
+        response, found = archive_response(self.archive, request)
+        self.replayed += found
+        return response
+
+    def process_response(self, request, response, spider=None):
+        # Pages not modified are not recorded, they have no body
+        if self.record and response.status != 304:
+            headers = {
+                key.decode(): [value.decode("latin-1") for value in values]
+                for key, values in response.headers.items()
+            }
+            self.archive.add(
+                request.url, response.status, headers, response.body
+            )
+        return response
@@ -1,17 +1,32 @@
-import dateutil
+import dateutil.parser
+import functools
+import json
 import pytz
+import re
 import scrapy
-import pickle
-from slugify import slugify
+import scrapy.exceptions
+from scrapy.spidermiddlewares.httperror import HttpError
+from collections import Counter, defaultdict
 from datetime import datetime
 import rrc_rss.config
-from rrc_rss.pipelines import ShowDescriptionItem, EpisodeItem
+from rrc_rss.extract import ShowPage, EpisodePage
+from rrc_rss.metrics import metrics
+from rrc_rss.pipelines import ShowDescriptionItem, EpisodeItem, normalize_url
+from rrc_rss.storage import SeenIndex
 
 import logging
 logger = logging.getLogger('RRC_RSS')
 
 
 class DateTimeParser:
+    """
+    Parse the episode dates, e.g. '15 Martie 2024, 10:30'
+
+    Dates in the usual format are parsed with a single regex and a month
+    lookup. Anything else falls back to dateutil, after translating the
+    month names. Results are cached, since many episodes share a date.
+    """
+
     months = {
         'Ianuarie': 'January',
         'Februarie': 'February',
@@ -26,9 +41,34 @@ class DateTimeParser:
         'Noiembrie': 'November',
         'Decembrie': 'December'
     }
+    month_numbers = {month_ro: number
+                     for number, month_ro in enumerate(months, start=1)}
+
+    # Day, month name, year and optional time (seconds optional)
+    pattern = re.compile(r'\s*(\d{1,2})\s+([A-Za-z]+)\s+(\d{4})'
+                         r'(?:,?\s+(\d{1,2}):(\d{2})(?::(\d{2}))?)?\s*')
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def parse(datetime_str):
+        match = DateTimeParser.pattern.fullmatch(datetime_str)
+        if match:
+            day, month, year, hour, minute, second = match.groups()
+            month = DateTimeParser.month_numbers.get(month)
+            if month:
+                try:
+                    return datetime(int(year), month, int(day),
+                                    int(hour or 0), int(minute or 0),
+                                    int(second or 0), tzinfo=pytz.UTC)
+                except ValueError:
+                    pass
+        return DateTimeParser.parse_dateutil(datetime_str)
+
+    @staticmethod
+    def parse_dateutil(datetime_str):
+        """
+        Parse any date format understood by dateutil
+        """
         for month_ro, month_en in DateTimeParser.months.items():
             datetime_str = datetime_str.replace(month_ro, month_en)
         datetime_str = datetime_str.replace(', ', ' ')
@@ -43,13 +83,121 @@ class RRCShowSpider(scrapy.Spider):
         }
     }
 
-    def __init__(self, max_episodes=None, min_episodes=0, do_cache=False, *args, **kwargs):
+    # Show pages not modified since the last run
+    # (see ConditionalRequestMiddleware)
+    handle_httpstatus_list = [304]
+
+    def __init__(self, max_episodes=None, min_episodes=0, do_cache=False,
+                 wait_for_shows=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.max_episodes = max_episodes
         self.min_episodes = min_episodes
         self.do_cache = do_cache
+        self.wait_for_shows = wait_for_shows
+
+        # Episode urls parsed in this and previous runs, for all shows
+        self.seen = SeenIndex(
+            rrc_rss.config.config.cache.file_seen if do_cache else None)
+        self.seen.load()
+
+        # Number of show pages fetched, by show
+        self.pages_fetched = Counter()
+
+        # Normalized urls of the shows scheduled, to drop the same show
+        # written differently, e.g. without the trailing slash (see
+        # `show_requests`)
+        self.scheduled_shows = set()
+
+        # Episode and further page requests in progress, by first show page,
+        # and the show pages with requests which failed for a transient
+        # reason. The HTTP validators of a show page are only kept once all
+        # its requests succeeded or failed for good (see `incomplete_pages`)
+        self.pending = Counter()
+        self.failed_pages = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle,
+                                signal=scrapy.signals.spider_idle)
+        return spider
+
+    def incomplete_pages(self):
+        """
+        The first pages of the shows whose episodes or further pages failed
+        for a transient reason, or were not fetched because the crawl
+        stopped early. Their HTTP validators are not saved (see
+        ConditionalRequestMiddleware), so they are fetched again on the next
+        run. Pages whose requests failed for good, e.g. a dead link, or whose
+        parsing raised, are not retried.
+        """
+        return self.failed_pages | {
+            url for url, pending in self.pending.items() if pending}
+
+    def show_request_done(self, response):
+        self.pending[response.meta['show_page']] -= 1
+
+    def show_request_failed(self, failure):
+        show_page = failure.request.meta['show_page']
+        logger.warning(
+            f"Request failed: {failure.request.url}: {failure.value!r}")
+        self.pending[show_page] -= 1
+        if self.is_transient(failure):
+            self.failed_pages.add(show_page)
+
+    @staticmethod
+    def is_transient(failure):
+        """
+        Check if a failed request may succeed on a later run: network errors,
+        timeouts and server errors are transient, client errors (e.g. 404)
+        and ignored requests are not
+        """
+        if failure.check(HttpError):
+            status = failure.value.response.status
+            return status >= 500 or status in (408, 429)
+        return not failure.check(scrapy.exceptions.IgnoreRequest)
+
+    def spider_idle(self):
+        """
+        Keep the spider open while more shows are expected (see `add_shows`)
+        """
+        if self.wait_for_shows:
+            raise scrapy.exceptions.DontCloseSpider
+
+    def show_requests(self, urls):
+        """
+        Requests for the shows not scheduled yet. The same show written
+        differently would be crawled twice, and its website would alternate
+        between the two forms, marking the podcast as changed on every run.
+        """
+        for url in urls:
+            normalized = normalize_url(url)
+            if normalized in self.scheduled_shows:
+                logger.debug(f"Show already scheduled: {url}")
+                continue
+            self.scheduled_shows.add(normalized)
+            yield scrapy.Request(url, meta={'conditional': True})
+
+    def add_shows(self, urls):
+        """
+        Add more shows to crawl while the spider is running, e.g. as they
+        are found by the Showlist spider
+        """
+        for request in self.show_requests(urls):
+            self.crawler.engine.crawl(request)
+
+    async def start(self):
+        for request in self.show_requests(self.start_urls):
+            yield request
+
+    def closed(self, reason):
+        # Saved after the pipeline has stored the episodes
+        self.seen.save()
 
-        self.episodes_url_parsed = []
+        for show_name, pages in self.pages_fetched.most_common():
+            logger.debug(f"{show_name}: fetched {pages} show pages")
+        logger.info(f"Fetched {sum(self.pages_fetched.values())} show pages "
+                    f"for {len(self.pages_fetched)} shows")
 
     def parse(self, response):
         """
@@ -57,78 +205,139 @@ class RRCShowSpider(scrapy.Spider):
         :param response: the response object
         """
 
-        title = response.css('h1.cat-header__title::text').get(default='').strip()
-        author = response.css('span.cat-header__descriere__realizator::text').get(default='').strip()
-        program = response.css('span.cat-header__descriere__program strong::text').get(default='')
-        description = response.css('p.cat-header__descriere::text').get(default='')
+        # Show page not modified since the last run, so there are no new
+        # episodes
+        if response.status == 304:
+            logger.debug(f"Show page not modified: {response.url}")
+            metrics.count('pages_show_not_modified')
+            return
+
+        metrics.count('pages_show')
+        with metrics.timer('parse_show'):
+            show = ShowPage.extract(response.selector.root)
+        title = show['title'].strip()
         category = response.url.split('/')[-3].capitalize()
 
         # Send first the podcast description item
         yield ShowDescriptionItem(
             title=title,
-            author=author,
-            program=program,
-            description=description,
+            author=show['author'].strip(),
+            program=show['program'],
+            description=show['description'],
             category=category,
             website=response.url)
 
-        # Get episode urls
-        episode_urls = response.css('div.news-item.news-item--with-audio a.link::attr(href)').getall()
+        # Get episode urls and the next page of the show
+        episode_urls = show['episode_urls']
+        next_page = show['next_page']
 
         # If the show has too few episodes, skip it
-        if len(episode_urls) < self.min_episodes:
+        if len(episode_urls) < self.min_episodes and not next_page:
             logger.info(f"Skipping {title} because it has only {len(episode_urls)} episodes")
             return
 
+        yield from self.follow_episodes(
+            response, title, episode_urls, next_page, episode_count=0,
+            show_page=response.url,
+            backfill=response.meta.get('backfill', False))
+
+    def parse_show_page(self, response, show_name, episode_count):
+        """
+        Parse a further page of a show
+        :param response: the response object
+        :param show_name: the name of the show
+        :param episode_count: the number of episodes on the previous pages
+        """
+
+        self.show_request_done(response)
+        metrics.count('pages_show')
+        with metrics.timer('parse_show'):
+            links = ShowPage.extract_links(response.selector.root)
+
+        yield from self.follow_episodes(
+            response, show_name, links['episode_urls'], links['next_page'],
+            episode_count, show_page=response.meta['show_page'],
+            backfill=response.meta['backfill'])
+
+    def follow_episodes(self, response, show_name, episode_urls, next_page,
+                        episode_count, show_page, backfill=False):
+        """
+        Follow the new episodes on a show page, then the next page.
+
+        Show pages are newest first, so the next page is only followed if no
+        episode of this page was parsed before. Incremental runs fetch only
+        the first page of a show, unless all its episodes are new, while
+        first runs backfill the full archive, up to `max_episodes`.
+
+        With `backfill`, when requests of the show failed in the previous
+        run, all the pages are followed, since the failed episodes may be on
+        any of them. Only the episodes not parsed before are fetched.
+
+        The requests are counted as pending for `show_page`, the first page
+        of the show, until they are parsed.
+        """
+        self.pages_fetched[show_name] += 1
+
         # Limit the number of episodes
         if self.max_episodes:
-            episode_urls = episode_urls[:self.max_episodes]
-
-        # Load episode urls from pickle file
-        old_episode_urls = []
-        if self.do_cache:
-            pkl_filename = rrc_rss.config.config.cache.dir + "/" + slugify(title) + '.pkl'
-            try:
-                with open(pkl_filename, 'rb') as f:
-                    old_episode_urls = pickle.load(f)
-                    logger.debug(f"Loaded {len(old_episode_urls)} episodes from {pkl_filename}")
-            except FileNotFoundError:
-                pass
-
-        # Keep only the new episodes
-        new_episode_urls = list(set(episode_urls) - set(old_episode_urls))
-
-        # Follow new episode urls
-        for url in new_episode_urls:
-            if url not in old_episode_urls:
-                yield response.follow(url, callback=self.parse_episode, cb_kwargs={'show_name': title})
-
-        # Save episode urls to pickle file
-        if self.do_cache:
-            with open(pkl_filename, 'wb') as f:
-                pickle.dump(self.episodes_url_parsed, f)
-                logger.debug(f"Saved {len(self.episodes_url_parsed)} episodes to {pkl_filename}")
-
-    def parse_episode(self, response, show_name):
+            left = max(self.max_episodes - episode_count, 0)
+            episode_urls = episode_urls[:left]
+        episode_count += len(episode_urls)
+
+        # Follow only the episodes not parsed before
+        new_episode_urls = [url for url in map(response.urljoin, episode_urls)
+                            if url not in self.seen]
+        metrics.count('episodes_cached',
+                      len(episode_urls) - len(new_episode_urls))
+        for episode_url in new_episode_urls:
+            self.pending[show_page] += 1
+            yield response.follow(episode_url, callback=self.parse_episode,
+                                  errback=self.show_request_failed,
+                                  meta={'show_page': show_page},
+                                  cb_kwargs={'show_name': show_name,
+                                             'episode_url': episode_url})
+
+        if not backfill and len(new_episode_urls) < len(episode_urls):
+            logger.debug(f"{show_name}: episodes parsed before on page "
+                         f"{self.pages_fetched[show_name]}, stopping")
+            return
+        if self.max_episodes and episode_count >= self.max_episodes:
+            return
+        if next_page:
+            self.pending[show_page] += 1
+            yield response.follow(next_page, callback=self.parse_show_page,
+                                  errback=self.show_request_failed,
+                                  meta={'show_page': show_page,
+                                        'backfill': backfill},
+                                  cb_kwargs={'show_name': show_name,
+                                             'episode_count': episode_count})
+
+    def parse_episode(self, response, show_name, episode_url=None):
         """
         Parse an episode page
         :param response: the response object
         :param show_name: the name of the show
+        :param episode_url: the url of the episode, before any redirect
         """
 
         # Get episode details
-        title = response.css('article.articol h1::text').get(default='').strip()
-        datestr = response.css('p.articol__autor-data::text').get(default='').strip()
-        date = DateTimeParser.parse(datestr) if datestr else datetime.now()
-        paragraphs = response.css('#__content p').xpath('string(.)').getall()
-        description = '\n'.join(paragraphs)
+        self.show_request_done(response)
+        metrics.count('pages_episode')
+        with metrics.timer('parse_episode'):
+            episode = EpisodePage.extract(response.selector.root)
+            title = episode['title'].strip()
+            datestr = episode['date'].strip()
+            if datestr:
+                date = DateTimeParser.parse(datestr)
+            else:
+                date = datetime.now(pytz.UTC)
+        description = episode['description']
 
         # Get audio url and type
-        audio_elem = response.css('source').attrib
-        audio_url = audio_elem.get('src')
-        audio_type = audio_elem.get('type')
+        audio_url = episode['audio_url']
+        audio_type = episode['audio_type']
 
-        self.episodes_url_parsed.append(response.url)
+        self.seen.add(episode_url or response.url)
 
         # Send the episode item
         if audio_url:
@@ -138,27 +347,72 @@ class RRCShowSpider(scrapy.Spider):
                 date=date,
                 audio_url=audio_url,
                 audio_type=audio_type,
-                description=description
+                description=description,
+                url=episode_url or response.url
             )
+        else:
+            metrics.count('episodes_without_audio')
 
 
 class RRCShowListSpider(scrapy.Spider):
     name = 'show_list_spider'
-    custom_settings = {
-        'FEEDS' : {
-            rrc_rss.config.config.cache.file_shows: {'format': 'jsonlines', 'overwrite': True}
-        }
-    }
+
+    @classmethod
+    def update_settings(cls, settings):
+        """
+        Export the shows to the show list file. This is read from the
+        configuration when the crawler is created, not at import time.
+        """
+        super().update_settings(settings)
+        if rrc_rss.config.config.cache.file_shows:
+            settings.set('FEEDS', {
+                rrc_rss.config.config.cache.file_shows: {
+                    'format': 'jsonlines', 'overwrite': True}
+            }, priority='spider')
+
+    # Showlist pages not modified since the last run
+    # (see ConditionalRequestMiddleware)
+    handle_httpstatus_list = [304]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        # Shows found in the last run, by showlist page, re-sent for pages
+        # which are not modified. Read before the feed export overwrites the
+        # file.
+        self.cached_shows = defaultdict(list)
+        try:
+            with open(rrc_rss.config.config.cache.file_shows, 'r') as f:
+                for line in f:
+                    show = json.loads(line)
+                    self.cached_shows[show.get('showlist')].append(show)
+        except (FileNotFoundError, TypeError):
+            pass
+
+    async def start(self):
+        for url in self.start_urls:
+            yield scrapy.Request(url, dont_filter=True,
+                                 meta={'conditional': True})
+
     def parse(self, response):
         """
         Parse a show list page
         :param response: the response object
         """
 
+        # Showlist page not modified since the last run, send the same shows.
+        # If they are not cached, fetch the page again unconditionally.
+        if response.status == 304:
+            logger.debug(f"Showlist page not modified: {response.url}")
+            metrics.count('pages_showlist_not_modified')
+            if self.cached_shows[response.url]:
+                yield from self.cached_shows[response.url]
+            else:
+                yield scrapy.Request(response.url, dont_filter=True)
+            return
+
+        metrics.count('pages_showlist')
+
         # Get page title (e.g. Emisiuni, Podcast)
         page_title = response.css('h1.cat-header__title::text').get(default='').strip()
 
@@ -172,6 +426,7 @@ class RRCShowListSpider(scrapy.Spider):
             yield {
                 'category': page_title,
                 'title': title,
-                'url': absolute_url
+                'url': absolute_url,
+                'showlist': response.url
             }
 
@@ -0,0 +1,323 @@
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+from types import SimpleNamespace
+
+from omegaconf import OmegaConf
+from scrapy.crawler import CrawlerProcess
+
+import rrc_rss.config
+from rrc_rss.cache import atomic_write
+from rrc_rss.metrics import metrics
+from rrc_rss.pipelines import CreatePodcastPipeline, ITEM_TYPES
+from rrc_rss.rrc import RRCShowSpider, RRCShowListSpider
+from rrc_rss.storage import SeenIndex
+
+logger = logging.getLogger("RRC_RSS")
+
+
+class ShardWriterPipeline:
+    """
+    A Scrapy pipeline writing the scraped items of a shard to a file, as a
+    stream of pickled (item type, fields) pairs, to be merged later
+    """
+
+    def open_spider(self, spider):
+        self.file = open(spider.items_file, "wb")
+
+    def process_item(self, item, spider):
+        pickle.dump((type(item).__name__, dict(item)), self.file)
+        return item
+
+    def close_spider(self, spider):
+        self.file.close()
+
+
+class ShardShowSpider(RRCShowSpider):
+    """
+    The Show spider of a shard, writing its items to `items_file` instead
+    of the podcast storage
+    """
+
+    name = "shard_show_spider"
+    custom_settings = {
+        "ITEM_PIPELINES": {"rrc_rss.shards.ShardWriterPipeline": 300}
+    }
+
+    def __init__(self, items_file=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.items_file = items_file
+
+
+def split_urls(urls, shards):
+    """
+    Split the show urls in `shards` lists of about the same size
+    """
+    urls = sorted(urls)
+    return [urls[shard::shards] for shard in range(shards)]
+
+
+def read_items(filename):
+    """
+    Yield the items written by a shard. If the shard was killed while
+    writing an item, the incomplete end of the file is dropped, as in
+    `Journal.replay`.
+    """
+    try:
+        with open(filename, "rb") as f:
+            while True:
+                try:
+                    item_type, fields = pickle.load(f)
+                except EOFError:
+                    return
+                except (
+                    pickle.UnpicklingError,
+                    AttributeError,
+                    ValueError,
+                    IndexError,
+                ) as e:
+                    logger.warning(
+                        "Dropping the incomplete end of the shard items "
+                        f"{filename}: {e}"
+                    )
+                    return
+                yield ITEM_TYPES[item_type](**fields)
+    except FileNotFoundError:
+        return
+
+
+def setup_worker(shard, config):
+    """
+    Set the configuration and the logger of a worker process
+    """
+    rrc_rss.config.config = OmegaConf.create(config)
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter(
+            f"%(asctime)s - %(name)s - shard {shard} - "
+            "%(levelname)s - %(message)s"
+        )
+    )
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def crawl_showlists_worker(config, settings, metrics_file):
+    """
+    Worker process crawling the showlists to the show list file
+    """
+    setup_worker("showlists", config)
+    process = CrawlerProcess(settings=settings)
+    crawler = process.create_crawler(RRCShowListSpider)
+    metrics.track_crawler(crawler, "crawl_showlists")
+    process.crawl(crawler, start_urls=rrc_rss.config.config.shows.showlists)
+    process.start()
+    with open(metrics_file, "w") as f:
+        json.dump(metrics.to_dict(), f)
+
+
+def crawl_shard_worker(
+    shard, config, settings, show_urls, items_file, metrics_file
+):
+    """
+    Worker process crawling the shows of one shard
+    """
+    setup_worker(shard, config)
+    config = rrc_rss.config.config
+    process = CrawlerProcess(settings=settings)
+    crawler = process.create_crawler(ShardShowSpider)
+    metrics.track_crawler(crawler, "crawl_shows")
+    process.crawl(
+        crawler,
+        start_urls=show_urls,
+        items_file=items_file,
+        do_cache=config.cache.enabled,
+        max_episodes=config.options.max_episodes,
+        min_episodes=config.options.min_episodes,
+    )
+    process.start()
+    with open(metrics_file, "w") as f:
+        json.dump(metrics.to_dict(), f)
+
+
+def read_metrics(filename):
+    try:
+        with open(filename, "r") as f:
+            metrics.merge(json.load(f))
+    except FileNotFoundError:
+        pass
+
+
+def merge_validators(filename, shard_filenames):
+    """
+    Merge the HTTP validators of the shards into the validators file. Each
+    shard starts from a copy of the file, so only the validators a shard
+    changed or removed are merged.
+    """
+
+    def read(filename):
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    original = read(filename) if os.path.exists(filename) else {}
+    validators = dict(original)
+    for shard_filename in shard_filenames:
+        # A shard which failed early may not have written its copy
+        shard_validators = (
+            read(shard_filename)
+            if os.path.exists(shard_filename)
+            else original
+        )
+        for url, validator in shard_validators.items():
+            if original.get(url) != validator:
+                validators[url] = validator
+        for url in original.keys() - shard_validators.keys():
+            validators.pop(url, None)
+    with atomic_write(filename, "w") as f:
+        json.dump(validators, f, indent=1)
+
+
+def run_workers(workers):
+    """
+    Start the worker processes and wait for all of them. Returns the number of
+    failed workers.
+    """
+    for worker in workers:
+        worker.start()
+    failed = 0
+    for worker in workers:
+        worker.join()
+        if worker.exitcode != 0:
+            logger.error(
+                f"{worker.name} failed with exit code {worker.exitcode}"
+            )
+            failed += 1
+    return failed
+
+
+def crawl_showlists(settings):
+    """
+    Crawl the showlists in a worker process, and return the show urls found.
+    The show list file is written as in a normal run.
+    """
+    config = OmegaConf.to_container(rrc_rss.config.config)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="rrc_rss_showlists_") as tmpdir:
+        if not config["cache"]["file_shows"] or not config["cache"]["enabled"]:
+            config["cache"]["file_shows"] = os.path.join(tmpdir, "shows.json")
+        metrics_file = os.path.join(tmpdir, "metrics.json")
+        worker = context.Process(
+            target=crawl_showlists_worker,
+            args=(config, settings, metrics_file),
+            name="Showlist worker",
+        )
+        run_workers([worker])
+        read_metrics(metrics_file)
+        try:
+            with open(config["cache"]["file_shows"], "r") as f:
+                return [json.loads(line)["url"] for line in f]
+        except FileNotFoundError:
+            return []
+
+
+def crawl_sharded(show_urls, shards, settings):
+    """
+    Crawl the shows in `shards` worker processes, each with its own Twisted
+    reactor and downloader, then merge their results.
+
+    Each worker gets a copy of the seen episodes index and of the HTTP
+    validators, and writes its items to a file. The items of all shards are
+    then replayed through the usual CreatePodcastPipeline, which stores them,
+    assembles the combos across shards, and publishes the feeds. The seen
+    episodes and validators of the shards are merged back last, once the
+    episodes are stored.
+
+    Returns the number of failed shards. The items of the other shards are
+    still merged and published.
+    """
+    config = rrc_rss.config.config
+    context = multiprocessing.get_context("spawn")
+    do_cache = config.cache.enabled
+
+    with tempfile.TemporaryDirectory(prefix="rrc_rss_shards_") as tmpdir:
+        workers = []
+        shard_files = []
+        for shard, urls in enumerate(split_urls(show_urls, shards)):
+            files = SimpleNamespace(
+                items=os.path.join(tmpdir, f"items-{shard}.pkl"),
+                metrics=os.path.join(tmpdir, f"metrics-{shard}.json"),
+                seen=os.path.join(tmpdir, f"seen-{shard}.bin"),
+                validators=os.path.join(tmpdir, f"validators-{shard}.json"),
+            )
+            shard_files.append(files)
+
+            # Each shard reads and writes its own copy of the caches
+            shard_config = OmegaConf.to_container(config)
+            shard_settings = dict(settings)
+            if do_cache and config.cache.file_seen:
+                if os.path.exists(config.cache.file_seen):
+                    shutil.copyfile(config.cache.file_seen, files.seen)
+                shard_config["cache"]["file_seen"] = files.seen
+            if "CONDITIONAL_CACHE_FILE" in settings:
+                if os.path.exists(settings["CONDITIONAL_CACHE_FILE"]):
+                    shutil.copyfile(
+                        settings["CONDITIONAL_CACHE_FILE"], files.validators
+                    )
+                shard_settings["CONDITIONAL_CACHE_FILE"] = files.validators
+
+            workers.append(
+                context.Process(
+                    target=crawl_shard_worker,
+                    args=(
+                        shard,
+                        shard_config,
+                        shard_settings,
+                        urls,
+                        files.items,
+                        files.metrics,
+                    ),
+                    name=f"Shard {shard}",
+                )
+            )
+
+        logger.info(f"Crawling {len(show_urls)} shows in {shards} shards")
+        with metrics.timer("crawl_sharded"):
+            failed = run_workers(workers)
+        if failed:
+            logger.error(
+                f"{failed} of {shards} shards failed, merging the others"
+            )
+
+        # Merge the items of all shards through the podcast pipeline
+        with metrics.timer("merge"):
+            pipeline = CreatePodcastPipeline()
+            spider = SimpleNamespace(do_cache=do_cache)
+            pipeline.open_spider(spider)
+            for files in shard_files:
+                for item in read_items(files.items):
+                    pipeline.process_item(item, spider)
+            pipeline.publish()
+
+        for files in shard_files:
+            read_metrics(files.metrics)
+
+        # Merge the caches of the shards, now that their episodes are stored
+        if do_cache and config.cache.file_seen:
+            seen = SeenIndex(config.cache.file_seen)
+            seen.load()
+            for files in shard_files:
+                shard_seen = SeenIndex(files.seen)
+                shard_seen.load()
+                seen.update(shard_seen)
+            seen.save()
+        if "CONDITIONAL_CACHE_FILE" in settings:
+            merge_validators(
+                settings["CONDITIONAL_CACHE_FILE"],
+                [files.validators for files in shard_files],
+            )
+
+    return failed
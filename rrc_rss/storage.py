@@ -0,0 +1,805 @@
+import os
+import functools
+import hashlib
+import pickle
+import sqlite3
+import sys
+from array import array
+from datetime import datetime, timezone
+
+from podgen import Podcast, Episode, Media
+
+from rrc_rss.cache import atomic_write
+
+import logging
+
+logger = logging.getLogger("RRC_RSS")
+
+
+def feed_fingerprint(
+    episode_count, newest_date, description, website, explicit, show_category
+):
+    """
+    Cheap structural fingerprint of a feed, computed without rendering it.
+
+    Built from the number of episodes, the date of the newest episode and a
+    hash of the podcast metadata.
+    """
+    metadata = (description, website, bool(explicit), show_category)
+    metadata_hash = hashlib.md5(repr(metadata).encode()).hexdigest()
+    return f"{episode_count}|{newest_date or ''}|{metadata_hash}"
+
+
+def episode_date(date):
+    """
+    Date of an episode as stored. Feeds are only rendered with timezone-aware
+    dates, so a naive date is taken as UTC.
+    """
+    if date is not None and date.tzinfo is None:
+        return date.replace(tzinfo=timezone.utc)
+    return date
+
+
+def combo_episode_title(show_name, title):
+    """
+    Title of a show episode in a combo podcast
+    """
+    return f"{show_name}: {title}"
+
+
+class EpisodeRecord:
+    """
+    An episode, as kept in the pickle cache.
+
+    Only the scraped fields are kept, in slots, instead of a podgen Episode
+    and Media with all their attributes. The podgen Episode is only built
+    when the feed is rendered (see `to_episode`). Records are pickled as
+    plain tuples of their fields.
+    """
+
+    __slots__ = ("title", "audio_url", "audio_type", "summary", "date")
+
+    def __init__(self, title, audio_url, audio_type, summary, date):
+        self.title = title
+        self.audio_url = audio_url
+        self.audio_type = audio_type
+        self.summary = summary
+        self.date = date
+
+    def __reduce__(self):
+        return EpisodeRecord, (
+            self.title,
+            self.audio_url,
+            self.audio_type,
+            self.summary,
+            self.date,
+        )
+
+    def to_episode(self):
+        return Episode(
+            title=self.title,
+            media=Media(self.audio_url, type=self.audio_type),
+            summary=self.summary,
+            publication_date=self.date,
+        )
+
+
+class ComboEpisode:
+    """
+    An episode of a combo podcast: a reference to the record of the show
+    episode, shared with the show podcast, with the show name in the title
+    """
+
+    __slots__ = ("show_name", "record")
+
+    def __init__(self, show_name, record):
+        self.show_name = show_name
+        self.record = record
+
+    def __reduce__(self):
+        return ComboEpisode, (self.show_name, self.record)
+
+    @property
+    def title(self):
+        return combo_episode_title(self.show_name, self.record.title)
+
+    @property
+    def audio_url(self):
+        return self.record.audio_url
+
+    @property
+    def audio_type(self):
+        return self.record.audio_type
+
+    @property
+    def summary(self):
+        return self.record.summary
+
+    @property
+    def date(self):
+        return self.record.date
+
+    def to_episode(self):
+        episode = self.record.to_episode()
+        episode.title = self.title
+        return episode
+
+
+class PodcastRecord:
+    """
+    A podcast, as kept in the pickle cache: its metadata and its episode
+    records, oldest first. The episode index is not pickled, it is rebuilt
+    when first needed.
+    """
+
+    __slots__ = (
+        "name",
+        "description",
+        "website",
+        "explicit",
+        "show_category",
+        "episodes",
+        "index",
+    )
+
+    def __init__(
+        self,
+        name,
+        description,
+        website,
+        explicit,
+        show_category=None,
+        episodes=None,
+    ):
+        self.name = name
+        self.description = description
+        self.website = website
+        self.explicit = explicit
+        self.show_category = show_category
+        self.episodes = episodes if episodes is not None else []
+        self.index = None
+
+    def __reduce__(self):
+        return PodcastRecord, (
+            self.name,
+            self.description,
+            self.website,
+            self.explicit,
+            self.show_category,
+            self.episodes,
+        )
+
+    def to_podcast(self):
+        """
+        Build the podgen Podcast, without its episodes. They are built as the
+        feed is rendered, newest first, from `podcast.episode_source()`.
+        """
+        podcast = Podcast(
+            name=self.name,
+            description=self.description,
+            website=self.website,
+            explicit=self.explicit,
+        )
+        if self.show_category is not None:
+            podcast.show_category = self.show_category
+        podcast.episode_source = functools.partial(
+            self.iter_episodes, self.episodes
+        )
+        return podcast
+
+    @staticmethod
+    def iter_episodes(records):
+        oldest = datetime.min.replace(tzinfo=timezone.utc)
+        for record in sorted(
+            records, key=lambda record: record.date or oldest, reverse=True
+        ):
+            yield record.to_episode()
+
+
+class EpisodeIndex:
+    """
+    Index of the episodes of a podcast, keyed by title and by audio URL.
+
+    Replaces linear scans over the episodes with constant-time lookups.
+    Titles map to the episode records, so that combo podcasts can share
+    the records of their shows.
+    """
+
+    def __init__(self, episodes=()):
+        self.titles = {}
+        self.audio_urls = set()
+        self.newest = None
+        for episode in episodes:
+            self.add(episode.title, episode.audio_url, episode.date, episode)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def add(self, title, audio_url=None, date=None, episode=None):
+        self.titles[title] = episode
+        if audio_url:
+            self.audio_urls.add(audio_url)
+        if date and (self.newest is None or date > self.newest):
+            self.newest = date
+
+    def contains(self, title, audio_url=None):
+        """
+        Check if an episode with the same title or the same audio URL exists
+        """
+        return title in self.titles or (
+            audio_url is not None and audio_url in self.audio_urls
+        )
+
+
+class PickleStorage:
+    """
+    Keeps all podcasts in memory as compact records, saved as a single pickle
+    file.
+
+    The episodes of combo podcasts are references to the records of their
+    shows, so each episode is kept and pickled once. Podcasts from older
+    cache files, pickled as podgen objects, are converted when loaded.
+
+    If `filename` is None, nothing is loaded or saved (caching disabled).
+    The names of podcasts changed during the run are kept in `dirty`.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.podcasts = {}
+        self.dirty = set()
+
+    def open(self):
+        if not self.filename:
+            return
+        try:
+            with open(self.filename, "rb") as f:
+                self.podcasts = pickle.load(f)
+                logger.info(
+                    f"Loaded {len(self.podcasts)} podcasts "
+                    f"from {self.filename}"
+                )
+        except FileNotFoundError:
+            self.podcasts = {}
+        if any(
+            isinstance(podcast, Podcast) for podcast in self.podcasts.values()
+        ):
+            self.podcasts = self.convert(self.podcasts)
+
+    @staticmethod
+    def convert(podcasts):
+        """
+        Convert podgen Podcasts from an older cache file to records. Episodes
+        of combos which are also in their show are linked to the show episode.
+        """
+        records = {}
+
+        def episode_record(episode):
+            return EpisodeRecord(
+                episode.title,
+                episode.media.url if episode.media else None,
+                episode.media.type if episode.media else None,
+                episode.summary,
+                episode.publication_date,
+            )
+
+        # Shows first, then combos, which refer to the shows
+        def is_combo(podcast):
+            return getattr(podcast, "show_category", None) == "Combo"
+
+        def show_episode(title, audio_url):
+            # Show names may contain ": " too, so try each split of the title
+            # into a show name and the title of the show episode
+            end = title.find(": ")
+            while end != -1:
+                show = records.get(title[:end])
+                if show is not None and show.show_category != "Combo":
+                    if show.index is None:
+                        show.index = EpisodeIndex(show.episodes)
+                    start = end + len(": ")
+                    episode = show.index.titles.get(title[start:])
+                    if episode is not None and episode.audio_url == audio_url:
+                        return show.name, episode
+                end = title.find(": ", end + 1)
+            return None, None
+
+        for name, podcast in sorted(
+            podcasts.items(), key=lambda item: is_combo(item[1])
+        ):
+            record = PodcastRecord(
+                name,
+                podcast.description,
+                podcast.website,
+                podcast.explicit,
+                getattr(podcast, "show_category", None),
+            )
+            for episode in podcast.episodes:
+                show_name = shared = None
+                if is_combo(podcast):
+                    show_name, shared = show_episode(
+                        episode.title,
+                        episode.media.url if episode.media else None,
+                    )
+                if shared is not None:
+                    record.episodes.append(
+                        ComboEpisode(sys.intern(show_name), shared)
+                    )
+                else:
+                    record.episodes.append(episode_record(episode))
+            records[name] = record
+        logger.info(f"Converted {len(records)} podcasts to episode records")
+        return records
+
+    def save(self):
+        if not self.filename:
+            return
+        with atomic_write(self.filename) as f:
+            pickle.dump(self.podcasts, f, protocol=pickle.HIGHEST_PROTOCOL)
+        logger.info(f"Saved {len(self.podcasts)} podcasts to {self.filename}")
+
+    def close(self):
+        pass
+
+    def __contains__(self, name):
+        return name in self.podcasts
+
+    def __len__(self):
+        return len(self.podcasts)
+
+    def __iter__(self):
+        return self.iter_podcasts()
+
+    def names(self):
+        return list(self.podcasts)
+
+    def iter_podcasts(self, names=None):
+        """
+        Iterate over the podgen Podcast objects, optionally only the given
+        names. Their episodes are built when the feed is rendered, from
+        `podcast.episode_source()`.
+        """
+        for name in self.names() if names is None else names:
+            yield self.podcasts[name].to_podcast()
+
+    def update_podcast(self, name, description, website, explicit, **kwargs):
+        """
+        Create or update a podcast with the given metadata
+        """
+        if name not in self.podcasts:
+            self.podcasts[name] = PodcastRecord(
+                name, description, website, explicit
+            )
+            self.dirty.add(name)
+        podcast = self.podcasts[name]
+        metadata = (
+            description,
+            website,
+            explicit,
+            kwargs.get("show_category"),
+        )
+        if (
+            podcast.description,
+            podcast.website,
+            podcast.explicit,
+            podcast.show_category,
+        ) != metadata:
+            (
+                podcast.description,
+                podcast.website,
+                podcast.explicit,
+                podcast.show_category,
+            ) = metadata
+            self.dirty.add(name)
+
+    def website(self, name):
+        return self.podcasts[name].website
+
+    def episode_index(self, name):
+        """
+        Get the episode index of a podcast, building it on first use
+        """
+        podcast = self.podcasts[name]
+        if podcast.index is None:
+            podcast.index = EpisodeIndex(podcast.episodes)
+        return podcast.index
+
+    def has_episode(self, name, title, audio_url=None):
+        return self.episode_index(name).contains(title, audio_url)
+
+    def add_episode(self, name, title, audio_url, audio_type, summary, date):
+        date = episode_date(date)
+        record = EpisodeRecord(title, audio_url, audio_type, summary, date)
+        self.podcasts[name].episodes.append(record)
+        self.episode_index(name).add(title, audio_url, date, record)
+        self.dirty.add(name)
+
+    def add_combo_episode(
+        self, name, show_name, title, audio_url, audio_type, summary, date
+    ):
+        """
+        Add an episode of a show to a combo podcast. The combo refers to the
+        record of the show episode, when the show has it.
+        """
+        date = episode_date(date)
+        record = (
+            self.episode_index(show_name).titles.get(title)
+            if show_name in self.podcasts
+            else None
+        )
+        if record is None or record.audio_url != audio_url:
+            record = EpisodeRecord(title, audio_url, audio_type, summary, date)
+        episode = ComboEpisode(sys.intern(show_name), record)
+        self.podcasts[name].episodes.append(episode)
+        self.episode_index(name).add(episode.title, audio_url, date, episode)
+        self.dirty.add(name)
+
+    def fingerprint(self, name):
+        podcast = self.podcasts[name]
+        newest = self.episode_index(name).newest
+        return feed_fingerprint(
+            len(podcast.episodes),
+            newest.isoformat() if newest else None,
+            podcast.description,
+            podcast.website,
+            podcast.explicit,
+            podcast.show_category,
+        )
+
+
+class SQLiteStorage:
+    """
+    Keeps shows and episodes in an indexed SQLite database.
+
+    Only new or changed rows are written during a run, and podcasts are
+    loaded one at a time when iterating, so the full archive is never held
+    in memory as podgen objects.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS podcasts (
+            name            TEXT PRIMARY KEY,
+            description     TEXT,
+            website         TEXT,
+            explicit        INTEGER,
+            show_category   TEXT
+        );
+        CREATE TABLE IF NOT EXISTS episodes (
+            id              INTEGER PRIMARY KEY,
+            podcast         TEXT NOT NULL REFERENCES podcasts(name),
+            title           TEXT NOT NULL,
+            audio_url       TEXT,
+            audio_type      TEXT,
+            summary         TEXT,
+            date            TEXT
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS episodes_title
+            ON episodes(podcast, title);
+        CREATE INDEX IF NOT EXISTS episodes_audio_url
+            ON episodes(podcast, audio_url);
+    """
+
+    def __init__(self, filename, migrate_from=None):
+        self.filename = filename
+        self.migrate_from = migrate_from
+        self.db = None
+        self.dirty = set()
+
+    def open(self):
+        # Podcasts are published from a worker thread (see
+        # CreatePodcastPipeline.close_spider), after the crawl is done with
+        # the storage
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.filename, check_same_thread=False)
+        self.db.executescript(self.schema)
+
+        # One-shot migration from the pickle cache, when the database is new
+        if (
+            self.migrate_from
+            and len(self) == 0
+            and os.path.exists(self.migrate_from)
+        ):
+            self.migrate(self.migrate_from)
+
+    def save(self):
+        self.db.commit()
+        logger.info(f"Saved {len(self)} podcasts to {self.filename}")
+
+    def close(self):
+        self.db.close()
+        self.db = None
+
+    def migrate(self, pickle_filename):
+        """
+        Import all podcasts and episodes from a pickle cache file
+        """
+        source = PickleStorage(pickle_filename)
+        source.open()
+        for podcast in source.podcasts.values():
+            self.update_podcast(
+                name=podcast.name,
+                description=podcast.description,
+                website=podcast.website,
+                explicit=podcast.explicit,
+                show_category=podcast.show_category,
+            )
+            for episode in podcast.episodes:
+                if not self.has_episode(podcast.name, episode.title):
+                    self.add_episode(
+                        podcast.name,
+                        episode.title,
+                        episode.audio_url,
+                        episode.audio_type,
+                        episode.summary,
+                        episode.date,
+                    )
+        self.db.commit()
+        logger.info(
+            f"Migrated {len(source)} podcasts from {pickle_filename} "
+            f"to {self.filename}"
+        )
+
+    def __contains__(self, name):
+        return (
+            self.db.execute(
+                "SELECT 1 FROM podcasts WHERE name = ?", (name,)
+            ).fetchone()
+            is not None
+        )
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM podcasts").fetchone()[0]
+
+    def __iter__(self):
+        return self.iter_podcasts()
+
+    def names(self):
+        return [
+            row[0]
+            for row in self.db.execute(
+                "SELECT name FROM podcasts ORDER BY rowid"
+            )
+        ]
+
+    def iter_podcasts(self, names=None):
+        """
+        Iterate over the podgen Podcast objects, optionally only the given
+        names. Each podcast is loaded from the database only when it is
+        reached, and its episodes only when the feed is rendered, from
+        `podcast.episode_source()`.
+        """
+        for name in self.names() if names is None else names:
+            podcast = self.podcast(name, with_episodes=False)
+            podcast.episode_source = functools.partial(
+                self.iter_episodes, name
+            )
+            yield podcast
+
+    def update_podcast(self, name, description, website, explicit, **kwargs):
+        """
+        Create or update a podcast with the given metadata
+        """
+        row = (
+            name,
+            description,
+            website,
+            int(bool(explicit)),
+            kwargs.get("show_category"),
+        )
+        old_row = self.db.execute(
+            "SELECT name, description, website, explicit, show_category "
+            "FROM podcasts WHERE name = ?",
+            (name,),
+        ).fetchone()
+        if old_row != row:
+            self.db.execute(
+                "INSERT INTO podcasts VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET "
+                "description = excluded.description, "
+                "website = excluded.website, "
+                "explicit = excluded.explicit, "
+                "show_category = excluded.show_category",
+                row,
+            )
+            self.dirty.add(name)
+
+    def website(self, name):
+        return self.db.execute(
+            "SELECT website FROM podcasts WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    def has_episode(self, name, title, audio_url=None):
+        # One lookup per index: with an OR, SQLite scans all the episodes of
+        # the podcast
+        return (
+            self.db.execute(
+                "SELECT 1 FROM episodes WHERE podcast = ?1 AND title = ?2 "
+                "UNION ALL "
+                "SELECT 1 FROM episodes WHERE podcast = ?1 AND audio_url = ?3 "
+                "LIMIT 1",
+                (name, title, audio_url),
+            ).fetchone()
+            is not None
+        )
+
+    def add_episode(self, name, title, audio_url, audio_type, summary, date):
+        self.db.execute(
+            "INSERT INTO episodes "
+            "(podcast, title, audio_url, audio_type, summary, date) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                title,
+                audio_url,
+                audio_type,
+                summary,
+                episode_date(date).isoformat() if date else None,
+            ),
+        )
+        self.dirty.add(name)
+
+    def add_combo_episode(
+        self, name, show_name, title, audio_url, audio_type, summary, date
+    ):
+        self.add_episode(
+            name,
+            combo_episode_title(show_name, title),
+            audio_url,
+            audio_type,
+            summary,
+            date,
+        )
+
+    def fingerprint(self, name):
+        description, website, explicit, show_category = self.db.execute(
+            "SELECT description, website, explicit, show_category "
+            "FROM podcasts WHERE name = ?",
+            (name,),
+        ).fetchone()
+        episode_count, newest = self.db.execute(
+            "SELECT COUNT(*), MAX(date) FROM episodes WHERE podcast = ?",
+            (name,),
+        ).fetchone()
+        return feed_fingerprint(
+            episode_count,
+            newest,
+            description,
+            website,
+            explicit,
+            show_category,
+        )
+
+    def podcast(self, name, with_episodes=True):
+        """
+        Build the podgen Podcast object of a single podcast
+        """
+        description, website, explicit, show_category = self.db.execute(
+            "SELECT description, website, explicit, show_category "
+            "FROM podcasts WHERE name = ?",
+            (name,),
+        ).fetchone()
+        podcast = Podcast(
+            name=name,
+            description=description,
+            website=website,
+            explicit=bool(explicit),
+        )
+        if show_category is not None:
+            podcast.show_category = show_category
+
+        if with_episodes:
+            for title, audio_url, audio_type, summary, date in self.db.execute(
+                "SELECT title, audio_url, audio_type, summary, date "
+                "FROM episodes WHERE podcast = ? ORDER BY id",
+                (name,),
+            ):
+                podcast.add_episode(
+                    self.episode(title, audio_url, audio_type, summary, date)
+                )
+        return podcast
+
+    @staticmethod
+    def episode(title, audio_url, audio_type, summary, date):
+        return Episode(
+            title=title,
+            media=Media(audio_url, type=audio_type),
+            summary=summary,
+            publication_date=datetime.fromisoformat(date) if date else None,
+        )
+
+    def iter_episodes(self, name):
+        """
+        Iterate over the episodes of a podcast, newest first, undated ones
+        last. Rows are read from the database as they are consumed.
+        """
+        cursor = self.db.execute(
+            "SELECT title, audio_url, audio_type, summary, date "
+            "FROM episodes WHERE podcast = ? "
+            "ORDER BY date IS NULL, date DESC, id",
+            (name,),
+        )
+        for row in cursor:
+            yield self.episode(*row)
+
+
+class SeenIndex:
+    """
+    Set of the episode URLs already parsed, for all shows.
+
+    Stored on disk as a flat array of 64-bit URL digests, so the file stays
+    compact and membership checks take constant time. If `filename` is None,
+    nothing is loaded or saved.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.keys = set()
+        self.changed = False
+
+    @staticmethod
+    def key(url):
+        return int.from_bytes(
+            hashlib.blake2b(url.encode(), digest_size=8).digest(), "little"
+        )
+
+    def load(self):
+        if not self.filename:
+            return
+        keys = array("Q")
+        try:
+            with open(self.filename, "rb") as f:
+                keys.frombytes(f.read())
+        except FileNotFoundError:
+            pass
+        self.keys = set(keys)
+        logger.debug(
+            f"Loaded {len(self.keys)} seen episodes from {self.filename}"
+        )
+
+    def save(self):
+        """
+        Write the index atomically, so that an interrupted run never leaves
+        a truncated index behind
+        """
+        if not self.filename or not self.changed:
+            return
+        with atomic_write(self.filename) as f:
+            f.write(array("Q", self.keys).tobytes())
+        self.changed = False
+        logger.debug(
+            f"Saved {len(self.keys)} seen episodes to {self.filename}"
+        )
+
+    def __contains__(self, url):
+        return SeenIndex.key(url) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, url):
+        self.keys.add(SeenIndex.key(url))
+        self.changed = True
+
+    def update(self, other):
+        """
+        Add all the episodes of another index, e.g. of a crawl shard
+        """
+        if not other.keys <= self.keys:
+            self.keys |= other.keys
+            self.changed = True
+
+
+def create_storage(cache_config, enabled=True):
+    """
+    Create the podcast storage backend selected in the `cache` config section
+    """
+    if not enabled:
+        return PickleStorage()
+    if cache_config.backend == "pickle":
+        return PickleStorage(cache_config.file_podcasts)
+    if cache_config.backend == "sqlite":
+        return SQLiteStorage(
+            cache_config.file_db, migrate_from=cache_config.file_podcasts
+        )
+    raise ValueError(f"Unknown cache backend: {cache_config.backend}")
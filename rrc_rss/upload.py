@@ -2,44 +2,150 @@
 from slugify import slugify
 from podgen import Podcast
 import hashlib
+import io
+import json
+import multiprocessing
 import pickle
-import re
-import gistyc
-import dropbox
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait, FIRST_COMPLETED)
 import rrc_rss.config
-import rrc_rss.pastebin as pastebin
+from rrc_rss.cache import atomic_write
+from rrc_rss.feed import FeedWriter, newest_first
+from rrc_rss.metrics import metrics
 
 import logging
 logger = logging.getLogger('RRC_RSS')
 
+
+class RenderedFeed:
+    """
+    A podcast serialized once to RSS bytes, together with its content hash.
+
+    The hash leaves out the <lastBuildDate> text, which changes on every
+    render. Instead of rewriting the document, the bytes before and after
+    that text are fed to the hash in a single pass, which gives the same
+    digest as hashing the document with an empty
+    <lastBuildDate></lastBuildDate>.
+    """
+
+    volatile_start = b'<lastBuildDate>'
+    volatile_end = b'</lastBuildDate>'
+
+    def __init__(self, podcast: Podcast, max_episodes=None):
+        self.name = podcast.name
+        self.filename = PodcastsUploader.filename(podcast)
+        with metrics.timer('render'):
+            self.data = RenderedFeed.render(podcast, max_episodes)
+            self.hash = RenderedFeed.content_hash(self.data)
+        metrics.count('feeds_rendered')
+
+    @staticmethod
+    def render(podcast: Podcast, max_episodes=None):
+        """
+        Serialize a podcast to UTF-8 bytes, streaming the episodes newest first
+        (same output as `rss_str()` with the episodes in that order).
+
+        The episodes come from `podcast.episode_source()` when the storage
+        builds them lazily (see `iter_podcasts` of the storage backends),
+        otherwise from `podcast.episodes`.
+        """
+        episode_source = getattr(podcast, 'episode_source', None)
+        if episode_source:
+            episodes = episode_source()
+        else:
+            episodes = newest_first(podcast.episodes)
+        buffer = io.BytesIO()
+        FeedWriter(max_episodes=max_episodes).write(podcast, episodes, buffer)
+        return buffer.getvalue()
+
+    @staticmethod
+    def content_hash(data):
+        md5 = hashlib.md5()
+        view = memoryview(data)
+        start = data.find(RenderedFeed.volatile_start)
+        end = -1
+        if start != -1:
+            end = data.find(RenderedFeed.volatile_end, start)
+        if end == -1:
+            md5.update(view)
+        else:
+            md5.update(view[:start + len(RenderedFeed.volatile_start)])
+            md5.update(view[end:])
+        return md5.hexdigest()
+
+
 class PodcastsUploader():
 
     def __init__(self,
                  podcasts,
                  gist_token=None,
+                 gist_api_url='https://api.github.com',
+                 gist_batch_size=20,
+                 gist_client=None,
                  pastebin_api_key=None,
                  pastebin_username=None,
                  pastebin_password=None,
+                 pastebin_api_url='https://pastebin.com/api/',
+                 pastebin_workers=1,
+                 pastebin_client=None,
                  dropbox_token=None,
                  dropbox_refresh_token=None,
                  dropbox_app_key=None,
                  dropbox_app_secret=None,
-                 dropbox_folder=''):
-
-        if not isinstance(podcasts, list) and not isinstance(podcasts, tuple):
+                 dropbox_folder='',
+                 dropbox_workers=1,
+                 dropbox_retries=3,
+                 dropbox_backoff=1.0,
+                 dropbox_client=None,
+                 max_episodes=None,
+                 render_workers=1):
+
+        # A single podcast, or any iterable of podcasts (e.g. a storage
+        # backend)
+        if isinstance(podcasts, Podcast):
             podcasts = [podcasts]
 
         self.podcasts = podcasts
         self.gist_token = gist_token
+        self.gist_api_url = gist_api_url
+        self.gist_batch_size = max(1, gist_batch_size)
+        self.gist_client = gist_client
         self.pastebin_api_key = pastebin_api_key
         self.pastebin_username = pastebin_username
         self.pastebin_password = pastebin_password
+        self.pastebin_api_url = pastebin_api_url
+        self.pastebin_workers = max(1, pastebin_workers)
+        self.pastebin_client = pastebin_client
         self.dropbox_token = dropbox_token
         self.dropbox_refresh_token = dropbox_refresh_token
         self.dropbox_app_key = dropbox_app_key
         self.dropbox_app_secret = dropbox_app_secret
         self.dropbox_folder = dropbox_folder
-
+        self.dropbox_workers = max(1, dropbox_workers)
+        self.dropbox_retries = dropbox_retries
+        self.dropbox_backoff = dropbox_backoff
+        self.dropbox_client = dropbox_client
+        self.max_episodes = max_episodes
+        self.render_workers = max(1, render_workers)
+        self.rendered = None
+        self.published = set()
+
+    def has_credentials(self, backend):
+        """
+        Check if an upload backend has a client or the credentials to create
+        one
+        """
+        if backend == 'gist':
+            return bool(self.gist_client or self.gist_token)
+        if backend == 'pastebin':
+            return bool(self.pastebin_client or self.pastebin_api_key)
+        if backend == 'dropbox':
+            return bool(self.dropbox_client or
+                        (self.dropbox_token and self.dropbox_refresh_token))
+        raise ValueError(f"Unknown upload backend: {backend}")
 
     @staticmethod
     def filename(podcast: Podcast):
@@ -51,113 +157,421 @@ class PodcastsUploader():
         filename += slugify(podcast.name).capitalize() + '.xml'
         return filename
 
-    def to_file(self, podcast: Podcast):
-        for podcast in self.podcasts:
-            podcast.rss_file(PodcastsUploader.filename(podcast))
+    def feeds(self):
+        """
+        Render each podcast once. The rendered feeds are kept, so that all
+        uploaders reuse the same buffers.
+        """
+        if self.rendered is None:
+            if self.render_workers > 1:
+                self.rendered = self.render_parallel()
+            else:
+                self.rendered = []
+                for podcast in self.podcasts:
+                    # A podcast which fails to render is skipped, as in
+                    # `render_parallel`, so it does not block the others
+                    try:
+                        feed = RenderedFeed(podcast, self.max_episodes)
+                    except Exception as e:
+                        logger.error(f"Error rendering {podcast.name}: {e}")
+                        continue
+                    self.rendered.append(feed)
+                    self.log_progress()
+            logger.info(f"Rendered {len(self.rendered)} feeds")
+        return self.rendered
+
+    def log_progress(self, every=100):
+        if len(self.rendered) % every == 0:
+            logger.info(f"Rendered {len(self.rendered)} feeds so far")
+
+    def render_parallel(self):
+        """
+        Render the feeds in a pool of processes, to use several cores.
+
+        Podcasts are sent to the workers in order, with at most two per worker
+        queued at a time, so that lazily loaded podcasts are only materialized
+        shortly before they are rendered.
+        """
+        self.rendered = []
+        pending = deque()
+
+        def collect():
+            podcast_name, future = pending.popleft()
+            try:
+                self.rendered.append(future.result())
+            except Exception as e:
+                logger.error(f"Error rendering {podcast_name}: {e}")
+                return
+            metrics.count('feeds_rendered')
+            self.log_progress()
+
+        context = multiprocessing.get_context('spawn')
+        with metrics.timer('render'), \
+                ProcessPoolExecutor(max_workers=self.render_workers,
+                                    mp_context=context) as executor:
+            for podcast in self.podcasts:
+                # Episodes loaded lazily from the storage are read here, the
+                # storage itself cannot be sent to the workers
+                episode_source = getattr(podcast, 'episode_source', None)
+                if episode_source:
+                    podcast.episodes = list(episode_source())
+                    del podcast.episode_source
+
+                if len(pending) >= 2 * self.render_workers:
+                    collect()
+                future = executor.submit(RenderedFeed, podcast,
+                                         self.max_episodes)
+                pending.append((podcast.name, future))
+            while pending:
+                collect()
+        return self.rendered
+
+    def to_file(self):
+        for feed in self.feeds():
+            with open(feed.filename, 'wb') as f:
+                f.write(feed.data)
 
     def to_gist(self):
-        if self.gist_token:
-            gist_api = gistyc.GISTyc(auth_token=self.gist_token)
-            gists = gist_api.get_gists()
+        """
+        Upload the feeds as gist files, one file per feed.
+
+        The gists are listed once, to map each feed file to its gist. Changed
+        feeds are then sent in multi-file updates, one call per gist and
+        batch, and new feeds in new gists of up to `gist_batch_size` files.
+        Feeds whose content hash did not change since the last upload are
+        skipped.
+        """
+        from rrc_rss.gist import GistClient, GistAPIError
+
+        if self.gist_client is None:
+            if not self.gist_token:
+                logger.warning(
+                    'No Github token provided. Not pushing to Github gists.')
+                return
+            self.gist_client = GistClient(self.gist_token,
+                                          api_url=self.gist_api_url)
+        client = self.gist_client
+
+        feeds = self.feeds()
+        if not feeds:
+            return
+        hashes = self.load_hashes()
+        index = client.file_index()
+
+        # Group the changed feeds by gist, new feeds go to new gists
+        updates = defaultdict(list)
+        new_feeds = []
+        for feed in feeds:
+            if (hashes.get(f'gist:{feed.filename}') == feed.hash and
+                    feed.filename in index):
+                logger.debug(f"{feed.name} unchanged, not uploaded to gist")
+                metrics.count('gists_unchanged')
+                self.published.add(feed.name)
+                continue
+            if feed.filename in index:
+                updates[index[feed.filename]].append(feed)
+            else:
+                new_feeds.append(feed)
 
-            for podcast in self.podcasts:
+        def batches(feeds):
+            for start in range(0, len(feeds), self.gist_batch_size):
+                yield feeds[start:start + self.gist_batch_size]
 
-                filename = PodcastsUploader.filename(podcast)
-
-                # Check if the gist is already present
-                is_gist_present = False
-                for gist in gists:
-                    if filename in gist['files']:
-                        is_gist_present = True
-                        break
-
-                if is_gist_present:
-                    logger.debug(f'Updating gist {filename}')
-                    gist_api.update_gist(file_name=filename)
-                else:
-                    logger.debug(f'Creating gist {filename}')
-                    gist_api.create_gist(filename)
-        else:
-            logger.warning('No Github token provided. Not pushing to Github gists.')
+        def uploaded(feeds):
+            for feed in feeds:
+                hashes[f'gist:{feed.filename}'] = feed.hash
+                self.published.add(feed.name)
+            metrics.count('gists_uploaded', len(feeds))
 
+        try:
+            for gist_id, feeds in updates.items():
+                for batch in batches(feeds):
+                    try:
+                        client.update_gist(gist_id, {
+                            feed.filename: feed.data.decode()
+                            for feed in batch})
+                    except GistAPIError as e:
+                        logger.error(f"Error updating gist {gist_id}: {e}")
+                        continue
+                    logger.info(
+                        f"Updated {len(batch)} files in gist {gist_id}")
+                    uploaded(batch)
+
+            for batch in batches(new_feeds):
+                try:
+                    gist_id = client.create_gist(
+                        {feed.filename: feed.data.decode() for feed in batch},
+                        description='Radio Romania Cultural podcasts',
+                        public=True)
+                except GistAPIError as e:
+                    logger.error(f"Error creating gist: {e}")
+                    continue
+                logger.info(f"Created gist {gist_id} with {len(batch)} files")
+                uploaded(batch)
+        finally:
+            self.save_hashes(hashes)
+
+    def load_hashes(self):
+        """
+        Read the content hashes of the files uploaded in previous runs
+        """
+        filename = rrc_rss.config.config.cache.file_hashes
+        if not filename:
+            return {}
+        try:
+            with open(filename, 'rb') as f:
+                hashes = pickle.load(f)
+                logger.info(f"Hashes loaded from {filename}")
+                return hashes
+        except FileNotFoundError:
+            return {}
 
+    def save_hashes(self, hashes):
+        filename = rrc_rss.config.config.cache.file_hashes
+        if not filename:
+            return
+        with atomic_write(filename) as f:
+            pickle.dump(hashes, f)
+        logger.info(f"Hashes saved to {filename}")
 
     def to_pastebin(self):
-
-        api = pastebin.PasteBin(self.pastebin_api_key)
-        api.api_user_key = api.create_user_key(self.pastebin_password, self.pastebin_password)
-
-        for podcast in self.podcasts:
-            result = api.paste(podcast.rss_str(),
-                                guest=False,
-                                name=podcast.name,
-                                format='xml',
-                                private='0',
-                                expire='N')
-            logger.debug(f'Pastebin URL: {result}')
-
-
-    def to_dropbox(self):
-
-        if not self.dropbox_token:
-            logger.warning('No Dropbox token provided. Not pushing to Dropbox.')
+        """
+        Paste the changed feeds to PasteBin, up to `pastebin_workers` at a
+        time.
+
+        The user key is kept in the PasteBin cache file with the paste of each
+        feed, so the login only happens on the first run or when the key is
+        rejected. PasteBin cannot edit pastes: a changed feed gets a new paste
+        and the previous one is deleted. Unchanged feeds are skipped.
+        """
+        import rrc_rss.pastebin as pastebin
+
+        if self.pastebin_client is None:
+            if not self.pastebin_api_key:
+                logger.warning(
+                    'No PasteBin API key provided. Not pushing to PasteBin.')
+                return
+            self.pastebin_client = pastebin.PasteBin(
+                self.pastebin_api_key, api_url=self.pastebin_api_url,
+                pool_size=self.pastebin_workers)
+        api = self.pastebin_client
+
+        hashes = self.load_hashes()
+        state = self.load_pastebin_state()
+        pastes = state.setdefault('pastes', {})
+        login_lock = threading.Lock()
+
+        def login(rejected_key=None):
+            with login_lock:
+                # Another thread may have logged in again already
+                if api.api_user_key and api.api_user_key != rejected_key:
+                    return
+                api.api_user_key = api.create_user_key(
+                    self.pastebin_username, self.pastebin_password)
+                state['user_key'] = api.api_user_key
+                logger.info('Logged in to PasteBin')
+
+        def paste(feed):
+            for attempt in range(2):
+                user_key = api.api_user_key
+                try:
+                    return api.paste(feed.data.decode(), guest=False,
+                                     name=feed.name, format='xml',
+                                     private='0', expire='N')
+                except pastebin.PasteBinError as e:
+                    if attempt or 'invalid api_user_key' not in str(e):
+                        raise
+                login(user_key)
+
+        api.api_user_key = api.api_user_key or state.get('user_key')
+        try:
+            if not api.api_user_key:
+                login()
+        except Exception as e:
+            logger.error(f"Error logging in to PasteBin: {e}")
             return
 
-        if not self.dropbox_refresh_token:
-            logger.warning('No Dropbox refresh token provided. Not pushing to Dropbox.')
-            return
+        pending = {}
 
-        # Connect to Dropbox
-        dbx = dropbox.Dropbox(
-            oauth2_access_token=self.dropbox_token,
-            oauth2_refresh_token=self.dropbox_refresh_token,
-            app_key=self.dropbox_app_key,
-            app_secret=self.dropbox_app_secret
-        )
+        def collect(futures):
+            for future in futures:
+                feed = pending.pop(future)
+                try:
+                    url = future.result()
+                except Exception as e:
+                    logger.error(
+                        f"Error pasting {feed.name} to PasteBin: {e}")
+                    metrics.count('pastes_failed')
+                    continue
+                metrics.count('pastes_uploaded')
+                logger.info(f"{feed.name} pasted to {url}")
+                old_url = pastes.get(feed.filename)
+                if old_url and old_url != url:
+                    try:
+                        api.delete_paste(old_url.rsplit('/', 1)[-1])
+                    except Exception as e:
+                        logger.warning(f"Error deleting the old paste "
+                                       f"{old_url} of {feed.name}: {e}")
+                pastes[feed.filename] = url
+                hashes[f'pastebin:{feed.filename}'] = feed.hash
+                self.published.add(feed.name)
 
-        # Read existing file content hashes
         try:
-            with open(rrc_rss.config.config.cache.file_hashes, 'rb') as f:
-                hashes = pickle.load(f)
-                logger.info(f"Hashes loaded from {rrc_rss.config.config.cache.file_hashes}")
+            with ThreadPoolExecutor(
+                    max_workers=self.pastebin_workers) as executor:
+                for feed in self.feeds():
+                    unchanged = (
+                        hashes.get(f'pastebin:{feed.filename}') == feed.hash)
+                    if unchanged and feed.filename in pastes:
+                        logger.debug(
+                            f"{feed.name} unchanged, not pasted to PasteBin")
+                        metrics.count('pastes_unchanged')
+                        self.published.add(feed.name)
+                        continue
+
+                    # Bound the number of pastes queued in the pool
+                    if len(pending) >= 2 * self.pastebin_workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    pending[executor.submit(paste, feed)] = feed
+
+                collect(list(pending))
+        finally:
+            self.save_hashes(hashes)
+            self.save_pastebin_state(state)
+
+    def load_pastebin_state(self):
+        """
+        Read the PasteBin user key and the paste url of each feed
+        """
+        filename = rrc_rss.config.config.cache.file_pastebin
+        if not filename:
+            return {}
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
         except FileNotFoundError:
-            hashes = {}
+            return {}
 
-        for podcast in self.podcasts:
+    def save_pastebin_state(self, state):
+        filename = rrc_rss.config.config.cache.file_pastebin
+        if not filename:
+            return
+        with atomic_write(filename, 'w') as f:
+            json.dump(state, f, indent=1)
 
-            # Define the file path
-            file_path = f'{self.dropbox_folder}/{PodcastsUploader.filename(podcast)}'
+    def dropbox_upload(self, dbx, file_data, file_path):
+        """
+        Upload a single file to Dropbox, retrying with exponential backoff.
 
-            # Compute the file hash and compare with the old one
-            # Remove the lastBuildDate tag before hashing, as this changes every time
-            file_data = podcast.rss_str()
-            file_data = re.sub(r"<lastBuildDate>.*?</lastBuildDate>", "<lastBuildDate></lastBuildDate>", file_data, flags=re.DOTALL)
-            file_data = file_data.encode()
-            file_hash = hashlib.md5(file_data).hexdigest()
-            file_unchanged = file_path in hashes and hashes[file_path] == file_hash
+        Authentication and bad input errors are not retried.
+        """
+        import dropbox
 
-            # Upload only if the file has changed
-            if not file_unchanged:
-                try:
+        for attempt in range(self.dropbox_retries + 1):
+            try:
+                with metrics.timer('dropbox_upload'):
                     dbx.files_upload(
-                        podcast.rss_str().encode(),
+                        file_data,
                         file_path,
                         mode=dropbox.files.WriteMode("overwrite")
                     )
-                except Exception as e:
-                    logger.error(f"Error uploading {podcast.name} to Dropbox: {e}")
-
-                logger.info(f"{podcast.name} uploaded to Dropbox at {file_path}")
+                return
+            except (dropbox.exceptions.AuthError,
+                    dropbox.exceptions.BadInputError,
+                    dropbox.exceptions.ApiError):
+                raise
+            except Exception as e:
+                if attempt == self.dropbox_retries:
+                    raise
+                delay = (getattr(e, 'backoff', None) or
+                         self.dropbox_backoff * 2 ** attempt)
+                logger.warning(f"Error uploading {file_path} to Dropbox "
+                               f"(attempt {attempt + 1}): {e}. "
+                               f"Retrying in {delay}s")
+                time.sleep(delay)
 
-                # Save the new hash
-                hashes[file_path] = file_hash
+    def to_dropbox(self):
+        import dropbox
+
+        if self.dropbox_client is None:
+            if not self.dropbox_token:
+                logger.warning(
+                    'No Dropbox token provided. Not pushing to Dropbox.')
+                return
+
+            if not self.dropbox_refresh_token:
+                logger.warning('No Dropbox refresh token provided. '
+                               'Not pushing to Dropbox.')
+                return
+
+            # Connect to Dropbox, with one connection per upload worker
+            self.dropbox_client = dropbox.Dropbox(
+                oauth2_access_token=self.dropbox_token,
+                oauth2_refresh_token=self.dropbox_refresh_token,
+                app_key=self.dropbox_app_key,
+                app_secret=self.dropbox_app_secret,
+                session=dropbox.create_session(
+                    max_connections=self.dropbox_workers)
+            )
+        dbx = self.dropbox_client
 
-            else:
-                logger.debug(f"{podcast.name} unchanged, not uploaded to Dropbox")
+        # Read existing file content hashes
+        hashes = self.load_hashes()
 
-        # Save the new hashes
-        with open(rrc_rss.config.config.cache.file_hashes, 'wb') as f:
-            pickle.dump(hashes, f)
-            logger.info(f"Hashes saved to {rrc_rss.config.config.cache.file_hashes}")
+        # Uploads run in a thread pool sharing the same Dropbox session.
+        # Hashes are only updated here, in the calling thread, when an upload
+        # completes successfully, so they stay correct in any completion order.
+        pending = {}
 
+        def collect(futures):
+            for future in futures:
+                podcast_name, file_path, file_hash = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(
+                        f"Error uploading {podcast_name} to Dropbox: {e}")
+                    metrics.count('feeds_upload_failed')
+                    continue
+                metrics.count('feeds_uploaded')
+                logger.info(
+                    f"{podcast_name} uploaded to Dropbox at {file_path}")
+                hashes[file_path] = file_hash
+                self.published.add(podcast_name)
 
+        try:
+            with ThreadPoolExecutor(
+                    max_workers=self.dropbox_workers) as executor:
+                for feed in self.feeds():
+
+                    # Define the file path
+                    file_path = f'{self.dropbox_folder}/{feed.filename}'
+
+                    # Compare the content hash with the old one
+                    file_unchanged = (file_path in hashes and
+                                      hashes[file_path] == feed.hash)
+
+                    # Upload only if the file has changed
+                    if file_unchanged:
+                        logger.debug(
+                            f"{feed.name} unchanged, not uploaded to Dropbox")
+                        self.published.add(feed.name)
+                        metrics.count('feeds_upload_unchanged')
+                        continue
+
+                    # Bound the number of uploads queued in the pool
+                    if len(pending) >= 2 * self.dropbox_workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+
+                    future = executor.submit(self.dropbox_upload, dbx,
+                                             feed.data, file_path)
+                    pending[future] = (feed.name, file_path, feed.hash)
+
+                collect(list(pending))
+        finally:
+            # Save the new hashes, with the uploads which completed before an
+            # error
+            collect(list(pending))
+            self.save_hashes(hashes)
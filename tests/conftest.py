@@ -1,5 +1,15 @@
+import multiprocessing
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
+from omegaconf import OmegaConf
+from podgen import Episode, Media, Podcast
+
+import rrc_rss.config
 
 
 # each test runs on cwd to its temp dir
@@ -12,3 +22,69 @@ def go_to_tmpdir(request):
     # Chdir only for the duration of the test.
     with tmpdir.as_cwd():
         yield
+
+
+def run_in_process(target, *args):
+    """
+    Run `target(*args)` in a new process and return its result, e.g. for a
+    crawl, since the Twisted reactor can only be started once per process
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(target, *args).result()
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    A local HTTP server on a free port, for the stand-ins of the site and
+    of the upload APIs
+    """
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serving(server):
+    """Serve the requests to `server` in a thread until the block exits"""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def hashes_file(monkeypatch, tmpdir):
+    filename = str(tmpdir.join("hashes.pkl"))
+    config = OmegaConf.merge(
+        OmegaConf.create(rrc_rss.config.config_defaults),
+        {"cache": {"file_hashes": filename}},
+    )
+    monkeypatch.setattr(rrc_rss.config, "config", config)
+    return filename
+
+
+def podcast(name, episodes=1):
+    podcast = Podcast(
+        name=name,
+        description="Description",
+        website=f"https://rrc.invalid/{name}",
+        explicit=False,
+    )
+    for number in range(episodes):
+        podcast.add_episode(
+            Episode(
+                title=f"Episode {number}",
+                media=Media(f"https://rrc.invalid/{name}/{number}.mp3", 1),
+            )
+        )
+    return podcast
@@ -1,7 +1,124 @@
-# from rrc_rss.base import NAME
+import json
+import logging.handlers
+import os
 
+import pytest
 
-# def test_base():
-#     assert NAME == "rrc_rss"
+from rrc_rss.replay import SyntheticArchive
+from tests.conftest import run_in_process
 
-# TODO
+
+def crawl_and_read_podcasts(config_file, archive):
+    """
+    Crawl a synthetic archive offline, then return the episode titles of
+    each podcast in the cache
+    """
+    from rrc_rss import cli
+    import rrc_rss.config
+    from rrc_rss.storage import create_storage
+
+    exit_code = cli.main(
+        ["crawl", "-c", config_file], settings={"REPLAY_ARCHIVE": archive}
+    )
+    storage = create_storage(rrc_rss.config.config.cache)
+    storage.open()
+    try:
+        podcasts = {
+            podcast.name: sorted(
+                episode.title for episode in podcast.episode_source()
+            )
+            for podcast in storage.iter_podcasts()
+        }
+    finally:
+        storage.close()
+    return exit_code, podcasts
+
+
+def crawl_and_read_errors(config_file, archive):
+    """
+    Crawl a synthetic archive offline, then return the errors logged
+    """
+    from rrc_rss import cli
+
+    handler = logging.handlers.BufferingHandler(capacity=1000)
+    handler.setLevel(logging.ERROR)
+    logging.getLogger("RRC_RSS").addHandler(handler)
+    cli.main(
+        ["crawl", "-c", config_file], settings={"REPLAY_ARCHIVE": archive}
+    )
+    return [record.getMessage() for record in handler.buffer]
+
+
+@pytest.mark.parametrize("backend", ["pickle", "sqlite"])
+def test_replay_synthetic_archive(tmpdir, backend):
+    archive = SyntheticArchive(shows=3, episodes=5, page_size=2)
+    data = str(tmpdir.join("data"))
+    config_file = str(tmpdir.join("config.yml"))
+    with open(config_file, "w") as f:
+        json.dump(
+            {
+                "shows": {
+                    "showlists": [archive.showlist_url],
+                    "combos": [
+                        {
+                            "name": "Combo",
+                            "urls": [
+                                archive.show_url(0),
+                                # Written differently than on the showlist
+                                archive.show_url(1).rstrip("/"),
+                            ],
+                        }
+                    ],
+                },
+                "upload": {"backends": []},
+                "cache": {
+                    "enabled": True,
+                    "backend": backend,
+                    "file_db": os.path.join(data, "podcasts.db"),
+                    "file_shows": os.path.join(data, "shows.json"),
+                    "file_podcasts": os.path.join(data, "podcasts.pkl"),
+                    "file_seen": os.path.join(data, "seen.bin"),
+                },
+            },
+            f,
+        )
+
+    exit_code, podcasts = run_in_process(
+        crawl_and_read_podcasts, config_file, archive
+    )
+    assert exit_code == 0
+    episodes = [f"Episodul {episode}" for episode in range(5)]
+    assert podcasts["Show 0"] == episodes
+    assert podcasts["Show 1"] == episodes
+    assert podcasts["Show 2"] == episodes
+    assert len(podcasts["Combo"]) == 10
+    assert set(podcasts) == {"Show 0", "Show 1", "Show 2", "Combo"}
+
+
+def test_failed_publish_is_logged_and_the_crawl_ends(tmpdir):
+    archive = SyntheticArchive(shows=1, episodes=2)
+    data = str(tmpdir.join("data"))
+    # Reading the fingerprints fails when the podcasts are published
+    fingerprints = os.path.join(data, "fingerprints.pkl")
+    os.makedirs(fingerprints)
+    config_file = str(tmpdir.join("config.yml"))
+    with open(config_file, "w") as f:
+        json.dump(
+            {
+                "shows": {"showlists": [archive.showlist_url]},
+                "upload": {"backends": []},
+                "cache": {
+                    "enabled": True,
+                    "file_podcasts": os.path.join(data, "podcasts.pkl"),
+                    "file_fingerprints": fingerprints,
+                },
+            },
+            f,
+        )
+
+    errors = run_in_process(crawl_and_read_errors, config_file, archive)
+    assert len(errors) == 1
+    assert errors[0].startswith("Saving and publishing podcasts failed")
+    assert "IsADirectoryError" in errors[0]
+    # The podcasts were saved before publishing failed
+    assert os.path.exists(os.path.join(data, "podcasts.pkl"))
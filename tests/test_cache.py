@@ -0,0 +1,116 @@
+import os
+import pickle
+from types import SimpleNamespace
+
+import pytest
+from omegaconf import OmegaConf
+
+import rrc_rss.config
+from rrc_rss.cache import Journal, atomic_write
+from rrc_rss.pipelines import (
+    CreatePodcastPipeline,
+    EpisodeItem,
+    ShowDescriptionItem,
+)
+from rrc_rss.storage import SeenIndex
+
+
+def test_journal_drops_an_incomplete_last_entry(tmpdir):
+    filename = str(tmpdir.join("journal.pkl"))
+    journal = Journal(filename)
+    for n in range(3):
+        journal.append(("EpisodeItem", {"title": f"Episode {n}"}))
+    journal.close()
+    # The run was killed while writing the last entry
+    with open(filename, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    journal = Journal(filename)
+    assert [fields["title"] for _, fields in journal.replay()] == [
+        "Episode 0",
+        "Episode 1",
+    ]
+    # The next entries follow the last complete one
+    journal.append(("EpisodeItem", {"title": "Episode 3"}))
+    journal.close()
+    assert [fields["title"] for _, fields in journal.replay()] == [
+        "Episode 0",
+        "Episode 1",
+        "Episode 3",
+    ]
+
+
+def test_journal_clear(tmpdir):
+    filename = str(tmpdir.join("journal.pkl"))
+    journal = Journal(filename)
+    journal.append(("EpisodeItem", {"title": "Episode"}))
+    journal.clear()
+    assert not os.path.exists(filename)
+    assert list(journal.replay()) == []
+    # Clearing a journal which was never written is fine
+    Journal(filename).clear()
+
+
+def test_resumed_run_does_not_fetch_the_journaled_episodes(
+    monkeypatch, tmpdir
+):
+    config = OmegaConf.merge(
+        OmegaConf.create(rrc_rss.config.config_defaults),
+        {
+            "cache": {
+                "file_podcasts": str(tmpdir.join("podcasts.pkl")),
+                "file_journal": str(tmpdir.join("journal.pkl")),
+            }
+        },
+    )
+    monkeypatch.setattr(rrc_rss.config, "config", config)
+    url = "https://rrc.invalid/show/episode-1"
+
+    # The first run is killed after the items are journaled, before the
+    # storage is saved
+    spider = SimpleNamespace(do_cache=True, seen=SeenIndex())
+    pipeline = CreatePodcastPipeline()
+    pipeline.open_spider(spider)
+    for item in (
+        ShowDescriptionItem(
+            title="Show",
+            author="Author",
+            program="Program",
+            description="Description",
+            category="Category",
+            website="https://rrc.invalid/show",
+        ),
+        EpisodeItem(
+            show_name="Show",
+            title="Episode 1",
+            date=None,
+            audio_url="https://rrc.invalid/1.mp3",
+            audio_type="audio/mpeg",
+            description="Summary",
+            url=url,
+        ),
+    ):
+        pipeline.process_item(item, spider)
+    pipeline.journal.close()
+    assert not os.path.exists(config.cache.file_podcasts)
+
+    spider = SimpleNamespace(do_cache=True, seen=SeenIndex())
+    pipeline = CreatePodcastPipeline()
+    pipeline.open_spider(spider)
+    assert url in spider.seen
+    assert pipeline.storage.has_episode("Show", "Episode 1")
+
+
+def test_atomic_write_keeps_the_old_file_when_the_write_fails(tmpdir):
+    filename = str(tmpdir.join("data", "hashes.pkl"))
+    with atomic_write(filename) as f:
+        pickle.dump({"old": 1}, f)
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(filename) as f:
+            f.write(b"partial")
+            raise RuntimeError("write failed")
+
+    with open(filename, "rb") as f:
+        assert pickle.load(f) == {"old": 1}
+    assert os.listdir(os.path.dirname(filename)) == ["hashes.pkl"]
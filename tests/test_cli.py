@@ -0,0 +1,95 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from rrc_rss import cli
+
+# Runs a command, then prints the heavy crawl libraries it imported
+IMPORTED_MODULES = """
+import sys
+from rrc_rss.cli import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+heavy = ("scrapy", "twisted")
+print("IMPORTED", *(name for name in heavy if name in sys.modules))
+"""
+
+
+def write_config(tmpdir, **cache):
+    config_file = str(tmpdir.join("config.yml"))
+    with open(config_file, "w") as f:
+        json.dump(
+            {
+                "upload": {"backends": []},
+                "cache": dict(
+                    enabled=True,
+                    file_podcasts=str(tmpdir.join("podcasts.pkl")),
+                    **cache,
+                ),
+            },
+            f,
+        )
+    return config_file
+
+
+def test_cached_shows_and_their_freshness(tmpdir):
+    filename = str(tmpdir.join("shows.json"))
+    assert cli.read_cached_shows(filename) is None
+    assert not cli.shows_are_fresh(filename, 3600)
+
+    with open(filename, "w") as f:
+        for show in range(2):
+            url = f"https://rrc.invalid/emisiuni/show-{show}/"
+            f.write(json.dumps({"url": url, "title": f"Show {show}"}) + "\n")
+    assert cli.read_cached_shows(filename) == [
+        "https://rrc.invalid/emisiuni/show-0/",
+        "https://rrc.invalid/emisiuni/show-1/",
+    ]
+    assert cli.shows_are_fresh(filename, 3600)
+    # Without a time to live, the show list is never fresh
+    assert not cli.shows_are_fresh(filename, 0)
+
+    two_hours_ago = time.time() - 7200
+    os.utime(filename, (two_hours_ago, two_hours_ago))
+    assert not cli.shows_are_fresh(filename, 3600)
+
+
+def test_upload_keeps_the_metrics_of_the_last_crawl(tmpdir):
+    metrics_file = tmpdir.join("metrics.json")
+    prometheus_file = tmpdir.join("rrc_rss.prom")
+    metrics_file.write("crawl metrics")
+    prometheus_file.write("crawl metrics")
+    config_file = write_config(
+        tmpdir,
+        file_metrics=str(metrics_file),
+        file_prometheus=str(prometheus_file),
+    )
+    assert cli.main(["upload", "-c", config_file]) == 0
+    assert cli.main(["render", "-c", config_file]) == 0
+    assert metrics_file.read() == "crawl metrics"
+    assert prometheus_file.read() == "crawl metrics"
+
+
+@pytest.mark.parametrize(
+    "argv", [["--help"], ["check-config"], ["upload"], ["render"]]
+)
+def test_commands_without_crawl_do_not_import_scrapy(tmpdir, argv):
+    if argv != ["--help"]:
+        argv = argv + ["-c", write_config(tmpdir)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORTED_MODULES] + argv,
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    ).stdout
+    assert output.splitlines()[-1] == "IMPORTED"
@@ -0,0 +1,281 @@
+import json
+
+import pytest
+
+from rrc_rss import cli
+from rrc_rss.replay import SyntheticArchive
+from tests.conftest import StubHandler, StubServer, run_in_process, serving
+
+
+class SiteServer(StubServer):
+    """
+    A local stand-in for the site, serving the pages of a SyntheticArchive.
+    The first show page and the showlist have an ETag, changed with the
+    number of episodes and of shows, and are answered with 304 when it
+    matches. The pages of `failing` urls get a `failing_status` error, by
+    default a 503.
+    """
+
+    def __init__(self):
+        super().__init__(SiteHandler)
+        self.archive = SyntheticArchive(
+            shows=1, episodes=3, base_url=self.base_url
+        )
+        self.failing = set()
+        self.failing_status = 503
+        self.requests = []
+
+    @property
+    def etag(self):
+        return f'"show-0-{self.archive.episodes}"'
+
+    def etag_of(self, url):
+        if url == self.archive.show_url(0):
+            return self.etag
+        if url == self.archive.showlist_url:
+            return f'"showlist-{self.archive.shows}"'
+        return None
+
+
+class SiteHandler(StubHandler):
+    def do_GET(self):
+        server = self.server
+        url = server.base_url + self.path
+        etag = server.etag_of(url)
+        page = server.archive.get(url)
+        if url in server.failing:
+            server.requests.append((url, server.failing_status))
+            self.send_error(server.failing_status)
+            return
+        if etag and self.headers.get("If-None-Match") == etag:
+            server.requests.append((url, 304))
+            self.send_response(304)
+            self.end_headers()
+            return
+        if page is None:
+            server.requests.append((url, 404))
+            self.send_error(404)
+            return
+        status, headers, body = page
+        server.requests.append((url, status))
+        self.send_response(status)
+        self.send_header("Content-Type", headers["Content-Type"][0])
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def site():
+    with serving(SiteServer()) as server:
+        yield server
+
+
+def crawl(config_file, settings=None):
+    from rrc_rss import cli
+
+    return cli.main(["crawl", "-c", config_file], settings=settings)
+
+
+@pytest.fixture
+def config_file(site, tmpdir):
+    config_file = str(tmpdir.join("config.yml"))
+    with open(config_file, "w") as f:
+        json.dump(
+            {
+                "shows": {
+                    "showlists": [],
+                    "shows": [site.archive.show_url(0)],
+                },
+                "upload": {"backends": []},
+                "cache": {
+                    "enabled": True,
+                    "file_podcasts": str(tmpdir.join("data", "podcasts.pkl")),
+                    "file_seen": str(tmpdir.join("data", "seen.bin")),
+                    "file_validators": str(
+                        tmpdir.join("data", "validators.json")
+                    ),
+                },
+            },
+            f,
+        )
+    return config_file
+
+
+@pytest.fixture
+def showlist_config(site, tmpdir):
+    """
+    Write a configuration which finds the shows on the showlist, with the
+    show list cache options given as keyword arguments
+    """
+
+    def write(**cache):
+        config_file = str(tmpdir.join("config.yml"))
+        with open(config_file, "w") as f:
+            json.dump(
+                {
+                    "shows": {"showlists": [site.archive.showlist_url]},
+                    "upload": {"backends": []},
+                    "cache": dict(
+                        enabled=True,
+                        file_podcasts=str(tmpdir.join("data", "podcasts.pkl")),
+                        file_seen=str(tmpdir.join("data", "seen.bin")),
+                        file_shows=str(tmpdir.join("data", "shows.json")),
+                        file_validators=str(
+                            tmpdir.join("data", "validators.json")
+                        ),
+                        **cache,
+                    ),
+                },
+                f,
+            )
+        return config_file
+
+    return write
+
+
+def validators(tmpdir):
+    try:
+        with open(str(tmpdir.join("data", "validators.json"))) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def test_failed_episodes_are_retried_on_the_next_run(
+    site, config_file, tmpdir
+):
+    show_url = site.archive.show_url(0)
+
+    # An episode fails, the show page validator is not saved
+    failing_url = site.archive.episode_url(0, 1)
+    site.failing.add(failing_url)
+    run_in_process(crawl, config_file)
+    assert (failing_url, 503) in site.requests
+    assert validators(tmpdir)[show_url] == {"incomplete": True, "attempts": 1}
+
+    # The show page is fetched again, and the failed episode with it
+    site.failing.clear()
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert site.requests == [(show_url, 200), (failing_url, 200)]
+    assert validators(tmpdir)[show_url]["etag"] == site.etag
+
+    # All episodes were parsed, the show page is not modified
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert site.requests == [(show_url, 304)]
+
+
+def test_pages_are_followed_until_an_episode_parsed_before(site, config_file):
+    site.archive.episodes = 10
+    site.archive.page_size = 4
+    run_in_process(crawl, config_file)
+    assert len(site.requests) == 3 + 10
+
+    # The new episodes are all on the first page
+    site.archive.episodes = 13
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert sorted(site.requests) == sorted(
+        [(site.archive.show_url(0), 200)]
+        + [
+            (site.archive.episode_url(0, episode), 200)
+            for episode in (10, 11, 12)
+        ]
+    )
+
+
+def test_failed_episodes_on_further_pages_are_backfilled(site, config_file):
+    site.archive.episodes = 10
+    site.archive.page_size = 4
+    failing_url = site.archive.episode_url(0, 3)
+    site.failing.add(failing_url)
+    run_in_process(crawl, config_file)
+    assert (failing_url, 503) in site.requests
+
+    # All the show pages are followed, to find the failed episode
+    site.failing.clear()
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert sorted(site.requests) == sorted(
+        [(site.archive.show_url(0, page), 200) for page in (1, 2, 3)]
+        + [(failing_url, 200)]
+    )
+
+
+def test_dead_episode_links_are_not_retried(site, config_file, tmpdir):
+    show_url = site.archive.show_url(0)
+    failing_url = site.archive.episode_url(0, 1)
+    site.failing.add(failing_url)
+    site.failing_status = 404
+    run_in_process(crawl, config_file)
+    assert (failing_url, 404) in site.requests
+    assert validators(tmpdir)[show_url]["etag"] == site.etag
+
+    # The show page is not modified, the dead link is not fetched again
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert site.requests == [(show_url, 304)]
+
+
+def test_backfill_stops_after_the_retries(site, config_file, tmpdir):
+    show_url = site.archive.show_url(0)
+    site.failing.add(site.archive.episode_url(0, 1))
+    settings = {"CONDITIONAL_BACKFILL_RETRIES": 1}
+    run_in_process(crawl, config_file, settings)
+    assert validators(tmpdir)[show_url] == {"incomplete": True, "attempts": 1}
+
+    # Still failing on the retry, the show page keeps its validators
+    run_in_process(crawl, config_file, settings)
+    assert validators(tmpdir)[show_url]["etag"] == site.etag
+
+    site.requests.clear()
+    run_in_process(crawl, config_file, settings)
+    assert site.requests == [(show_url, 304)]
+
+
+def test_fresh_show_list_is_not_crawled_again(site, showlist_config):
+    config_file = showlist_config(shows_ttl=3600)
+    run_in_process(crawl, config_file)
+    assert (site.archive.showlist_url, 200) in site.requests
+
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert site.requests == [(site.archive.show_url(0), 304)]
+
+
+def test_not_modified_showlist_sends_the_cached_shows(
+    site, showlist_config, tmpdir
+):
+    # Without a time to live, the show list is crawled on each run
+    config_file = showlist_config()
+    run_in_process(crawl, config_file)
+
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert sorted(site.requests) == sorted(
+        [(site.archive.showlist_url, 304), (site.archive.show_url(0), 304)]
+    )
+    # The shows sent again are written to the show list for the next run
+    shows_file = str(tmpdir.join("data", "shows.json"))
+    assert cli.read_cached_shows(shows_file) == [site.archive.show_url(0)]
+
+
+@pytest.mark.parametrize("refresh", ["showlist", "background"])
+def test_cached_shows_are_crawled_while_the_show_list_is_refreshed(
+    site, showlist_config, refresh
+):
+    config_file = showlist_config(shows_refresh=refresh)
+    run_in_process(crawl, config_file)
+
+    # The showlist is down: only in background mode, the cached shows are
+    # crawled
+    site.failing.add(site.archive.showlist_url)
+    site.requests.clear()
+    run_in_process(crawl, config_file)
+    assert (site.archive.showlist_url, 503) in site.requests
+    crawled = (site.archive.show_url(0), 304) in site.requests
+    assert crawled == (refresh == "background")
@@ -0,0 +1,50 @@
+import pytest
+from omegaconf import OmegaConf
+from scrapy.settings import Settings
+
+from rrc_rss.config import config_defaults, crawl_profile_settings
+
+
+def config(**crawl):
+    return OmegaConf.merge(OmegaConf.create(config_defaults), {"crawl": crawl})
+
+
+def test_crawl_profiles_give_scrapy_settings():
+    settings = Settings(crawl_profile_settings(config(), "fast-backfill"))
+    assert settings.getint("CONCURRENT_REQUESTS") == 32
+    assert settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN") == 16
+    assert settings.getbool("AUTOTHROTTLE_ENABLED")
+    assert settings.getint("RETRY_TIMES") == 5
+    assert 429 in settings.getlist("RETRY_HTTP_CODES")
+
+    settings = Settings(
+        crawl_profile_settings(config(), "nightly-incremental")
+    )
+    assert settings.getint("CONCURRENT_REQUESTS") == 8
+    assert settings.getfloat("DOWNLOAD_DELAY") == 0.25
+    assert settings.getint("RETRY_TIMES") == 2
+
+
+def test_crawl_profile_of_the_configuration():
+    # Without a profile, Scrapy runs with its defaults
+    assert crawl_profile_settings(config()) == {}
+
+    # The profile is selected in the configuration, and its settings can be
+    # changed there
+    settings = crawl_profile_settings(
+        config(
+            profile="nightly-incremental",
+            profiles={"nightly-incremental": {"download_delay": 1}},
+        )
+    )
+    assert settings["DOWNLOAD_DELAY"] == 1
+    assert settings["CONCURRENT_REQUESTS"] == 8
+
+    # A profile given on the command line wins
+    settings = crawl_profile_settings(
+        config(profile="nightly-incremental"), "fast-backfill"
+    )
+    assert settings["CONCURRENT_REQUESTS"] == 32
+
+    with pytest.raises(ValueError):
+        crawl_profile_settings(config(), "slow")
@@ -0,0 +1,75 @@
+import io
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from podgen import Episode, Media, Podcast
+
+from rrc_rss.feed import FeedWriter, newest_first
+
+
+def podcast(episodes=5, xslt=None):
+    podcast = Podcast(
+        name="Texte și pretexte",
+        description="Emisiune de cultură, cu <diacritice> & entități",
+        website="https://rrc.invalid/emisiuni/texte-si-pretexte/",
+        explicit=False,
+        category=None,
+        last_updated=datetime(2024, 3, 1, tzinfo=timezone.utc),
+        xslt=xslt,
+    )
+    start = datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc)
+    for number in range(episodes):
+        podcast.add_episode(
+            Episode(
+                title=f"Episodul {number}: „citate” și <etichete>",
+                summary=f"<p>Descrierea episodului {number}</p>",
+                media=Media(
+                    f"https://rrc.invalid/audio/{number}.mp3", 1000 + number
+                ),
+                publication_date=start + timedelta(days=number),
+                link=f"https://rrc.invalid/episod-{number}/",
+            )
+        )
+    # An episode without a date goes last
+    podcast.add_episode(
+        Episode(
+            title="Episod fără dată",
+            media=Media("https://rrc.invalid/audio/undated.mp3", 1),
+        )
+    )
+    return podcast
+
+
+def streamed(podcast, **kwargs):
+    out = io.BytesIO()
+    FeedWriter(**kwargs).write(podcast, newest_first(podcast.episodes), out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+@pytest.mark.parametrize("xslt", [None, "https://rrc.invalid/feed.xsl"])
+def test_feed_writer_output_is_the_same_as_rss_str(batch_size, xslt):
+    source = podcast(xslt=xslt)
+    expected = podcast(xslt=xslt)
+    expected.episodes = newest_first(expected.episodes)
+    assert (
+        streamed(source, batch_size=batch_size) == expected.rss_str().encode()
+    )
+
+
+def test_feed_writer_max_episodes():
+    source = podcast()
+    expected = podcast()
+    expected.episodes = newest_first(expected.episodes)[:3]
+    assert (
+        streamed(source, max_episodes=3, batch_size=2)
+        == expected.rss_str().encode()
+    )
+
+
+def test_feed_writer_without_episodes():
+    source = podcast(episodes=0)
+    source.episodes = []
+    expected = podcast(episodes=0)
+    expected.episodes = []
+    assert streamed(source) == expected.rss_str().encode()
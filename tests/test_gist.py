@@ -0,0 +1,162 @@
+import itertools
+import json
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from rrc_rss.gist import GistAPIError, GistClient
+from rrc_rss.upload import PodcastsUploader
+from tests.conftest import StubHandler, StubServer, podcast, serving
+
+
+class GistAPIStub(StubServer):
+    """
+    A local stand-in for the GitHub gists API, listing `page_size` gists per
+    page. The calls are recorded as (method, path, file names). The next
+    `drops` calls are answered by closing the connection.
+    """
+
+    def __init__(self, page_size=2):
+        super().__init__(GistAPIHandler)
+        self.api_url = self.base_url
+        self.page_size = page_size
+        self.gist_ids = itertools.count()
+        self.gists = {}
+        self.drops = 0
+        self.calls = []
+
+
+class GistAPIHandler(StubHandler):
+    def do_GET(self):
+        server = self.server
+        server.calls.append(("GET", self.path, None))
+        if server.drops:
+            server.drops -= 1
+            self.close_connection = True
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        ids = sorted(server.gists)
+        start = (page - 1) * server.page_size
+        end = start + server.page_size
+        gists = [
+            {
+                "id": gist_id,
+                "files": {name: {} for name in server.gists[gist_id]},
+            }
+            for gist_id in ids[start:end]
+        ]
+        headers = {}
+        if end < len(ids):
+            next_url = f"{server.api_url}/gists?page={page + 1}"
+            headers["Link"] = f'<{next_url}>; rel="next"'
+        self.reply(gists, headers=headers)
+
+    def do_POST(self):
+        files = self.read_files()
+        gist_id = f"gist{next(self.server.gist_ids)}"
+        self.server.calls.append(("POST", self.path, sorted(files)))
+        self.server.gists[gist_id] = files
+        self.reply({"id": gist_id}, status=201)
+
+    def do_PATCH(self):
+        files = self.read_files()
+        gist_id = self.path.rsplit("/", 1)[-1]
+        self.server.calls.append(("PATCH", self.path, sorted(files)))
+        self.server.gists[gist_id].update(files)
+        self.reply({"id": gist_id})
+
+    def read_files(self):
+        length = int(self.headers["Content-Length"])
+        files = json.loads(self.rfile.read(length))["files"]
+        return {name: file["content"] for name, file in files.items()}
+
+    def reply(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    with serving(GistAPIStub()) as server:
+        yield server
+
+
+def upload(stub, podcasts):
+    uploader = PodcastsUploader(
+        podcasts=podcasts,
+        gist_batch_size=2,
+        gist_client=GistClient("token", api_url=stub.api_url, min_interval=0),
+    )
+    uploader.to_gist()
+    return uploader
+
+
+def writes(stub):
+    return [call for call in stub.calls if call[0] != "GET"]
+
+
+def test_gist_batches_changed_feeds_and_skips_unchanged_ones(
+    stub, hashes_file
+):
+    podcasts = [podcast(f"Show {i}") for i in range(5)]
+    uploader = upload(stub, podcasts)
+    # New feeds are created in gists of up to 2 files
+    assert writes(stub) == [
+        ("POST", "/gists", ["Show-0.xml", "Show-1.xml"]),
+        ("POST", "/gists", ["Show-2.xml", "Show-3.xml"]),
+        ("POST", "/gists", ["Show-4.xml"]),
+    ]
+    assert uploader.published == {p.name for p in podcasts}
+
+    # The 3 gists are listed over 2 pages, and the changed feeds are
+    # updated with one call per gist
+    stub.calls.clear()
+    for i in (0, 1, 2):
+        podcasts[i] = podcast(f"Show {i}", episodes=2)
+    uploader = upload(stub, podcasts)
+    assert [call[1] for call in stub.calls if call[0] == "GET"] == [
+        "/gists?per_page=100",
+        "/gists?page=2",
+    ]
+    assert writes(stub) == [
+        ("PATCH", "/gists/gist0", ["Show-0.xml", "Show-1.xml"]),
+        ("PATCH", "/gists/gist1", ["Show-2.xml"]),
+    ]
+    assert "Episode 1" in stub.gists["gist1"]["Show-2.xml"]
+    assert uploader.published == {p.name for p in podcasts}
+
+    # Nothing changed, nothing is written
+    stub.calls.clear()
+    uploader = upload(stub, podcasts)
+    assert writes(stub) == []
+    assert uploader.published == {p.name for p in podcasts}
+
+
+def test_gist_uploads_again_a_feed_missing_from_the_gists(stub, hashes_file):
+    podcasts = [podcast("Show 0")]
+    upload(stub, podcasts)
+
+    # The hash is unchanged, but the file is not in any gist anymore
+    stub.gists.clear()
+    stub.calls.clear()
+    upload(stub, podcasts)
+    assert writes(stub) == [("POST", "/gists", ["Show-0.xml"])]
+
+
+def test_gist_client_retries_connection_errors(stub):
+    client = GistClient("token", api_url=stub.api_url, backoff=0)
+    stub.drops = 2
+    assert client.list_gists() == []
+    assert len(stub.calls) == 3
+
+    # Once the retries are used up, the error is a GistAPIError
+    stub.drops = 4
+    with pytest.raises(GistAPIError):
+        client.list_gists()
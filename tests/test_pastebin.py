@@ -0,0 +1,154 @@
+import itertools
+from urllib.parse import parse_qs
+
+import pytest
+from omegaconf import OmegaConf
+
+import rrc_rss.config
+from rrc_rss.pastebin import PasteBin, PasteBinError
+from rrc_rss.upload import PodcastsUploader
+from tests.conftest import StubHandler, StubServer, podcast, serving
+
+
+class PasteBinStub(StubServer):
+    """
+    A local stand-in for the PasteBin API. Keys of `rejected_keys` are
+    answered as invalid, and the next `errors` calls get a 503.
+    """
+
+    def __init__(self):
+        super().__init__(PasteBinHandler)
+        self.api_url = f"{self.base_url}/api/"
+        self.user_keys = itertools.count()
+        self.paste_keys = itertools.count()
+        self.rejected_keys = set()
+        self.errors = 0
+        self.pastes = {}
+        self.calls = []
+
+
+class PasteBinHandler(StubHandler):
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers["Content-Length"])
+        params = {
+            key: values[0]
+            for key, values in parse_qs(
+                self.rfile.read(length).decode()
+            ).items()
+        }
+        method = self.path.rsplit("/", 1)[-1]
+        option = params.get("api_option", "login")
+        server.calls.append((method, option))
+        if server.errors:
+            server.errors -= 1
+            self.reply("Service unavailable", 503)
+        elif method == "api_login.php":
+            self.reply(f"user-key-{next(server.user_keys)}")
+        elif params.get("api_user_key") in server.rejected_keys:
+            self.reply("Bad API request, invalid api_user_key")
+        elif option == "paste":
+            key = f"paste{next(server.paste_keys)}"
+            server.pastes[key] = params["api_paste_name"]
+            self.reply(f"https://pastebin.invalid/{key}")
+        elif option == "delete":
+            del server.pastes[params["api_paste_key"]]
+            self.reply("Paste Removed")
+        else:
+            self.reply("Bad API request, invalid api_option")
+
+    def reply(self, text, status=200):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    with serving(PasteBinStub()) as server:
+        yield server
+
+
+@pytest.fixture
+def cache(monkeypatch, tmpdir):
+    config = OmegaConf.merge(
+        OmegaConf.create(rrc_rss.config.config_defaults),
+        {
+            "cache": {
+                "file_hashes": str(tmpdir.join("hashes.pkl")),
+                "file_pastebin": str(tmpdir.join("pastebin.json")),
+            }
+        },
+    )
+    monkeypatch.setattr(rrc_rss.config, "config", config)
+
+
+def upload(stub, podcasts):
+    uploader = PodcastsUploader(
+        podcasts=podcasts,
+        pastebin_api_key="dev-key",
+        pastebin_username="user",
+        pastebin_password="password",
+        pastebin_api_url=stub.api_url,
+    )
+    uploader.to_pastebin()
+    return uploader
+
+
+def test_paste_is_not_retried_once_sent(stub):
+    api = PasteBin("dev-key", "user-key", api_url=stub.api_url, backoff=0)
+    stub.errors = 1
+    with pytest.raises(PasteBinError):
+        api.paste("<rss/>", name="Show")
+    assert stub.calls == [("api_post.php", "paste")]
+
+    # Idempotent calls are retried
+    stub.calls.clear()
+    stub.errors = 1
+    assert api.create_user_key("user", "password") == "user-key-0"
+    assert len(stub.calls) == 2
+
+
+def test_pastebin_skips_unchanged_and_replaces_changed_feeds(stub, cache):
+    podcasts = [podcast("Show 0"), podcast("Show 1")]
+    uploader = upload(stub, podcasts)
+    assert stub.calls == [("api_login.php", "login")] + 2 * [
+        ("api_post.php", "paste")
+    ]
+    assert sorted(stub.pastes.values()) == ["Show 0", "Show 1"]
+    assert uploader.published == {"Show 0", "Show 1"}
+
+    # The user key is cached, only the changed feed gets a new paste,
+    # and its previous paste is deleted
+    stub.calls.clear()
+    podcasts[1] = podcast("Show 1", episodes=2)
+    uploader = upload(stub, podcasts)
+    assert stub.calls == [
+        ("api_post.php", "paste"),
+        ("api_post.php", "delete"),
+    ]
+    assert stub.pastes == {"paste0": "Show 0", "paste2": "Show 1"}
+    assert uploader.published == {"Show 0", "Show 1"}
+
+
+def test_pastebin_logs_in_again_when_the_key_is_rejected(stub, cache):
+    upload(stub, [podcast("Show 0")])
+
+    stub.calls.clear()
+    stub.rejected_keys.add("user-key-0")
+    uploader = upload(stub, [podcast("Show 0", episodes=2)])
+    assert stub.calls == [
+        ("api_post.php", "paste"),
+        ("api_login.php", "login"),
+        ("api_post.php", "paste"),
+        ("api_post.php", "delete"),
+    ]
+    assert uploader.published == {"Show 0"}
+
+    # The new key is cached for the next run
+    stub.calls.clear()
+    upload(stub, [podcast("Show 0", episodes=3)])
+    assert stub.calls[0] == ("api_post.php", "paste")
+    assert ("api_login.php", "login") not in stub.calls
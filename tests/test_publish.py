@@ -0,0 +1,45 @@
+import os
+
+import pytest
+from omegaconf import OmegaConf
+
+import rrc_rss.config
+from rrc_rss.publish import Publisher
+from rrc_rss.storage import PickleStorage
+from rrc_rss.upload import PodcastsUploader
+
+
+@pytest.fixture
+def storage(monkeypatch, tmpdir):
+    config = OmegaConf.merge(
+        OmegaConf.create(rrc_rss.config.config_defaults),
+        {
+            "upload": {"backends": []},
+            "cache": {
+                "file_fingerprints": str(tmpdir.join("fingerprints.pkl"))
+            },
+        },
+    )
+    monkeypatch.setattr(rrc_rss.config, "config", config)
+    for name in ("DROPBOX_ACCESS_TOKEN", "DROPBOX_REFRESH_TOKEN"):
+        monkeypatch.delenv(name, raising=False)
+
+    def not_rendered(self):
+        raise AssertionError("feeds rendered without an upload backend")
+
+    monkeypatch.setattr(PodcastsUploader, "feeds", not_rendered)
+
+    storage = PickleStorage()
+    storage.update_podcast("Show", "Description", "https://rrc.invalid", 0)
+    storage.add_episode(
+        "Show", "Episode", "https://rrc.invalid/1.mp3", None, None, None
+    )
+    return storage
+
+
+@pytest.mark.parametrize("backends", [None, ["dropbox"]])
+def test_publish_without_an_upload_backend(storage, backends):
+    # No backend configured, or none with credentials
+    publisher = Publisher(storage, backends=backends)
+    assert publisher.publish() == set()
+    assert not os.path.exists(rrc_rss.config.config.cache.file_fingerprints)
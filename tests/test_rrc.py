@@ -0,0 +1,52 @@
+from scrapy.http import HtmlResponse, Request
+
+from rrc_rss.rrc import RRCShowSpider
+
+
+def test_shows_are_scheduled_once_by_normalized_url():
+    spider = RRCShowSpider()
+    requests = list(
+        spider.show_requests(
+            [
+                "https://www.rrc.invalid/emisiuni/show/",
+                "https://www.rrc.invalid/emisiuni/show",
+                "http://rrc.invalid/emisiuni/show/",
+            ]
+        )
+    )
+    assert [request.url for request in requests] == [
+        "https://www.rrc.invalid/emisiuni/show/"
+    ]
+
+    # Also for shows added while the spider runs
+    requests = list(
+        spider.show_requests(
+            [
+                "https://www.rrc.invalid/emisiuni/show",
+                "https://www.rrc.invalid/emisiuni/other",
+            ]
+        )
+    )
+    assert [request.url for request in requests] == [
+        "https://www.rrc.invalid/emisiuni/other"
+    ]
+
+
+def test_episode_without_date_gets_an_aware_date():
+    url = "https://www.rrc.invalid/emisiuni/show/episod-1"
+    show_page = "https://www.rrc.invalid/emisiuni/show/"
+    spider = RRCShowSpider()
+    spider.pending[show_page] = 1
+    response = HtmlResponse(
+        url,
+        body=(
+            '<html><body><article class="articol"><h1>Episodul 1</h1>'
+            '<audio><source src="https://www.rrc.invalid/1.mp3" '
+            'type="audio/mpeg"></audio>'
+            '<div id="__content"><p>Text</p></div></article></body></html>'
+        ),
+        encoding="utf-8",
+        request=Request(url, meta={"show_page": show_page}),
+    )
+    (item,) = spider.parse_episode(response, "Show")
+    assert item["date"].tzinfo is not None
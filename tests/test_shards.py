@@ -0,0 +1,44 @@
+import json
+import pickle
+
+from rrc_rss.pipelines import EpisodeItem
+from rrc_rss.shards import merge_validators, read_items
+
+
+def test_read_items_drops_an_incomplete_tail(tmpdir):
+    filename = str(tmpdir.join("items-0.pkl"))
+    with open(filename, "wb") as f:
+        for n in range(3):
+            fields = {"show_name": "Show", "title": f"Episode {n}"}
+            pickle.dump(("EpisodeItem", fields), f)
+    # The shard was killed while writing the last item
+    with open(filename, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    items = list(read_items(filename))
+    assert [item["title"] for item in items] == ["Episode 0", "Episode 1"]
+    assert all(isinstance(item, EpisodeItem) for item in items)
+
+
+def test_read_items_of_a_missing_file(tmpdir):
+    assert list(read_items(str(tmpdir.join("missing.pkl")))) == []
+
+
+def test_merge_validators_keeps_the_changes_of_each_shard(tmpdir):
+    def write(name, validators):
+        filename = str(tmpdir.join(name))
+        with open(filename, "w") as f:
+            json.dump(validators, f)
+        return filename
+
+    filename = write(
+        "validators.json", {"a": {"etag": "1"}, "b": {"etag": "1"}}
+    )
+    shards = [
+        write("validators-0.json", {"a": {"etag": "2"}, "b": {"etag": "1"}}),
+        write("validators-1.json", {"a": {"etag": "1"}}),
+        str(tmpdir.join("validators-2.json")),
+    ]
+    merge_validators(filename, shards)
+    with open(filename) as f:
+        assert json.load(f) == {"a": {"etag": "2"}}
@@ -0,0 +1,190 @@
+import os
+import pickle
+from array import array
+from datetime import datetime, timezone
+
+import pytest
+from podgen import Episode, Media, Podcast
+
+from rrc_rss.storage import (
+    ComboEpisode,
+    PickleStorage,
+    SeenIndex,
+    SQLiteStorage,
+)
+from rrc_rss.upload import RenderedFeed
+
+
+@pytest.fixture(params=["pickle", "sqlite"])
+def storage(request, tmpdir):
+    if request.param == "pickle":
+        storage = PickleStorage(str(tmpdir.join("podcasts.pkl")))
+    else:
+        storage = SQLiteStorage(str(tmpdir.join("cache", "podcasts.db")))
+    storage.open()
+    yield storage
+    storage.close()
+
+
+def test_update_podcast_applies_metadata_changes(storage):
+    storage.update_podcast("Show", "Description", "https://rrc.invalid/a", 0)
+    storage.add_episode(
+        "Show",
+        "Episode",
+        "https://rrc.invalid/1.mp3",
+        "audio/mpeg",
+        "Summary",
+        datetime(2024, 1, 1, tzinfo=timezone.utc),
+    )
+    fingerprint = storage.fingerprint("Show")
+    storage.dirty.clear()
+
+    storage.update_podcast("Show", "Description", "https://rrc.invalid/a", 0)
+    assert storage.dirty == set()
+
+    storage.update_podcast("Show", "New", "https://rrc.invalid/b", 0)
+    assert storage.dirty == {"Show"}
+    assert storage.website("Show") == "https://rrc.invalid/b"
+    assert storage.fingerprint("Show") != fingerprint
+    (podcast,) = storage.iter_podcasts(["Show"])
+    assert podcast.description == "New"
+
+
+def test_has_episode_by_title_or_audio_url(storage):
+    storage.update_podcast("Show", "Description", "https://rrc.invalid", 0)
+    storage.add_episode(
+        "Show", "Episode", "https://rrc.invalid/1.mp3", None, None, None
+    )
+    assert storage.has_episode("Show", "Episode")
+    assert storage.has_episode("Show", "Other", "https://rrc.invalid/1.mp3")
+    assert not storage.has_episode("Show", "Other", "https://rrc.invalid/2")
+
+
+def test_naive_dates_are_stored_as_utc(storage):
+    storage.update_podcast("Show", "Description", "https://rrc.invalid", 0)
+    storage.update_podcast("Combo", "Combo podcast", "[]", 0)
+    for title, date in [
+        ("Naive", datetime(2024, 1, 1, 10)),
+        ("Aware", datetime(2024, 1, 2, tzinfo=timezone.utc)),
+    ]:
+        audio_url = f"https://rrc.invalid/{title}.mp3"
+        storage.add_episode(
+            "Show", title, audio_url, "audio/mpeg", "Summary", date
+        )
+        storage.add_combo_episode(
+            "Combo", "Show", title, audio_url, "audio/mpeg", "Summary", date
+        )
+    storage.save()
+
+    for podcast in storage.iter_podcasts():
+        RenderedFeed(podcast)
+        for episode in podcast.episode_source():
+            assert episode.publication_date.tzinfo is not None
+
+
+def test_convert_a_cache_file_of_podgen_podcasts(tmpdir):
+    # The cache file of older versions: podgen Podcasts, with the episodes
+    # of the shows copied in the combos, their titles prefixed by the show
+    def podcast(name, category, episodes):
+        podcast = Podcast(
+            name=name,
+            description="Description",
+            website=f"https://rrc.invalid/{name}",
+            explicit=False,
+        )
+        podcast.show_category = category
+        for title, audio_url, day in episodes:
+            podcast.add_episode(
+                Episode(
+                    title=title,
+                    media=Media(audio_url, type="audio/mpeg"),
+                    summary="Summary",
+                    publication_date=datetime(
+                        2024, 1, day, tzinfo=timezone.utc
+                    ),
+                )
+            )
+        return podcast
+
+    shows = {
+        "Show": [("Episode", "https://rrc.invalid/1.mp3", 1)],
+        "Jazz: Live": [("Set: One", "https://rrc.invalid/2.mp3", 2)],
+    }
+    podcasts = {
+        name: podcast(name, "Music", episodes)
+        for name, episodes in shows.items()
+    }
+    podcasts["Combo"] = podcast(
+        "Combo",
+        "Combo",
+        [
+            ("Show: Episode", "https://rrc.invalid/1.mp3", 1),
+            ("Jazz: Live: Set: One", "https://rrc.invalid/2.mp3", 2),
+            # Not in its show anymore
+            ("Show: Old", "https://rrc.invalid/0.mp3", 3),
+        ],
+    )
+    filename = str(tmpdir.join("podcasts.pkl"))
+    with open(filename, "wb") as f:
+        pickle.dump(podcasts, f)
+
+    storage = PickleStorage(filename)
+    storage.open()
+    assert sorted(storage.names()) == ["Combo", "Jazz: Live", "Show"]
+    combo = storage.podcasts["Combo"]
+    assert [
+        (episode.title, episode.audio_url, episode.date)
+        for episode in combo.episodes
+    ] == [
+        (title, audio_url, datetime(2024, 1, day, tzinfo=timezone.utc))
+        for title, audio_url, day in [
+            ("Show: Episode", "https://rrc.invalid/1.mp3", 1),
+            ("Jazz: Live: Set: One", "https://rrc.invalid/2.mp3", 2),
+            ("Show: Old", "https://rrc.invalid/0.mp3", 3),
+        ]
+    ]
+    # The combo episodes share the records of the show episodes
+    first, second, old = combo.episodes
+    assert isinstance(first, ComboEpisode)
+    assert first.record is storage.podcasts["Show"].episodes[0]
+    assert isinstance(second, ComboEpisode)
+    assert second.show_name == "Jazz: Live"
+    assert second.record is storage.podcasts["Jazz: Live"].episodes[0]
+    assert not isinstance(old, ComboEpisode)
+
+
+def test_seen_index_round_trip(tmpdir):
+    filename = str(tmpdir.join("data", "seen.bin"))
+    urls = [f"https://rrc.invalid/show/episode-{n}" for n in range(3)]
+    seen = SeenIndex(filename)
+    seen.load()
+    assert len(seen) == 0
+    for url in urls:
+        seen.add(url)
+    seen.add(urls[0])
+    seen.save()
+
+    # The file is the array of the 64-bit digests of the urls
+    with open(filename, "rb") as f:
+        keys = array("Q", f.read())
+    assert sorted(keys) == sorted(SeenIndex.key(url) for url in urls)
+
+    seen = SeenIndex(filename)
+    seen.load()
+    assert len(seen) == 3
+    assert all(url in seen for url in urls)
+    assert "https://rrc.invalid/show/episode-3" not in seen
+
+    # Unchanged, the index is not written again
+    os.remove(filename)
+    seen.update(SeenIndex())
+    seen.save()
+    assert not os.path.exists(filename)
+
+
+def test_seen_index_without_a_file():
+    seen = SeenIndex()
+    seen.load()
+    seen.add("https://rrc.invalid/show/episode-0")
+    seen.save()
+    assert "https://rrc.invalid/show/episode-0" in seen
@@ -0,0 +1,136 @@
+import pickle
+from datetime import datetime, timezone
+
+import pytest
+
+from rrc_rss.storage import PickleStorage
+from rrc_rss.upload import PodcastsUploader, RenderedFeed
+from tests.conftest import podcast
+
+
+class FakeDropbox:
+    """
+    Records the uploaded files, and raises the exceptions of `errors` for
+    the files of these paths
+    """
+
+    def __init__(self, errors=None):
+        self.files = {}
+        self.calls = []
+        self.errors = errors or {}
+
+    def files_upload(self, data, path, mode=None):
+        self.calls.append(path)
+        if path in self.errors:
+            raise self.errors[path]
+        self.files[path] = data
+
+
+def upload(podcasts, client, workers=1):
+    uploader = PodcastsUploader(
+        podcasts=podcasts,
+        dropbox_client=client,
+        dropbox_folder="/feeds",
+        dropbox_workers=workers,
+        dropbox_retries=0,
+    )
+    uploader.to_dropbox()
+    return uploader
+
+
+def load_hashes(filename):
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_dropbox_skips_unchanged_feeds(hashes_file, workers):
+    client = FakeDropbox()
+    podcasts = [podcast(f"Show {i}") for i in range(6)]
+    uploader = upload(podcasts, client, workers)
+    assert len(client.calls) == 6
+    assert uploader.published == {p.name for p in podcasts}
+
+    # Only the changed feed is uploaded again
+    client.calls.clear()
+    podcasts[2] = podcast("Show 2", episodes=2)
+    uploader = upload(podcasts, client, workers)
+    assert client.calls == ["/feeds/Show-2.xml"]
+    assert uploader.published == {p.name for p in podcasts}
+    assert set(load_hashes(hashes_file)) == set(client.files)
+
+
+def test_dropbox_keeps_hashes_of_uploads_before_an_error(hashes_file):
+    client = FakeDropbox(
+        errors={
+            "/feeds/Show-1.xml": ValueError("upload failed"),
+            "/feeds/Show-2.xml": KeyboardInterrupt(),
+        }
+    )
+    podcasts = [podcast(f"Show {i}") for i in range(3)]
+    with pytest.raises(KeyboardInterrupt):
+        upload(podcasts, client)
+    assert set(load_hashes(hashes_file)) == {"/feeds/Show-0.xml"}
+
+    # The next run only uploads the feeds which were not uploaded
+    client = FakeDropbox()
+    upload(podcasts, client)
+    assert client.calls == ["/feeds/Show-1.xml", "/feeds/Show-2.xml"]
+
+
+def test_feeds_skip_podcasts_which_fail_to_render():
+    def broken_episodes():
+        raise TypeError("can't compare offset-naive and offset-aware")
+
+    broken = podcast("Show 1")
+    broken.episode_source = broken_episodes
+    uploader = PodcastsUploader(
+        podcasts=[podcast("Show 0"), broken, podcast("Show 2")]
+    )
+    assert [feed.name for feed in uploader.feeds()] == ["Show 0", "Show 2"]
+
+
+def test_parallel_rendering_gives_the_same_feeds():
+    # Podcasts of a storage, whose episodes are loaded when rendered
+    storage = PickleStorage()
+    for show in range(5):
+        name = f"Show {show}"
+        storage.update_podcast(name, "Description", "https://rrc.invalid", 0)
+        for number in range(3):
+            storage.add_episode(
+                name,
+                f"Episode {number}",
+                f"https://rrc.invalid/{show}/{number}.mp3",
+                "audio/mpeg",
+                "Summary",
+                datetime(2024, 1, number + 1, tzinfo=timezone.utc),
+            )
+
+    def hashes(render_workers):
+        uploader = PodcastsUploader(
+            podcasts=storage.iter_podcasts(), render_workers=render_workers
+        )
+        return [(feed.name, feed.hash) for feed in uploader.feeds()]
+
+    sequential = hashes(1)
+    assert len(sequential) == 5
+    assert hashes(2) == sequential
+
+
+def test_content_hash_leaves_out_the_build_date():
+    def rendered(last_updated, title="Episode 1"):
+        show = podcast("Show", episodes=2)
+        show.last_updated = last_updated
+        show.episodes[1].title = title
+        return RenderedFeed(show)
+
+    feed = rendered(datetime(2024, 1, 1, tzinfo=timezone.utc))
+    rebuilt = rendered(datetime(2024, 1, 2, tzinfo=timezone.utc))
+    assert b"<lastBuildDate>" in feed.data
+    assert rebuilt.data != feed.data
+    assert rebuilt.hash == feed.hash
+
+    changed = rendered(
+        datetime(2024, 1, 1, tzinfo=timezone.utc), title="Changed"
+    )
+    assert changed.hash != feed.hash